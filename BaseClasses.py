@@ -5,6 +5,7 @@ import functools
 import logging
 import random
 import secrets
+import time
 import warnings
 from argparse import Namespace
 from collections import Counter, deque, defaultdict
@@ -18,6 +19,7 @@ from typing_extensions import NotRequired, TypedDict
 
 import NetUtils
 import Options
+import Profiling
 import Utils
 
 if TYPE_CHECKING:
@@ -68,6 +70,23 @@ class PlandoItemBlock:
     count: dict[str, int] = dataclasses.field(default_factory=dict)
 
 
+@dataclasses.dataclass
+class SphereTrace:
+    """
+    The logical spheres of a filled multiworld, computed once by MultiWorld.get_sphere_trace and shared by the
+    accessibility check, the beatable check and Spoiler.create_playthrough.
+    """
+    spheres: list[set[Location]]
+    """each sphere holds the locations that can be reached with the advancement items of all previous spheres"""
+    states: list[CollectionState]
+    """if requested, a copy of the state after collecting each sphere"""
+    unreachable: set[Location]
+    """locations that could not be reached at all"""
+    state: CollectionState
+    """the state after collecting all reachable advancement items"""
+    beatable: bool
+
+
 class MultiWorld():
     debug_types = False
     player_name: Dict[int, str]
@@ -589,15 +608,13 @@ class MultiWorld():
         locations is followed by an empty set, and then a set of all of the
         unreachable locations.
         """
+        from worlds.generic.Rules import RuleBatch
         state = CollectionState(self)
         locations = set(self.get_filled_locations())
+        rule_batch = RuleBatch(locations)
 
         while locations:
-            sphere: Set[Location] = set()
-
-            for location in locations:
-                if location.can_reach(state):
-                    sphere.add(location)
+            sphere: Set[Location] = set(rule_batch.reachable(state, locations))
             yield sphere
             if not sphere:
                 if locations:
@@ -615,6 +632,7 @@ class MultiWorld():
         If there are unreachable locations, the last sphere of reachable locations is followed by an empty set,
         and then a set of all of the unreachable locations.
         """
+        from worlds.generic.Rules import RuleBatch
         state = CollectionState(self)
         locations: Set[Location] = set()
         events: Set[Location] = set()
@@ -623,10 +641,9 @@ class MultiWorld():
                 locations.add(location)
             else:
                 events.add(location)
+        rule_batch = RuleBatch(locations)
 
         while locations:
-            sphere: Set[Location] = set()
-
             # cull events out
             done_events: Set[Union[Location, None]] = {None}
             while done_events:
@@ -637,9 +654,7 @@ class MultiWorld():
                         done_events.add(event)
                 events -= done_events
 
-            for location in locations:
-                if location.can_reach(state):
-                    sphere.add(location)
+            sphere: Set[Location] = set(rule_batch.reachable(state, locations))
 
             yield sphere
             if not sphere:
@@ -651,8 +666,39 @@ class MultiWorld():
                 state.collect(location.item, True, location)
             locations -= sphere
 
-    def fulfills_accessibility(self, state: Optional[CollectionState] = None):
-        """Check if accessibility rules are fulfilled with current or supplied state."""
+    def get_sphere_trace(self, keep_states: bool = False) -> SphereTrace:
+        """
+        Computes the spheres of all locations, collecting the advancement items of each sphere before the next.
+
+        :param keep_states: keep a copy of the state after each sphere, as needed by Spoiler.create_playthrough
+        """
+        from worlds.generic.Rules import RuleBatch
+        state = CollectionState(self)
+        locations = set(self.get_locations())
+        rule_batch = RuleBatch(locations)
+        spheres: List[Set[Location]] = []
+        states: List[CollectionState] = []
+
+        while locations:
+            sphere = set(rule_batch.reachable(state, locations))
+            if not sphere:
+                break
+            for location in sphere:
+                if location.advancement:
+                    state.collect(location.item, True, location)
+            locations -= sphere
+            spheres.append(sphere)
+            if keep_states:
+                states.append(state.copy())
+
+        return SphereTrace(spheres, states, locations, state, self.has_beaten_game(state))
+
+    def fulfills_accessibility(self, state: Optional[CollectionState] = None,
+                               sphere_trace: Optional[SphereTrace] = None):
+        """
+        Check if accessibility rules are fulfilled with current or supplied state.
+        If a sphere_trace is supplied, it is used instead of sweeping through the multiworld again.
+        """
         if not state:
             state = CollectionState(self)
         players: Dict[str, Set[int]] = {
@@ -682,13 +728,30 @@ class MultiWorld():
                 return False  # still locations required to be collected
             return True
 
+        if sphere_trace:
+            locations = [location for location in sphere_trace.unreachable if location_relevant(location)]
+            beatable_fulfilled = sphere_trace.beatable
+            if all_done():
+                return True
+            if locations:
+                if __debug__:
+                    from Fill import FillError
+                    raise FillError(
+                        f"Could not access required locations for accessibility check. Missing: {locations}",
+                        multiworld=self,
+                    )
+                logging.warning(f"Could not access required locations for accessibility check."
+                                f" Missing: {locations}")
+            return False
+
+        from worlds.generic.Rules import RuleBatch
         locations = [location for location in self.get_locations() if location_relevant(location)]
+        rule_batch = RuleBatch(locations)
 
         while locations:
-            sphere: List[Location] = []
-            for n in range(len(locations) - 1, -1, -1):
-                if locations[n].can_reach(state):
-                    sphere.append(locations.pop(n))
+            reachable = set(rule_batch.reachable(state, locations))
+            sphere: List[Location] = [location for location in reversed(locations) if location in reachable]
+            locations[:] = [location for location in locations if location not in reachable]
 
             if not sphere:
                 if __debug__:
@@ -727,6 +790,14 @@ class CollectionState():
     path: Dict[Union[Region, Entrance], PathValue]
     locations_checked: Set[Location]
     stale: Dict[int, bool]
+    pending_items: Dict[int, Set[str]]
+    """names of the Items collected per player since that player's reachable regions were last updated"""
+    _shared_items: Set[int]
+    """players whose prog_items and pending_items are shared with another copy of this state and need to be copied
+    before they are written to"""
+    _shared_regions: Set[int]
+    """players whose reachable_regions and blocked_connections are shared with another copy of this state and need to
+    be copied before they are written to"""
     allow_partial_entrances: bool
     additional_init_functions: List[Callable[[CollectionState, MultiWorld], None]] = []
     additional_copy_functions: List[Callable[[CollectionState, CollectionState], CollectionState]] = []
@@ -741,6 +812,9 @@ class CollectionState():
         self.path = {}
         self.locations_checked = set()
         self.stale = {player: True for player in parent.get_all_ids()}
+        self.pending_items = {player: set() for player in parent.get_all_ids()}
+        self._shared_items = set()
+        self._shared_regions = set()
         self.allow_partial_entrances = allow_partial_entrances
         for function in self.additional_init_functions:
             function(self, parent)
@@ -751,8 +825,14 @@ class CollectionState():
     def update_reachable_regions(self, player: int):
         self.stale[player] = False
         world: AutoWorld.World = self.multiworld.worlds[player]
+        self._own_regions(player)
         reachable_regions = self.reachable_regions[player]
-        queue = deque(self.blocked_connections[player])
+        if world.incremental_reachability and world.explicit_indirect_conditions:
+            queue = deque(self._get_affected_connections(player))
+        else:
+            queue = deque(self.blocked_connections[player])
+        # replaced instead of cleared, as the set may be shared with a copy of this state
+        self.pending_items[player] = set()
         start: Region = world.get_region(world.origin_region_name)
 
         # init on first call - this can't be done on construction since the regions don't exist yet
@@ -766,6 +846,21 @@ class CollectionState():
         else:
             self._update_reachable_regions_auto_indirect_conditions(player, queue)
 
+    def _get_affected_connections(self, player: int) -> List[Entrance]:
+        """
+        Returns the blocked connections of a player that could have become passable since the last update, in the same
+        order as a full recheck would visit them, so the resulting regions and paths are identical.
+
+        A connection is skipped if it declares `item_dependencies`, none of those were collected since the last update,
+        and it is not waiting on a connected region or on being cleaned up. Indirect conditions are handled by the BFS.
+        """
+        reachable_regions = self.reachable_regions[player]
+        pending_items = self.pending_items[player]
+        return [connection for connection in self.blocked_connections[player]
+                if connection.item_dependencies is None
+                or not connection.item_dependencies.isdisjoint(pending_items)
+                or connection.connected_region is None or connection.connected_region in reachable_regions]
+
     def _update_reachable_regions_explicit_indirect_conditions(self, player: int, queue: deque):
         reachable_regions = self.reachable_regions[player]
         blocked_connections = self.blocked_connections[player]
@@ -815,16 +910,54 @@ class CollectionState():
             # sweep for indirect connections, mostly Entrance.can_reach(unrelated_Region)
             queue.extend(blocked_connections)
 
+    def _own_items(self, player: int) -> None:
+        """Gives this state its own copy of a player's prog_items and pending_items, if they are currently shared."""
+        if player in self._shared_items:
+            self._shared_items.remove(player)
+            self.prog_items[player] = self.prog_items[player].copy()
+            self.pending_items[player] = self.pending_items[player].copy()
+
+    def own_prog_items(self, player: int) -> Counter[str]:
+        """
+        Returns the prog_items of a player to write to, which are copied first if they are shared with another state.
+        Access rules that cache values in prog_items, like counts derived from the reachable regions, have to use this.
+        """
+        self._own_items(player)
+        return self.prog_items[player]
+
+    def _own_regions(self, player: int) -> None:
+        """
+        Gives this state its own copy of a player's reachable_regions and blocked_connections, if they are currently
+        shared.
+        """
+        if player in self._shared_regions:
+            self._shared_regions.remove(player)
+            self.reachable_regions[player] = self.reachable_regions[player].copy()
+            self.blocked_connections[player] = self.blocked_connections[player].copy()
+
     def copy(self) -> CollectionState:
+        """
+        Returns a copy of this state.
+
+        The per-player prog_items, reachable_regions and blocked_connections are shared between both states until either
+        of them changes that player, so copying is cheap even if there are many players.
+        Because of this, prog_items should only be modified through collect, remove, add_item, remove_item, set_item,
+        own_prog_items, or from inside World.collect and World.remove, and the sets of reachable_regions and
+        blocked_connections should be replaced instead of modified.
+        """
         ret = CollectionState(self.multiworld)
-        ret.prog_items = {player: counter.copy() for player, counter in self.prog_items.items()}
-        ret.reachable_regions = {player: region_set.copy() for player, region_set in
-                                 self.reachable_regions.items()}
-        ret.blocked_connections = {player: entrance_set.copy() for player, entrance_set in
-                                   self.blocked_connections.items()}
+        ret.prog_items = self.prog_items.copy()
+        ret.reachable_regions = self.reachable_regions.copy()
+        ret.blocked_connections = self.blocked_connections.copy()
         ret.advancements = self.advancements.copy()
         ret.path = self.path.copy()
         ret.locations_checked = self.locations_checked.copy()
+        ret.stale = self.stale.copy()
+        ret.pending_items = self.pending_items.copy()
+        self._shared_items = set(self.prog_items)
+        self._shared_regions = set(self.reachable_regions)
+        ret._shared_items = self._shared_items.copy()
+        ret._shared_regions = self._shared_regions.copy()
         ret.allow_partial_entrances = self.allow_partial_entrances
         for function in self.additional_copy_functions:
             ret = function(self, ret)
@@ -873,6 +1006,11 @@ class CollectionState():
         # under this assumption, an extra sweep iteration is performed that checks every player, to confirm that the
         # sweep is finished.
         checking_if_finished = False
+        # The number of collected items that changed the state, and its value when each player was last checked, so
+        # players that were already checked in the current state don't need to be checked again to confirm the sweep
+        # is finished.
+        changes = 0
+        checked_at: Dict[int, int] = {}
         while players_to_check:
             next_advancements_per_player: List[Tuple[int, List[Location]]] = []
             next_players_to_check = set()
@@ -886,6 +1024,7 @@ class CollectionState():
                 # stale whenever one of their own items is collected into the state.
                 reachable_locations: List[Location] = []
                 unreachable_locations: List[Location] = []
+                checked_at[player] = changes
                 for location in locations:
                     if location.can_reach(self):
                         # Locations containing items that do not belong to `player` could be collected immediately
@@ -917,13 +1056,16 @@ class CollectionState():
                         # The player the item belongs to may be able to reach additional locations in the next sweep
                         # iteration.
                         next_players_to_check.add(item.player)
+                        changes += 1
 
             if not next_players_to_check:
                 if not checking_if_finished:
                     # It is assumed that each player's world only logically depends on itself, which may not be the
-                    # case, so confirm that the sweep is finished by doing an extra iteration that checks every player.
+                    # case, so confirm that the sweep is finished by doing an extra iteration that checks every player
+                    # who has not been checked since the state last changed.
                     checking_if_finished = True
-                    next_players_to_check = all_players
+                    next_players_to_check = {player for player, _ in next_advancements_per_player
+                                             if checked_at.get(player) != changes}
             else:
                 checking_if_finished = False
 
@@ -954,6 +1096,7 @@ class CollectionState():
         :param checked_locations: Optional override of locations to filter out from the locations argument, defaults to
         self.advancements when None.
         """
+        Profiling.count("sweeps")
         if checked_locations is None:
             checked_locations = self.advancements
 
@@ -1113,9 +1256,11 @@ class CollectionState():
         if location:
             self.locations_checked.add(location)
 
+        self._own_items(item.player)
         changed = self.multiworld.worlds[item.player].collect(self, item)
 
         self.stale[item.player] = True
+        self.pending_items[item.player].add(item.name)
 
         if changed and not prevent_sweep:
             self.sweep_for_advancements()
@@ -1131,14 +1276,17 @@ class CollectionState():
         :param count: How many of the item to add.
         """
         assert count > 0
+        self._own_items(player)
         self.prog_items[player][item] += count
 
     def remove(self, item: Item):
+        self._own_items(item.player)
         changed = self.multiworld.worlds[item.player].remove(self, item)
         if changed:
             # invalidate caches, nothing can be trusted anymore now
             self.reachable_regions[item.player] = set()
             self.blocked_connections[item.player] = set()
+            self._shared_regions.discard(item.player)
             self.stale[item.player] = True
 
     def remove_item(self, item: str, player: int, count: int = 1) -> None:
@@ -1150,6 +1298,7 @@ class CollectionState():
         :param count: How many of the item to remove.
         """
         assert count > 0
+        self._own_items(player)
         self.prog_items[player][item] -= count
         if self.prog_items[player][item] < 1:
             del (self.prog_items[player][item])
@@ -1163,6 +1312,7 @@ class CollectionState():
         :param count: How many of the item to now have.
         """
         assert count >= 0
+        self._own_items(player)
         if count == 0:
             del (self.prog_items[player][item])
         else:
@@ -1181,6 +1331,10 @@ class Entrance:
     name: str
     parent_region: Optional[Region]
     connected_region: Optional[Region] = None
+    item_dependencies: Optional[AbstractSet[str]] = None
+    """Names of the Items of this player whose collection can change the result of access_rule.
+    None means unknown, which re-evaluates the Entrance whenever its player's reachability is updated.
+    Only used by worlds with incremental_reachability, see worlds.generic.Rules.set_item_dependencies."""
     randomization_group: int
     randomization_type: EntranceType
 
@@ -1689,30 +1843,44 @@ class Spoiler:
             self.entrances[(entrance, direction, player)] = \
                 {"player": player, "entrance": entrance, "exit": exit_, "direction": direction}
 
-    def create_playthrough(self, create_paths: bool = True) -> None:
-        """Destructive to the multiworld while it is run, damage gets repaired afterwards."""
+    def create_playthrough(self, create_paths: bool = True, sphere_trace: Optional[SphereTrace] = None) -> None:
+        """
+        Destructive to the multiworld while it is run, damage gets repaired afterwards.
+        If a sphere_trace with states is supplied, its spheres are used instead of calculating them again.
+        """
         from itertools import chain
+        from worlds.generic.Rules import RuleBatch
         # get locations containing progress items
         multiworld = self.multiworld
         prog_locations = {location for location in multiworld.get_filled_locations() if location.item.advancement}
+        rule_batch = RuleBatch(prog_locations)
         state_cache: List[Optional[CollectionState]] = [None]
         collection_spheres: List[Set[Location]] = []
         state = CollectionState(multiworld)
         sphere_candidates = set(prog_locations)
+        if sphere_trace and sphere_trace.states:
+            # the trace already holds these spheres, including the states after each of them
+            traced_spheres = iter(zip(sphere_trace.spheres, sphere_trace.states))
+            state = sphere_trace.state
         logging.debug('Building up collection spheres.')
         while sphere_candidates:
 
             # build up spheres of collection radius.
             # Everything in each sphere is independent from each other in dependencies and only depends on lower spheres
 
-            sphere = {location for location in sphere_candidates if state.can_reach(location)}
+            if sphere_trace and sphere_trace.states:
+                traced_sphere, traced_state = next(traced_spheres, (set(), state))
+                sphere = traced_sphere & sphere_candidates
+                state_cache.append(traced_state)
+            else:
+                sphere = set(rule_batch.reachable(state, sphere_candidates))
 
-            for location in sphere:
-                state.collect(location.item, True, location)
+                for location in sphere:
+                    state.collect(location.item, True, location)
+                state_cache.append(state.copy())
 
             sphere_candidates -= sphere
             collection_spheres.append(sphere)
-            state_cache.append(state.copy())
 
             logging.debug('Calculated sphere %i, containing %i of %i progress items.', len(collection_spheres),
                           len(sphere),
@@ -1732,21 +1900,20 @@ class Spoiler:
         # in the second phase, we cull each sphere such that the game is still beatable,
         # reducing each range of influence to the bare minimum required inside it
         required_locations = {location for sphere in collection_spheres for location in sphere}
+        cull_start = time.perf_counter()
+        total_checks = 0
         for num, sphere in reversed(tuple(enumerate(collection_spheres))):
-            to_delete: Set[Location] = set()
-            for location in sphere:
-                # we remove the location from required_locations to sweep from, and check if the game is still beatable
-                logging.debug('Checking if %s (Player %d) is required to beat the game.', location.item.name,
-                              location.item.player)
-                required_locations.remove(location)
-                if multiworld.can_beat_game(state_cache[num], required_locations):
-                    to_delete.add(location)
-                else:
-                    # still required, got to keep it around
-                    required_locations.add(location)
+            sphere_size = len(sphere)
+            to_delete, checks = self._cull_sphere(state_cache[num], list(sphere), required_locations)
+            total_checks += checks
 
             # cull entries in spheres for spoiler walkthrough at end
             sphere -= to_delete
+            logging.debug('Culled sphere %i down to %i of %i progress items with %i checks.', num + 1, len(sphere),
+                          sphere_size, checks)
+        logging.info('Culled playthrough down to %i of %i progress items with %i checks in %.2f seconds.',
+                     len(required_locations), len(prog_locations) - len(self.unreachables), total_checks,
+                     time.perf_counter() - cull_start)
 
         # second phase, sphere 0
         removed_precollected: List[Item] = []
@@ -1776,7 +1943,7 @@ class Spoiler:
         state = CollectionState(multiworld)
         collection_spheres = []
         while required_locations:
-            sphere = set(filter(state.can_reach, required_locations))
+            sphere = set(rule_batch.reachable(state, required_locations))
 
             for location in sphere:
                 state.collect(location.item, True, location)
@@ -1805,6 +1972,45 @@ class Spoiler:
         for item in removed_precollected:
             multiworld.push_precollected(item)
 
+    def _cull_sphere(self, state: CollectionState, sphere: List[Location],
+                     required_locations: Set[Location]) -> Tuple[Set[Location], int]:
+        """
+        Removes the locations of a sphere that are not required to beat the game from required_locations.
+        The result is the same as checking each location in order, but if the game can be beaten without a block of
+        locations, it can be beaten without any of them, so the blocks grow while they can be removed and get split
+        up again when they can not.
+        Returns the removed locations and the amount of beatable checks used.
+        """
+        multiworld = self.multiworld
+        to_delete: Set[Location] = set()
+        checks = 0
+
+        def cull(block: List[Location], known_required: bool = False) -> bool:
+            nonlocal checks
+            if not known_required:
+                logging.debug('Checking if the items at %s are required to beat the game.', block)
+                # we remove the block from required_locations to sweep from, and check if the game is still beatable
+                required_locations.difference_update(block)
+                checks += 1
+                if multiworld.can_beat_game(state, required_locations):
+                    to_delete.update(block)
+                    return True
+                # still required, got to keep it around
+                required_locations.update(block)
+            if len(block) > 1:
+                half = len(block) // 2
+                # if the first half could be removed, something in the second half has to be required
+                cull(block[half:], cull(block[:half]))
+            return False
+
+        index = 0
+        block_size = 1
+        while index < len(sphere):
+            block = sphere[index:index + block_size]
+            index += len(block)
+            block_size = block_size * 2 if cull(block) else 1
+        return to_delete, checks
+
     def create_paths(self, state: CollectionState, collection_spheres: List[Set[Location]]) -> None:
         from itertools import zip_longest
         multiworld = self.multiworld
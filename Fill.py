@@ -4,11 +4,12 @@ import logging
 import typing
 from collections import Counter, deque
 
+import Profiling
 from BaseClasses import CollectionState, Item, Location, LocationProgressType, MultiWorld, PlandoItemBlock
 from Options import Accessibility
 
 from worlds.AutoWorld import call_all
-from worlds.generic.Rules import add_item_rule
+from worlds.generic.Rules import RuleBatch, add_item_rule
 
 
 class FillError(RuntimeError):
@@ -24,6 +25,19 @@ def _log_fill_progress(name: str, placed: int, total_items: int) -> None:
     logging.info(f"Current fill step ({name}) at {placed}/{total_items} items placed.")
 
 
+def _next_index(skips: typing.List[int], index: int) -> int:
+    """
+    Returns the first index at or after `index` that has not been skipped, where skipped indices point to the next
+    index to try. Visited pointers are shortened to the result, so repeated lookups stay cheap.
+    """
+    root = index
+    while skips[root] != root:
+        root = skips[root]
+    while skips[index] != root:
+        skips[index], index = root, skips[index]
+    return root
+
+
 def sweep_from_pool(base_state: CollectionState, itempool: typing.Sequence[Item] = tuple(),
                     locations: typing.Optional[typing.List[Location]] = None) -> CollectionState:
     new_state = base_state.copy()
@@ -33,6 +47,7 @@ def sweep_from_pool(base_state: CollectionState, itempool: typing.Sequence[Item]
     return new_state
 
 
+@Profiling.spanned("fill", label="name")
 def fill_restrictive(multiworld: MultiWorld, base_state: CollectionState, locations: typing.List[Location],
                      item_pool: typing.List[Item], single_player_placement: bool = False, lock: bool = False,
                      swap: bool = True, on_place: typing.Optional[typing.Callable[[Location], None]] = None,
@@ -59,11 +74,21 @@ def fill_restrictive(multiworld: MultiWorld, base_state: CollectionState, locati
     for item in item_pool:
         reachable_items.setdefault(item.player, deque()).append(item)
 
+    # Instead of popping filled locations out of `locations` and rescanning locations that are already known to be
+    # unreachable in the current `maximum_exploration_state`, their indices are skipped. The first location in list
+    # order that can be filled is still picked, so the placements are the same as checking every location in order.
+    all_locations = locations.copy()
+    # Locations whose reachability doesn't depend on the item being placed, so it can be cached for each state.
+    cacheable_reachability = [type(location).can_fill is Location.can_fill
+                              and location.always_allow is Location.always_allow for location in all_locations]
+    unfilled_indices = list(range(len(all_locations) + 1))
+    remaining_locations = len(all_locations)
+
     # for progress logging
     total = min(len(item_pool), len(locations))
     placed = 0
 
-    while any(reachable_items.values()) and locations:
+    while any(reachable_items.values()) and remaining_locations:
         if one_item_per_player:
             # grab one item per player
             items_to_place = [items.pop()
@@ -87,10 +112,12 @@ def fill_restrictive(multiworld: MultiWorld, base_state: CollectionState, locati
             if single_player_placement else None)
 
         has_beaten_game = multiworld.has_beaten_game(maximum_exploration_state)
+        reachable_indices: typing.Optional[typing.List[int]] = None
+        known_reachability: typing.Dict[Location, bool] = {}
 
         while items_to_place:
             # if we have run out of locations to fill,break out of this loop
-            if not locations:
+            if not remaining_locations:
                 unplaced_items += items_to_place
                 break
             item_to_place = items_to_place.pop(0)
@@ -105,13 +132,35 @@ def fill_restrictive(multiworld: MultiWorld, base_state: CollectionState, locati
             else:
                 perform_access_check = True
 
-            for i, location in enumerate(locations):
-                if (not single_player_placement or location.player == item_to_place.player) \
-                        and location.can_fill(maximum_exploration_state, item_to_place, perform_access_check):
-                    # popping by index is faster than removing by content,
-                    spot_to_fill = locations.pop(i)
-                    # skipping a scan for the element
-                    break
+            if perform_access_check:
+                if reachable_indices is None:
+                    reachable_indices = unfilled_indices.copy()
+                candidate_indices = reachable_indices
+            else:
+                candidate_indices = unfilled_indices
+            index = _next_index(candidate_indices, 0)
+            while index < len(all_locations):
+                location = all_locations[index]
+                if not single_player_placement or location.player == item_to_place.player:
+                    if perform_access_check and cacheable_reachability[index]:
+                        reachable = known_reachability.get(location)
+                        if reachable is None:
+                            reachable = known_reachability[location] = location.can_reach(maximum_exploration_state)
+                        if not reachable:
+                            candidate_indices[index] = index + 1
+                            index = _next_index(candidate_indices, index + 1)
+                            continue
+                        can_fill = location.can_fill(maximum_exploration_state, item_to_place, False)
+                    else:
+                        can_fill = location.can_fill(maximum_exploration_state, item_to_place, perform_access_check)
+                    if can_fill:
+                        spot_to_fill = location
+                        unfilled_indices[index] = index + 1
+                        if reachable_indices is not None:
+                            reachable_indices[index] = index + 1
+                        remaining_locations -= 1
+                        break
+                index = _next_index(candidate_indices, index + 1)
 
             else:
                 # we filled all reachable spots.
@@ -176,6 +225,7 @@ def fill_restrictive(multiworld: MultiWorld, base_state: CollectionState, locati
 
                             swap_count += 1
                             swapped_items[placed_item.player, placed_item.name, unsafe] = swap_count
+                            Profiling.count("swaps")
 
                             reachable_items[placed_item.player].appendleft(
                                 placed_item)
@@ -209,6 +259,8 @@ def fill_restrictive(multiworld: MultiWorld, base_state: CollectionState, locati
     if total > 1000:
         _log_fill_progress(name, placed, total)
 
+    locations[:] = [location for index, location in enumerate(all_locations) if unfilled_indices[index] == index]
+
     if cleanup_required:
         # validate all placements and remove invalid ones
         state = sweep_from_pool(
@@ -254,6 +306,7 @@ def fill_restrictive(multiworld: MultiWorld, base_state: CollectionState, locati
     item_pool.extend(unplaced_items)
 
 
+@Profiling.spanned("fill", label="name")
 def remaining_fill(multiworld: MultiWorld,
                    locations: typing.List[Location],
                    itempool: typing.List[Item],
@@ -309,6 +362,7 @@ def remaining_fill(multiworld: MultiWorld,
 
                     swapped_items[placed_item.player,
                                   placed_item.name] += 1
+                    Profiling.count("swaps")
 
                     itempool.append(placed_item)
 
@@ -485,6 +539,7 @@ def distribute_early_items(multiworld: MultiWorld,
     return fill_locations, itempool
 
 
+@Profiling.spanned("fill")
 def distribute_items_restrictive(multiworld: MultiWorld,
                                  panic_method: typing.Literal["swap", "raise", "start_inventory"] = "swap") -> None:
     assert all(item.location is None for item in multiworld.itempool), (
@@ -669,6 +724,7 @@ def distribute_items_restrictive(multiworld: MultiWorld,
             )
 
 
+@Profiling.spanned("fill")
 def flood_items(multiworld: MultiWorld) -> None:
     # get items to distribute
     multiworld.random.shuffle(multiworld.itempool)
@@ -730,6 +786,47 @@ def flood_items(multiworld: MultiWorld) -> None:
                 break
 
 
+def find_balancing_replacements(candidates: typing.Sequence[Location],
+                                is_balanced: typing.Callable[[typing.List[Location], int], bool]
+                                ) -> typing.List[Location]:
+    """
+    Tests the candidates from last to first and returns the ones that have to be replaced, in that order.
+    A candidate gets replaced if `is_balanced` fails with the candidates replaced before it and the given number of
+    candidates from the start, which are the ones left to test, moved ahead of the current sphere.
+    Collecting more never makes a player less balanced, so once a prefix of the candidates is balanced, every test that
+    keeps that prefix is answered without calling `is_balanced`, which lets a binary search answer most tests at once.
+    """
+    candidates = list(candidates)
+    replaced: typing.List[Location] = []
+    if not is_balanced(replaced, len(candidates)):
+        # not even all candidates together balance the player, so every test would replace
+        return candidates[::-1]
+    # the prefix that is known to be unbalanced is only valid until another candidate gets replaced
+    balanced_prefix = len(candidates) + 1
+    unbalanced_prefix = -1
+    while candidates:
+        testing = candidates.pop()
+        remaining = len(candidates)
+        if unbalanced_prefix < remaining < balanced_prefix:
+            if is_balanced(replaced, remaining):
+                low, high = unbalanced_prefix + 1, remaining
+                while low < high:
+                    middle = (low + high) // 2
+                    if is_balanced(replaced, middle):
+                        high = middle
+                    else:
+                        low = middle + 1
+                balanced_prefix = low
+                unbalanced_prefix = low - 1
+            else:
+                unbalanced_prefix = remaining
+        if remaining < balanced_prefix:
+            replaced.append(testing)
+            unbalanced_prefix = -1
+    return replaced
+
+
+@Profiling.spanned("balancing")
 def balance_multiworld_progression(multiworld: MultiWorld) -> None:
     # A system to reduce situations where players have no checks remaining, popularly known as "BK mode."
     # Overall progression balancing algorithm:
@@ -768,10 +865,48 @@ def balance_multiworld_progression(multiworld: MultiWorld) -> None:
         }
         sphere_num: int = 1
         moved_item_count: int = 0
+        rule_batch = RuleBatch(unchecked_locations)
+        # Spheres found while looking for candidates come next for the main state as well, as long as no items get
+        # moved, so they are kept to skip finding them again.
+        upcoming_spheres: typing.List[typing.Set[Location]] = []
 
         def get_sphere_locations(sphere_state: CollectionState,
                                  locations: typing.Set[Location]) -> typing.Set[Location]:
-            return {loc for loc in locations if sphere_state.can_reach(loc)}
+            return set(rule_batch.reachable(sphere_state, locations))
+
+        def find_replacements(player: int, candidates: typing.List[Location], locations: typing.Set[Location],
+                              goal_beaten: bool) -> typing.List[Location]:
+            """
+            Returns the candidates that have to be replaced, for a player that no longer reaches their threshold, or
+            no longer beats the game if it already was beaten, without them.
+            A test sweeps from the state of an unbalanced earlier test whose items are all part of the new one, which
+            holds for longer prefixes since replaced candidates only ever get added.
+            """
+            # swept state of the largest known unbalanced test, and the prefix and replaced count it was made with
+            base_state, base_prefix, base_replaced = state, 0, 0
+
+            def is_balanced(replaced: typing.List[Location], prefix: int) -> bool:
+                nonlocal base_state, base_prefix, base_replaced
+                if prefix >= base_prefix:
+                    reducing_state = base_state.copy()
+                    collected = itertools.chain(replaced[base_replaced:], candidates[base_prefix:prefix])
+                else:
+                    reducing_state = state.copy()
+                    collected = itertools.chain(replaced, candidates[:prefix])
+                for location in collected:
+                    reducing_state.collect(location.item, True, location)
+                reducing_state.sweep_for_advancements(locations=locations)
+                if goal_beaten:
+                    balanced = multiworld.has_beaten_game(reducing_state)
+                else:
+                    reduced_sphere = get_sphere_locations(reducing_state, locations)
+                    p = item_percentage(player, reachable_locations_count[player] + len(reduced_sphere))
+                    balanced = p >= threshold_percentages[player]
+                if not balanced:
+                    base_state, base_prefix, base_replaced = reducing_state, prefix, len(replaced)
+                return balanced
+
+            return find_balancing_replacements(candidates, is_balanced)
 
         def item_percentage(player: int, num: int) -> float:
             return num / total_locations_count[player]
@@ -781,10 +916,14 @@ def balance_multiworld_progression(multiworld: MultiWorld) -> None:
             return
 
         while True:
+            Profiling.count("progression balancing rounds")
             # Gather non-locked locations.
             # This ensures that only shuffled locations get counted for progression balancing,
             #   i.e. the items the players will be checking.
-            sphere_locations = get_sphere_locations(state, unchecked_locations)
+            if upcoming_spheres:
+                sphere_locations = upcoming_spheres.pop(0)
+            else:
+                sphere_locations = get_sphere_locations(state, unchecked_locations)
             for location in sphere_locations:
                 unchecked_locations.remove(location)
                 if not location.locked:
@@ -819,6 +958,7 @@ def balance_multiworld_progression(multiworld: MultiWorld) -> None:
                     balancing_reachables = reachable_locations_count.copy()
                     balancing_sphere = sphere_locations.copy()
                     candidate_items: typing.Dict[int, typing.Set[Location]] = collections.defaultdict(set)
+                    balancing_sphere_num = 0
                     while True:
                         # Check locations in the current sphere and gather progression items to swap earlier
                         for location in balancing_sphere:
@@ -832,7 +972,12 @@ def balance_multiworld_progression(multiworld: MultiWorld) -> None:
                                         location.progress_type != LocationProgressType.PRIORITY):
                                     candidate_items[player].add(location)
                                     logging.debug(f"Candidate item: {location.name}, {location.item.name}")
-                        balancing_sphere = get_sphere_locations(balancing_state, balancing_unchecked_locations)
+                        if balancing_sphere_num < len(upcoming_spheres):
+                            balancing_sphere = upcoming_spheres[balancing_sphere_num]
+                        else:
+                            balancing_sphere = get_sphere_locations(balancing_state, balancing_unchecked_locations)
+                            upcoming_spheres.append(balancing_sphere)
+                        balancing_sphere_num += 1
                         for location in balancing_sphere:
                             balancing_unchecked_locations.remove(location)
                             if not location.locked:
@@ -855,25 +1000,9 @@ def balance_multiworld_progression(multiworld: MultiWorld) -> None:
                         items_to_test = list(candidate_items[player])
                         items_to_test.sort()
                         multiworld.random.shuffle(items_to_test)
-                        while items_to_test:
-                            testing = items_to_test.pop()
-                            reducing_state = state.copy()
-                            for location in itertools.chain((
-                                    l for l in items_to_replace
-                                    if l.item.player == player
-                            ), items_to_test):
-                                reducing_state.collect(location.item, True, location)
-
-                            reducing_state.sweep_for_advancements(locations=locations_to_test)
-
-                            if multiworld.has_beaten_game(balancing_state):
-                                if not multiworld.has_beaten_game(reducing_state):
-                                    items_to_replace.append(testing)
-                            else:
-                                reduced_sphere = get_sphere_locations(reducing_state, locations_to_test)
-                                p = item_percentage(player, reachable_locations_count[player] + len(reduced_sphere))
-                                if p < threshold_percentages[player]:
-                                    items_to_replace.append(testing)
+                        goal_beaten = multiworld.has_beaten_game(balancing_state)
+                        items_to_replace.extend(find_replacements(player, items_to_test, locations_to_test,
+                                                                  goal_beaten))
 
                     old_moved_item_count = moved_item_count
 
@@ -895,12 +1024,14 @@ def balance_multiworld_progression(multiworld: MultiWorld) -> None:
                                 logging.debug(f"Progression balancing moved {new_location.item} to {new_location}, "
                                               f"displacing {old_location.item} into {old_location}")
                                 moved_item_count += 1
+                                Profiling.count("progression balancing moves")
                                 state.collect(new_location.item, True, new_location)
                                 break
                         else:
                             logging.warning(f"Could not Progression Balance {old_location.item}")
 
                     if old_moved_item_count < moved_item_count:
+                        upcoming_spheres.clear()
                         logging.debug(f"Moved {moved_item_count} items so far\n")
                         unlocked = {fresh for player in balancing_players for fresh in unlocked_locations[player]}
                         for location in get_sphere_locations(state, unlocked):
@@ -1088,6 +1219,7 @@ def resolve_early_locations_for_planned(multiworld: MultiWorld):
             multiworld.plando_item_blocks[player].remove(block)
 
 
+@Profiling.spanned("fill")
 def distribute_planned_blocks(multiworld: MultiWorld, plando_blocks: list[PlandoItemBlock]):
     def warn(warning: str, force: bool | str) -> None:
         if isinstance(force, bool):
@@ -57,6 +57,10 @@ def mystery_argparse(argv: list[str] | None = None):
     parser.add_argument("--spoiler_only", action="store_true",
                         help="Skips generation assertion and multidata, outputting only a spoiler log. "
                              "Intended for debugging and testing purposes.")
+    parser.add_argument("--profile_report", "--profile-report", metavar="PATH",
+                        help="Writes wall time, CPU time and memory change of every generation stage and player, "
+                             "fill step and output task to a Chrome trace event JSON file, which flame graph viewers "
+                             "can open. Slows down generation.")
     args = parser.parse_args(argv)
 
     if args.skip_output and args.spoiler_only:
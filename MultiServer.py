@@ -2,20 +2,26 @@ from __future__ import annotations
 
 import argparse
 import asyncio
+import bisect
 import collections
 import contextlib
 import copy
 import datetime
 import functools
 import hashlib
+import hmac
 import inspect
 import itertools
 import logging
 import math
+import multiprocessing
 import operator
+import os
 import pickle
 import random
+import secrets
 import shlex
+import struct
 import threading
 import time
 import typing
@@ -27,7 +33,6 @@ import ModuleUpdate
 ModuleUpdate.update()
 
 if typing.TYPE_CHECKING:
-    import ssl
     from NetUtils import ServerConnection
 
 import colorama
@@ -39,11 +44,12 @@ try:
 except ImportError:
     OperationalError = ConnectionError
 
+import MultiServerWorker
 import NetUtils
 import Utils
 from Utils import version_tuple, restricted_loads, Version, async_start, get_intended_text
 from NetUtils import Endpoint, ClientStatus, NetworkItem, decode, encode, NetworkPlayer, Permission, NetworkSlot, \
-    SlotType, LocationStore, MultiData, Hint, HintStatus
+    SlotType, LocationStore, MultiData, Hint, HintStatus, Outbox, load_server_cert, splice_encoded
 from BaseClasses import ItemClassification
 
 
@@ -101,7 +107,7 @@ def queue_gc():
 
 
 # functions callable on storable data on the server by clients
-modify_functions = {
+modify_functions: typing.Dict[str, typing.Callable[[typing.Any, typing.Any], typing.Any]] = {
     # generic:
     "replace": lambda old, new: new,
     "default": lambda old, new: old,
@@ -133,6 +139,323 @@ def get_saving_second(seed_name: str, interval: int = 60) -> int:
     return int(hashlib.sha256(seed_name.encode()).hexdigest(), 16) % interval
 
 
+SaveChange = typing.Tuple[str, str, typing.Any, typing.Any]
+""" operation ("set", "extend", "delete" or "replace"), section of the save, key within the section and value """
+
+save_journal_magic = b"APSJ"
+""" start of a .apsave that is a journal, saves without it are a single compressed pickle """
+_save_record_header = struct.Struct("<I")
+
+
+class SaveJournal:
+    """
+    Finds what changed in a save since it was last written, so that most saves only have to append those changes.
+    Received items and checks only ever get added to, so only the length of what was written is kept of them.
+    Keys of stored_data get marked when they are set instead of being compared, and everything else is compared to a
+    copy of what was last written.
+    """
+    appended_sections: typing.ClassVar[typing.FrozenSet[str]] = frozenset({"received_items"})
+    grown_sections: typing.ClassVar[typing.FrozenSet[str]] = frozenset({"location_checks"})
+    marked_sections: typing.ClassVar[typing.FrozenSet[str]] = frozenset({"stored_data"})
+    paired_sections: typing.ClassVar[typing.FrozenSet[str]] = frozenset({"client_activity_timers",
+                                                                         "client_connection_timers"})
+
+    written: typing.Optional[typing.Dict[str, typing.Any]]
+    """ what is known of every section as it was last written, None if the next save has to be written in full """
+    marked: typing.DefaultDict[str, typing.Set[typing.Any]]
+    snapshot_size: int
+    changes_size: int
+
+    def __init__(self) -> None:
+        self.written = None
+        self.marked = collections.defaultdict(set)
+        self.snapshot_size = 0
+        self.changes_size = 0
+
+    @property
+    def needs_snapshot(self) -> bool:
+        """Whether the next save should be written in full, because nothing was written yet or because the changes
+        written since the last full save have grown larger than it."""
+        return self.written is None or self.changes_size > self.snapshot_size
+
+    def mark(self, section: str, key: typing.Any) -> None:
+        self.marked[section].add(key)
+
+    def invalidate(self) -> None:
+        """Forget what was written, for when writing failed."""
+        self.written = None
+
+    def wrote(self, size: int, snapshot: bool = False) -> None:
+        if snapshot:
+            self.snapshot_size = size
+            self.changes_size = 0
+        else:
+            self.changes_size += size
+
+    def take_snapshot(self, save: typing.Dict[str, typing.Any]) -> None:
+        """Records all of save as written."""
+        self.marked = collections.defaultdict(set)
+        self.written = {}
+        self.take_changes(save)
+
+    def take_changes(self, save: typing.Dict[str, typing.Any]) -> typing.List[SaveChange]:
+        """Returns the changes of save since the last write and records them as written."""
+        assert self.written is not None, "Changes can only be taken after a snapshot."
+        changes: typing.List[SaveChange] = []
+        marked, self.marked = self.marked, collections.defaultdict(set)
+        for section, value in save.items():
+            if section in self.marked_sections and section in self.written:
+                for key in marked[section]:
+                    if key in value:
+                        changes.append(("set", section, key, value[key]))
+                    else:
+                        changes.append(("delete", section, key, None))
+                continue
+            if section in self.paired_sections:
+                value = dict(value)
+            if not isinstance(value, dict):
+                if section not in self.written or value != self.written[section]:
+                    changes.append(("replace", section, None, value))
+                    self.written[section] = copy.deepcopy(value)
+                continue
+
+            written: typing.Dict[typing.Any, typing.Any] = self.written.setdefault(section, {})
+            for key, item in value.items():
+                if section in self.appended_sections:
+                    length = written.get(key, 0)
+                    if len(item) > length:
+                        changes.append(("extend", section, key, item[length:]))
+                        written[key] = len(item)
+                elif section in self.grown_sections:
+                    if len(item) != written.get(key):
+                        changes.append(("set", section, key, item))
+                        written[key] = len(item)
+                elif section not in self.marked_sections and (key not in written or item != written[key]):
+                    changes.append(("set", section, key, item))
+                    written[key] = copy.copy(item)
+            for key in written.keys() - value.keys():
+                changes.append(("delete", section, key, None))
+                del written[key]
+        return changes
+
+
+def apply_save_changes(save: typing.Dict[str, typing.Any], changes: typing.Iterable[SaveChange]) -> None:
+    """Replays changes taken by a SaveJournal onto the save they were taken from."""
+    for operation, section, key, value in changes:
+        if operation == "replace":
+            save[section] = value
+            continue
+        target = save.get(section)
+        if target is None or section in SaveJournal.paired_sections:
+            target = save[section] = dict(target or ())
+        if operation == "set":
+            target[key] = value
+        elif operation == "extend":
+            target.setdefault(key, []).extend(value)
+        elif operation == "delete":
+            target.pop(key, None)
+        else:
+            raise ValueError(f"Unknown save change {operation}.")
+    for section in SaveJournal.paired_sections:
+        if isinstance(save.get(section), dict):
+            save[section] = tuple(save[section].items())
+
+
+def write_save_record(file: typing.BinaryIO, record: typing.Any) -> int:
+    """Appends a full save or a list of changes to a journal and returns the written size."""
+    # Does not use Utils.restricted_dumps because we'd rather make a save than not make one
+    data = zlib.compress(pickle.dumps(record))
+    file.write(_save_record_header.pack(len(data)))
+    file.write(data)
+    return _save_record_header.size + len(data)
+
+
+def load_save(data: bytes, logger: logging.Logger = logging.getLogger()) -> typing.Dict[str, typing.Any]:
+    """Reads a .apsave, replaying the changes of a journal onto the full save it starts with."""
+    if not data.startswith(save_journal_magic):
+        return restricted_loads(zlib.decompress(data))
+    records: typing.List[bytes] = []
+    position = len(save_journal_magic)
+    while position + _save_record_header.size <= len(data):
+        size, = _save_record_header.unpack_from(data, position)
+        position += _save_record_header.size
+        if position + size > len(data):
+            break
+        records.append(data[position:position + size])
+        position += size
+    if not records:
+        raise ValueError("Save journal does not contain a save.")
+    if position != len(data):
+        # the server stopped while appending, everything before that is intact
+        logger.warning("Ignoring the incomplete last change of the save journal.")
+    save = restricted_loads(zlib.decompress(records[0]))
+    for record in records[1:]:
+        apply_save_changes(save, restricted_loads(zlib.decompress(record)))
+    return save
+
+
+class DataStorage:
+    """
+    The data storage of a room, written by Set and read by Get and SetNotify.
+    Besides the values it keeps the pickled size of them for the size limits of the room, a sorted index of the keys
+    for lookups by prefix and the clients to notify of changes, either with the new value or with the operations that
+    were applied to it. Sizes are only measured when they are asked for, so that a room without limits does not
+    pickle a value on every change.
+    """
+    values: typing.Dict[str, typing.Any]
+    _sizes: typing.Dict[str, int]
+    """ pickled size of the values that did not change since they were last measured """
+    _sizes_total: int
+    notified: typing.Dict[bool, typing.DefaultDict[str, weakref.WeakSet[Client]]]
+    """ clients to notify by key, for SetReply with the full value (False) or with the operations instead (True) """
+    prefix_notified: typing.Dict[bool, typing.DefaultDict[str, weakref.WeakSet[Client]]]
+    """ the same by prefix of keys """
+    _sorted_keys: typing.List[str]
+
+    def __init__(self, values: typing.Optional[typing.Dict[str, typing.Any]] = None) -> None:
+        self.notified = {deltas: collections.defaultdict(weakref.WeakSet) for deltas in (False, True)}
+        self.prefix_notified = {deltas: collections.defaultdict(weakref.WeakSet) for deltas in (False, True)}
+        self.load({} if values is None else values)
+
+    def load(self, values: typing.Dict[str, typing.Any]) -> None:
+        """Replaces all values, keeping who gets notified."""
+        self.values = values
+        self._sizes = {}
+        self._sizes_total = 0
+        self._sorted_keys = sorted(values)
+
+    @staticmethod
+    def size_of(value: typing.Any) -> int:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def set(self, key: str, value: typing.Any, size: typing.Optional[int] = None) -> None:
+        """Stores value at key. size is its pickled size, if it was already measured."""
+        if key not in self.values:
+            bisect.insort(self._sorted_keys, key)
+        self.values[key] = value
+        self._sizes_total -= self._sizes.pop(key, 0)
+        if size is not None:
+            self._sizes[key] = size
+            self._sizes_total += size
+
+    def size(self, key: str) -> int:
+        """Pickled size of the value at key, 0 if there is none."""
+        size = self._sizes.get(key)
+        if size is None:
+            if key not in self.values:
+                return 0
+            size = self._sizes[key] = self.size_of(self.values[key])
+            self._sizes_total += size
+        return size
+
+    @property
+    def total_size(self) -> int:
+        """Pickled size of all values."""
+        if len(self._sizes) != len(self.values):
+            for key in self.values.keys() - self._sizes.keys():
+                self.size(key)
+        return self._sizes_total
+
+    def exceeds_limits(self, key: str, size: int, key_limit: int, total_limit: int) -> bool:
+        """Whether storing a value of that size at key would go over the limits, where 0 means no limit."""
+        return bool(key_limit and size > key_limit or
+                    total_limit and self.total_size - self.size(key) + size > total_limit)
+
+    def keys_with_prefix(self, prefix: str) -> typing.List[str]:
+        if len(self._sorted_keys) != len(self.values):
+            # values were added without going through set
+            self._sorted_keys = sorted(self.values)
+        start = bisect.bisect_left(self._sorted_keys, prefix)
+        end = start
+        while end < len(self._sorted_keys) and self._sorted_keys[end].startswith(prefix):
+            end += 1
+        return self._sorted_keys[start:end]
+
+    def notify(self, client: Client, keys: typing.Iterable[str], prefixes: typing.Iterable[str],
+               deltas: bool = False) -> None:
+        for key in keys:
+            self.notified[deltas][key].add(client)
+        for prefix in prefixes:
+            self.prefix_notified[deltas][prefix].add(client)
+
+    def notified_clients(self, key: str) -> typing.Tuple[typing.Set[Client], typing.Set[Client]]:
+        """Clients to notify of a change to key, as the ones that want the value and the ones that want deltas."""
+        clients: typing.Tuple[typing.Set[Client], typing.Set[Client]] = (set(), set())
+        for deltas in (False, True):
+            clients[deltas].update(self.notified[deltas].get(key, ()))
+            by_prefix = self.prefix_notified[deltas]
+            if by_prefix:
+                for end in range(len(key) + 1):
+                    clients[deltas].update(by_prefix.get(key[:end], ()))
+        clients[True].difference_update(clients[False])
+        return clients
+
+
+class EncodedPayloads:
+    """
+    Encoded parts of messages that are the same for many clients, like data packages, slot_data and the players of a
+    room. Messages splice them in with NetUtils.splice_encoded instead of encoding them for every client.
+    Each part is kept with the version of the data it was encoded from and gets encoded again once that changes.
+    """
+    _parts: typing.Dict[typing.Hashable, typing.Tuple[typing.Hashable, str]]
+
+    def __init__(self, dumper: typing.Callable[[typing.Any], str]) -> None:
+        self.dumper = dumper
+        self._parts = {}
+
+    def get(self, key: typing.Hashable, version: typing.Hashable, value: typing.Callable[[], typing.Any]) -> str:
+        part = self._parts.get(key)
+        if part is None or part[0] != version:
+            part = self._parts[key] = version, self.dumper(value())
+        return part[1]
+
+    def clear(self) -> None:
+        self._parts.clear()
+
+
+class ServerMetrics:
+    """
+    Counters and timings of a room, which write_metrics writes out together with the current state of the room for
+    MultiServer's --metrics_file and the room hosters of WebHost.
+    """
+    commands = frozenset({"Connect", "ConnectUpdate", "Sync", "LocationChecks", "LocationScouts", "CreateHints",
+                          "UpdateHint", "StatusUpdate", "Say", "GetDataPackage", "Bounce", "Get", "Set", "SetNotify"})
+    packets: typing.Counter[str]
+    """ packets received by cmd, with any cmd the server does not know counted as "unknown" """
+    timings: typing.Dict[str, typing.List[float]]
+    """ how often and how many seconds in total: decode, encode, register_location_checks and save, which is recorded
+    by the thread that saves, so read them through get_timings """
+
+    def __init__(self) -> None:
+        self.packets = collections.Counter()
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def count_packet(self, cmd: str) -> None:
+        self.packets[cmd if cmd in self.commands else "unknown"] += 1
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            timing = self.timings.get(name)
+            if timing:
+                timing[0] += 1
+                timing[1] += seconds
+            else:
+                self.timings[name] = [1, seconds]
+
+    def get_timings(self) -> typing.Dict[str, typing.Tuple[int, float]]:
+        with self._lock:
+            return {name: (int(count), seconds) for name, (count, seconds) in self.timings.items()}
+
+    @contextlib.contextmanager
+    def time(self, name: str) -> typing.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+
 class Client(Endpoint):
     __slots__ = (
         "__weakref__",
@@ -149,6 +472,7 @@ class Client(Endpoint):
         "no_items",
         "no_locations",
         "no_text",
+        "outbox",
     )
 
     version: Version
@@ -164,6 +488,8 @@ class Client(Endpoint):
     no_items: bool
     no_locations: bool
     no_text: bool
+    outbox: Outbox
+    """ broadcasts waiting to be sent to the client """
 
     def __init__(self, socket: "ServerConnection", ctx: Context) -> None:
         super().__init__(socket)
@@ -180,6 +506,7 @@ class Client(Endpoint):
         self.no_items = False
         self.no_locations = False
         self.no_text = False
+        self.outbox = Outbox(socket, ctx.outbox_stats)
 
     @property
     def items_handling(self):
@@ -228,9 +555,14 @@ class Context:
     hints_used: typing.Dict[typing.Tuple[int, int], int]
     groups: typing.Dict[int, typing.Set[int]]
     save_version = 2
-    stored_data: typing.Dict[str, object]
+    save_journal: SaveJournal
+    data_storage: DataStorage
+    datastorage_key_limit: int
+    """ most bytes a single value of the data storage may take up pickled, 0 for no limit. Set by the host, not an
+    option of the room, so neither the seed nor room admins can change it """
+    datastorage_limit: int
+    """ most bytes all values of the data storage may take up pickled, 0 for no limit. Set by the host as well """
     read_data: typing.Dict[str, object]
-    stored_data_notification_clients: typing.Dict[str, typing.Set[Client]]
     slot_info: typing.Dict[int, NetworkSlot]
     generator_version = Version(0, 0, 0)
     checksums: typing.Dict[str, str]
@@ -243,6 +575,15 @@ class Context:
     non_hintable_names: typing.Dict[str, typing.AbstractSet[str]]
     spheres: typing.List[typing.Dict[int, typing.Set[int]]]
     """ each sphere is { player: { location_id, ... } } """
+    pending_item_slots: typing.Set[typing.Tuple[int, int]]
+    """ team and slot of everyone who received items that were not sent to their clients yet """
+    item_delivery: typing.Optional[asyncio.Handle]
+    payloads: EncodedPayloads
+    payload_versions: typing.Counter[str]
+    """ versions of the data behind cached payloads that has no version of its own: "options" and "players" """
+    outbox_stats: typing.Counter[str]
+    """ totals of the outboxes of all clients, see NetUtils.Outbox """
+    metrics: ServerMetrics
     logger: logging.Logger
 
     def __init__(self, host: str, port: int, server_password: str, password: str, location_check_points: int,
@@ -260,6 +601,7 @@ class Context:
         self.data_filename = None
         self.save_filename = None
         self.saving = False
+        self.save_journal = SaveJournal()
         self.player_names: typing.Dict[team_slot, str] = {}
         self.player_name_lookup: typing.Dict[str, team_slot] = {}
         self.connect_names = {}  # names of slots clients can connect to
@@ -271,6 +613,12 @@ class Context:
         self.server = None
         self.countdown_timer = 0
         self.received_items = {}
+        self.pending_item_slots = set()
+        self.item_delivery = None
+        self.payloads = EncodedPayloads(self.dumper)
+        self.payload_versions = collections.Counter()
+        self.outbox_stats = collections.Counter()
+        self.metrics = ServerMetrics()
         self.start_inventory = {}
         self.name_aliases: typing.Dict[team_slot, str] = {}
         self.location_checks = collections.defaultdict(set)
@@ -278,6 +626,9 @@ class Context:
         self.location_check_points = location_check_points
         self.hints_used = collections.defaultdict(int)
         self.hints: typing.Dict[team_slot, typing.Set[Hint]] = collections.defaultdict(set)
+        # hints by team, finding player and location, to find the hints of newly checked locations
+        self.hints_by_location: typing.Dict[typing.Tuple[int, int, int], typing.Set[Hint]] = \
+            collections.defaultdict(set)
         self.release_mode: str = release_mode
         self.remaining_mode: str = remaining_mode
         self.collect_mode: str = collect_mode
@@ -304,8 +655,9 @@ class Context:
         self.groups = {}
         self.group_collected: typing.Dict[int, typing.Set[int]] = {}
         self.random = random.Random()
-        self.stored_data = {}
-        self.stored_data_notification_clients = collections.defaultdict(weakref.WeakSet)
+        self.data_storage = DataStorage()
+        self.datastorage_key_limit = 0
+        self.datastorage_limit = 0
         self.read_data = {}
         self.spheres = []
 
@@ -337,9 +689,9 @@ class Context:
             self.non_hintable_names[world_name] = world.hint_blacklist
 
         for game_package in self.gamespackage.values():
-            # remove groups from data sent to clients
-            del game_package["item_name_groups"]
-            del game_package["location_name_groups"]
+            # remove groups from data sent to clients, unless another context in this process already did
+            game_package.pop("item_name_groups", None)
+            game_package.pop("location_name_groups", None)
 
     def _init_game_data(self):
         for game_name, game_package in self.gamespackage.items():
@@ -367,60 +719,60 @@ class Context:
     def location_names_for_game(self, game: str) -> typing.Optional[typing.Dict[str, int]]:
         return self.gamespackage[game]["location_name_to_id"] if game in self.gamespackage else None
 
+    @property
+    def stored_data(self) -> typing.Dict[str, typing.Any]:
+        return self.data_storage.values
+
+    @stored_data.setter
+    def stored_data(self, values: typing.Dict[str, typing.Any]) -> None:
+        self.data_storage.load(values)
+
     # General networking
-    async def send_msgs(self, endpoint: Endpoint, msgs: typing.Iterable[dict]) -> bool:
+    async def send_msgs(self, endpoint: Client, msgs: typing.Iterable[dict]) -> bool:
         if not endpoint.socket or not endpoint.socket.open:
             return False
-        msg = self.dumper(msgs)
-        try:
-            await endpoint.socket.send(msg)
-        except websockets.ConnectionClosed:
-            self.logger.exception(f"Exception during send_msgs, could not send {msg}")
-            await self.disconnect(endpoint)
-            return False
-        else:
-            if self.log_network:
-                self.logger.info(f"Outgoing message: {msg}")
-            return True
+        with self.metrics.time("encode"):
+            msg = self.dumper(msgs)
+        return await self.send_encoded_msgs(endpoint, msg)
 
-    async def send_encoded_msgs(self, endpoint: Endpoint, msg: str) -> bool:
+    async def send_encoded_msgs(self, endpoint: Client, msg: str) -> bool:
         if not endpoint.socket or not endpoint.socket.open:
             return False
-        try:
-            await endpoint.socket.send(msg)
-        except websockets.ConnectionClosed:
-            self.logger.exception("Exception during send_encoded_msgs")
-            await self.disconnect(endpoint)
-            return False
-        else:
-            if self.log_network:
-                self.logger.info(f"Outgoing message: {msg}")
-            return True
+        # queued behind the broadcasts to the client, to arrive in order, but replies are never dropped like text
+        endpoint.outbox.put(msg, reply=True)
+        if self.log_network:
+            self.logger.info(f"Outgoing message: {msg}")
+        return True
 
-    async def broadcast_send_encoded_msgs(self, endpoints: typing.Iterable[Endpoint], msg: str) -> bool:
-        sockets = []
+    def broadcast_msgs(self, endpoints: typing.Iterable[Client], msgs: typing.List[dict]):
+        # queued per client, so that a slow client only holds up its own messages
+        with self.metrics.time("encode"):
+            encoded = self.dumper(msgs)
+        msg_is_text = all(msg["cmd"] == "PrintJSON" for msg in msgs)
         for endpoint in endpoints:
-            if endpoint.socket and endpoint.socket.open:
-                sockets.append(endpoint.socket)
-        try:
-            websockets.broadcast(sockets, msg)
-        except RuntimeError:
-            self.logger.exception("Exception during broadcast_send_encoded_msgs")
-            return False
-        else:
-            if self.log_network:
-                self.logger.info(f"Outgoing broadcast: {msg}")
-            return True
+            endpoint.outbox.put(encoded, msg_is_text, len(msgs))
+        if self.log_network:
+            self.logger.info(f"Outgoing broadcast: {encoded}")
+
+    def get_outbox_stats(self) -> typing.Dict[str, int]:
+        outboxes = [endpoint.outbox for endpoint in self.endpoints]
+        return {
+            "queued_frames": sum(len(outbox.frames) for outbox in outboxes),
+            "queued_size": sum(outbox.size for outbox in outboxes),
+            "largest_queue_size": max((outbox.size for outbox in outboxes), default=0),
+            "dropped_messages": self.outbox_stats["dropped_messages"],
+            "coalesced_frames": self.outbox_stats["coalesced_frames"],
+            "overflow_disconnects": self.outbox_stats["overflow_disconnects"],
+        }
 
     def broadcast_all(self, msgs: typing.List[dict]):
         msg_is_text = all(msg["cmd"] == "PrintJSON" for msg in msgs)
-        data = self.dumper(msgs)
         endpoints = (
             endpoint
             for endpoint in self.endpoints
             if endpoint.auth and not (msg_is_text and endpoint.no_text)
         )
-        async_start(self.broadcast_send_encoded_msgs(endpoints, data))
+        self.broadcast_msgs(endpoints, msgs)
 
     def broadcast_text_all(self, text: str, additional_arguments: dict = {}):
         self.logger.info("Notice (all): %s" % text)
@@ -428,23 +780,22 @@ class Context:
 
     def broadcast_team(self, team: int, msgs: typing.List[dict]):
         msg_is_text = all(msg["cmd"] == "PrintJSON" for msg in msgs)
-        data = self.dumper(msgs)
         endpoints = (
             endpoint
             for endpoint in itertools.chain.from_iterable(self.clients[team].values())
             if not (msg_is_text and endpoint.no_text)
         )
-        async_start(self.broadcast_send_encoded_msgs(endpoints, data))
+        self.broadcast_msgs(endpoints, msgs)
 
-    def broadcast(self, endpoints: typing.Iterable[Client], msgs: typing.List[dict]):
-        msgs = self.dumper(msgs)
-        async_start(self.broadcast_send_encoded_msgs(endpoints, msgs))
+    def broadcast(self, endpoints: typing.Iterable[Client], msgs: typing.List[typing.Dict[str, typing.Any]]) -> None:
+        self.broadcast_msgs(endpoints, msgs)
 
     async def disconnect(self, endpoint: Client):
         if endpoint in self.endpoints:
             self.endpoints.remove(endpoint)
         if endpoint.slot and endpoint in self.clients[endpoint.team][endpoint.slot]:
             self.clients[endpoint.team][endpoint.slot].remove(endpoint)
+        endpoint.outbox.clear()
         await on_client_disconnected(self, endpoint)
 
     def notify_client(self, client: Client, text: str, additional_arguments: dict = {}):
@@ -479,15 +830,19 @@ class Context:
         self.data_filename = multidatapath
 
     @staticmethod
-    def decompress(data: bytes) -> dict:
+    def decompress(data: bytes) -> typing.MutableMapping[str, typing.Any]:
         format_version = data[0]
-        if format_version > 3:
+        if format_version > NetUtils.multidata_format_version:
             raise Utils.VersionException("Incompatible multidata.")
+        if format_version >= 4:
+            # sections are only decoded once they get read
+            return NetUtils.MultiDataSections(data)
         return restricted_loads(zlib.decompress(data[1:]))
 
     def _load(self, decoded_obj: MultiData, game_data_packages: typing.Dict[str, typing.Any],
               use_embedded_server_options: bool):
 
+        self.payloads.clear()
         self.read_data = {}
         # there might be a better place to put this.
         self.read_data["race_mode"] = lambda: decoded_obj.get("race_mode", 0)
@@ -540,6 +895,7 @@ class Context:
 
         for slot, hints in decoded_obj["precollected_hints"].items():
             self.hints[0, slot].update(hints)
+        self.index_hints()
 
         # declare slots that aren't players as done
         for slot, slot_info in self.slot_info.items():
@@ -585,28 +941,40 @@ class Context:
         return False
 
     def _save(self, exit_save: bool = False) -> bool:
-        try:
-            # Does not use Utils.restricted_dumps because we'd rather make a save than not make one
-            encoded_save = pickle.dumps(self.get_save())
-            with open(self.save_filename, "wb") as f:
-                f.write(zlib.compress(encoded_save))
-        except Exception as e:
-            self.logger.exception(e)
-            return False
-        else:
-            return True
+        with self.metrics.time("save"):
+            try:
+                save = self.get_save()
+                if self.save_journal.needs_snapshot:
+                    self.save_journal.take_snapshot(save)
+                    # write next to the old save and replace it at once, so it is never lost halfway through
+                    temp_filename = self.save_filename + ".tmp"
+                    with open(temp_filename, "wb") as f:
+                        f.write(save_journal_magic)
+                        size = write_save_record(f, save)
+                    os.replace(temp_filename, self.save_filename)
+                    self.save_journal.wrote(size, snapshot=True)
+                else:
+                    changes = self.save_journal.take_changes(save)
+                    if changes:
+                        with open(self.save_filename, "ab") as f:
+                            self.save_journal.wrote(write_save_record(f, changes))
+            except Exception as e:
+                self.save_journal.invalidate()
+                self.logger.exception(e)
+                return False
+            else:
+                return True
 
     def init_save(self, enabled: bool = True):
         self.saving = enabled
         if self.saving:
             if not self.save_filename:
-                import os
                 name, ext = os.path.splitext(self.data_filename)
                 self.save_filename = name + '.apsave' if ext.lower() in ('.archipelago', '.zip') \
                     else self.data_filename + '_' + 'apsave'
             try:
                 with open(self.save_filename, 'rb') as f:
-                    save_data = restricted_loads(zlib.decompress(f.read()))
+                    save_data = load_save(f.read(), self.logger)
                     self.set_save(save_data)
             except FileNotFoundError:
                 self.logger.error('No save data found, starting a new game')
@@ -645,8 +1013,7 @@ class Context:
                 import atexit
                 atexit.register(self._save, True)  # make sure we save on exit too
 
-    def get_save(self) -> dict:
-        self.recheck_hints()
+    def get_save(self) -> typing.Dict[str, typing.Any]:
         d = {
             "version": self.save_version,
             "connect_names": self.connect_names,
@@ -684,6 +1051,7 @@ class Context:
         self.hints.update(savedata["hints"])
 
         self.name_aliases.update(savedata["name_aliases"])
+        self.payload_versions["players"] += 1
         self.client_game_state.update(savedata["client_game_state"])
         self.client_connection_timers.update(
             {tuple(key): datetime.datetime.fromtimestamp(value, datetime.timezone.utc) for key, value
@@ -692,6 +1060,8 @@ class Context:
             {tuple(key): datetime.datetime.fromtimestamp(value, datetime.timezone.utc) for key, value
              in savedata["client_activity_timers"]})
         self.location_checks.update(savedata["location_checks"])
+        self.index_hints()
+        self.recheck_hints()
         self.random.setstate(savedata["random_state"])
 
         if "game_options" in savedata:
@@ -740,6 +1110,7 @@ class Context:
                 new_hints.add(new_hint)
                 if hint == new_hint:
                     continue
+                self._reindex_hint(hint_team, hint, new_hint)
                 for player in self.slot_set(hint.receiving_player) | {hint.finding_player}:
                     if changed is not None:
                         changed.add((hint_team,player))
@@ -747,6 +1118,35 @@ class Context:
                         self.replace_hint(hint_team, player, hint, new_hint)
             self.hints[hint_team, hint_slot] = new_hints
 
+    def recheck_location_hints(self, team: int, slot: int, locations: typing.Iterable[int],
+                               changed: typing.Set[team_slot]) -> None:
+        """Refreshes only the hints for the given locations of the finding slot, looked up in hints_by_location.
+        Each (team,slot) pair that has at least one hint modified will be added to 'changed'.
+        """
+        for location in locations:
+            hints = self.hints_by_location.get((team, slot, location))
+            if not hints:
+                continue
+            for hint in list(hints):
+                new_hint = hint.re_check(self, team)
+                if hint == new_hint:
+                    continue
+                for player in self.slot_set(hint.receiving_player) | {hint.finding_player}:
+                    changed.add((team, player))
+                    self.replace_hint(team, player, hint, new_hint)
+
+    def index_hints(self) -> None:
+        """Rebuilds hints_by_location, for when hints were replaced as a whole."""
+        self.hints_by_location = collections.defaultdict(set)
+        for (team, _), hints in self.hints.items():
+            for hint in hints:
+                self.hints_by_location[team, hint.finding_player, hint.location].add(hint)
+
+    def _reindex_hint(self, team: int, old_hint: Hint, new_hint: Hint) -> None:
+        hints = self.hints_by_location[team, old_hint.finding_player, old_hint.location]
+        hints.discard(old_hint)
+        hints.add(new_hint)
+
     def get_rechecked_hints(self, team: int, slot: int):
         self.recheck_hints(team, slot)
         return self.hints[team, slot]
@@ -787,6 +1187,7 @@ class Context:
                 self.item_cheat = not bool(value)
             else:
                 self.logger.debug(f"Unrecognized server option {key}")
+        self.payload_versions["options"] += 1
 
     def get_aliased_name(self, team: int, slot: int):
         if (team, slot) in self.name_aliases:
@@ -817,6 +1218,7 @@ class Context:
                 # we can check once if hint already exists
                 if hint not in self.hints[team, hint.finding_player]:
                     self.hints[team, hint.finding_player].add(hint)
+                    self.hints_by_location[team, hint.finding_player, hint.location].add(hint)
                     new_hint_events.add(hint.finding_player)
                     for player in self.slot_set(hint.receiving_player):
                         self.hints[team, player].add(hint)
@@ -835,15 +1237,15 @@ class Context:
                     async_start(self.send_msgs(client, client_hints))
 
     def get_hint(self, team: int, finding_player: int, seeked_location: int) -> typing.Optional[Hint]:
-        for hint in self.hints[team, finding_player]:
-            if hint.location == seeked_location and hint.finding_player == finding_player:
-                return hint
+        for hint in self.hints_by_location.get((team, finding_player, seeked_location), ()):
+            return hint
         return None
     
     def replace_hint(self, team: int, slot: int, old_hint: Hint, new_hint: Hint) -> None:
         if old_hint in self.hints[team, slot]:
             self.hints[team, slot].remove(old_hint)
             self.hints[team, slot].add(new_hint)
+            self._reindex_hint(team, old_hint, new_hint)
     
     # "events"
 
@@ -866,20 +1268,21 @@ class Context:
 
     def on_changed_hints(self, team: int, slot: int):
         key: str = f"_read_hints_{team}_{slot}"
-        targets: typing.Set[Client] = set(self.stored_data_notification_clients[key])
+        targets: typing.Set[Client] = set.union(*self.data_storage.notified_clients(key))
         if targets:
             self.broadcast(targets, [{"cmd": "SetReply", "key": key, "value": self.hints[team, slot]}])
 
     def on_client_status_change(self, team: int, slot: int):
         key: str = f"_read_client_status_{team}_{slot}"
-        targets: typing.Set[Client] = set(self.stored_data_notification_clients[key])
+        targets: typing.Set[Client] = set.union(*self.data_storage.notified_clients(key))
         if targets:
             self.broadcast(targets, [{"cmd": "SetReply", "key": key, "value": self.client_game_state[team, slot]}])
 
 
 def update_aliases(ctx: Context, team: int):
-    cmd = ctx.dumper([{"cmd": "RoomUpdate",
-                       "players": ctx.get_players_package()}])
+    ctx.payload_versions["players"] += 1
+    players = ctx.payloads.get("players", ctx.payload_versions["players"], ctx.get_players_package)
+    cmd = f"[{splice_encoded([('cmd', ctx.dumper('RoomUpdate')), ('players', players)])}]"
 
     for clients in ctx.clients[team].values():
         for client in clients:
@@ -899,7 +1302,9 @@ async def server(websocket: "ServerConnection", path: str = "/", ctx: Context =
         async for data in websocket:
             if ctx.log_network:
                 ctx.logger.info(f"Incoming message: {data}")
-            for msg in decode(data):
+            with ctx.metrics.time("decode"):
+                msgs = decode(data)
+            for msg in msgs:
                 await process_client_cmd(ctx, client, msg)
     except Exception as e:
         if not isinstance(e, websockets.WebSocketException):
@@ -911,15 +1316,15 @@ async def server(websocket: "ServerConnection", path: str = "/", ctx: Context =
 
 
 async def on_client_connected(ctx: Context, client: Client):
-    players = []
-    for team, clients in ctx.clients.items():
-        for slot, connected_clients in clients.items():
-            if connected_clients:
-                name = ctx.player_names[team, slot]
-                players.append(NetworkPlayer(team, slot, ctx.name_aliases.get((team, slot), name), name))
+    room_info = ctx.payloads.get("RoomInfo", ctx.payload_versions["options"], lambda: get_room_info(ctx))
+    await ctx.send_encoded_msgs(client, f"[{splice_encoded([('time', ctx.dumper(time.time()))], room_info)}]")
+
+
+def get_room_info(ctx: Context) -> typing.Dict[str, typing.Any]:
+    """RoomInfo without the time, which on_client_connected adds to the cached encoding."""
     games = {ctx.games[x] for x in range(1, len(ctx.games) + 1)}
     games.add("Archipelago")
-    await ctx.send_msgs(client, [{
+    return {
         'cmd': 'RoomInfo',
         'password': bool(ctx.password),
         'games': games,
@@ -934,8 +1339,7 @@ async def on_client_connected(ctx: Context, client: Client):
         'datapackage_checksums': {game: game_data["checksum"] for game, game_data
                                   in ctx.gamespackage.items() if game in games and "checksum" in game_data},
         'seed_name': ctx.seed_name,
-        'time': time.time(),
-    }])
+    }
 
 
 def get_permissions(ctx) -> typing.Dict[str, Permission]:
@@ -1066,20 +1470,37 @@ def get_start_inventory(ctx: Context, player: int, remote_start_inventory: bool)
 
 
 def send_new_items(ctx: Context):
-    for team, clients in ctx.clients.items():
-        for slot, clients in clients.items():
-            for client in clients:
-                if client.no_items:
-                    continue
-                start_inventory = get_start_inventory(ctx, slot, client.remote_start_inventory)
-                items = get_received_items(ctx, team, slot, client.remote_items)
-                if len(start_inventory) + len(items) > client.send_index:
-                    first_new_item = max(0, client.send_index - len(start_inventory))
-                    async_start(ctx.send_msgs(client, [{
-                        "cmd": "ReceivedItems",
-                        "index": client.send_index,
-                        "items": start_inventory[client.send_index:] + items[first_new_item:]}]))
-                    client.send_index = len(start_inventory) + len(items)
+    """
+    Sends ReceivedItems to the clients of every slot with pending items.
+    Within an event loop this happens once at the end of the current iteration, so that all checks that came in at the
+    same time are sent together, and only the clients of the slots that received something are looked at.
+    """
+    if ctx.item_delivery or not ctx.pending_item_slots:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        deliver_items(ctx)
+    else:
+        ctx.item_delivery = loop.call_soon(deliver_items, ctx)
+
+
+def deliver_items(ctx: Context):
+    ctx.item_delivery = None
+    pending_item_slots, ctx.pending_item_slots = ctx.pending_item_slots, set()
+    for team, slot in sorted(pending_item_slots):
+        for client in ctx.clients.get(team, {}).get(slot, ()):
+            if client.no_items:
+                continue
+            start_inventory = get_start_inventory(ctx, slot, client.remote_start_inventory)
+            items = get_received_items(ctx, team, slot, client.remote_items)
+            if len(start_inventory) + len(items) > client.send_index:
+                first_new_item = max(0, client.send_index - len(start_inventory))
+                async_start(ctx.send_msgs(client, [{
+                    "cmd": "ReceivedItems",
+                    "index": client.send_index,
+                    "items": start_inventory[client.send_index:] + items[first_new_item:]}]))
+                client.send_index = len(start_inventory) + len(items)
 
 
 def update_checked_locations(ctx: Context, team: int, slot: int):
@@ -1127,6 +1548,7 @@ def send_items_to(ctx: Context, team: int, target_slot: int, *items: NetworkItem
             if item.player != target_slot:
                 get_received_items(ctx, team, target, False).append(item)
             get_received_items(ctx, team, target, True).append(item)
+        ctx.pending_item_slots.add((team, target))
 
 
 def register_location_checks(ctx: Context, team: int, slot: int, locations: typing.Iterable[int],
@@ -1135,6 +1557,7 @@ def register_location_checks(ctx: Context, team: int, slot: int, locations: typi
     new_locations = set(locations) - ctx.location_checks[team, slot]
     new_locations.intersection_update(slot_locations)  # ignore location IDs unknown to this multidata
     if new_locations:
+        start = time.perf_counter()
         if count_activity:
             ctx.client_activity_timers[team, slot] = datetime.datetime.now(datetime.timezone.utc)
 
@@ -1171,10 +1594,11 @@ def register_location_checks(ctx: Context, team: int, slot: int, locations: typi
             "checked_locations": new_locations,  # send back new checks only
         }])
         updated_slots: typing.Set[tuple[int, int]] = set()
-        ctx.recheck_hints(team, slot, updated_slots)
+        ctx.recheck_location_hints(team, slot, new_locations, updated_slots)
         for hint_team, hint_slot in updated_slots:
             ctx.on_changed_hints(hint_team, hint_slot)
         ctx.save()
+        ctx.metrics.record("register_location_checks", time.perf_counter() - start)
 
 
 def collect_hints(ctx: Context, team: int, slot: int, item: typing.Union[int, str],
@@ -1663,6 +2087,7 @@ class ClientMessageProcessor(CommonCommandProcessor):
                 new_item = NetworkItem(names[item_name], -1, self.client.slot)
                 get_received_items(self.ctx, self.client.team, self.client.slot, False).append(new_item)
                 get_received_items(self.ctx, self.client.team, self.client.slot, True).append(new_item)
+                self.ctx.pending_item_slots.add((self.client.team, self.client.slot))
                 self.ctx.broadcast_text_all(
                     'Cheat console: sending "' + item_name + '" to ' + self.ctx.get_aliased_name(self.client.team,
                                                                                                  self.client.slot),
@@ -1680,9 +2105,7 @@ class ClientMessageProcessor(CommonCommandProcessor):
         points_available = get_client_points(self.ctx, self.client)
         cost = self.ctx.get_hint_cost(self.client.slot)
         if not input_text:
-            hints = {hint.re_check(self.ctx, self.client.team) for hint in
-                     self.ctx.hints[self.client.team, self.client.slot]}
-            self.ctx.hints[self.client.team, self.client.slot] = hints
+            hints = self.ctx.get_rechecked_hints(self.client.team, self.client.slot)
             self.ctx.notify_hints(self.client.team, list(hints), recipients=(self.client.slot,))
             self.output(f"A hint costs {self.ctx.get_hint_cost(self.client.slot)} points. "
                         f"You have {points_available} points.")
@@ -1822,6 +2245,39 @@ class ClientMessageProcessor(CommonCommandProcessor):
         return self.get_hints(location, True)
 
 
+def get_encoded_connected(ctx: Context, team: int, slot: int, with_slot_data: bool) -> str:
+    """The Connected packet of a slot, spliced together from cached payloads."""
+    payloads = ctx.payloads
+    # locations only ever get added to location_checks, so their number tells if the lists changed
+    checks = len(ctx.location_checks[team, slot])
+    fields = [
+        ("cmd", ctx.dumper("Connected")),
+        ("team", ctx.dumper(team)),
+        ("slot", ctx.dumper(slot)),
+        ("players", payloads.get("players", ctx.payload_versions["players"], ctx.get_players_package)),
+        ("missing_locations", payloads.get(("missing_locations", team, slot), checks,
+                                           lambda: get_missing_checks(ctx, team, slot))),
+        ("checked_locations", payloads.get(("checked_locations", team, slot), checks,
+                                           lambda: get_checked_checks(ctx, team, slot))),
+        ("slot_info", payloads.get("slot_info", None, lambda: ctx.slot_info)),
+        ("hint_points", ctx.dumper(get_slot_points(ctx, team, slot))),
+    ]
+    if with_slot_data:
+        fields.append(("slot_data", payloads.get(("slot_data", slot), None, lambda: ctx.slot_data[slot])))
+    return splice_encoded(fields)
+
+
+def get_encoded_data_package(ctx: Context, games: typing.Iterable[str]) -> str:
+    """DataPackage with the given games, which are encoded once per checksum."""
+    encoded_games = splice_encoded(
+        (game, ctx.payloads.get(("game", game), ctx.gamespackage[game].get("checksum"),
+                                lambda: ctx.gamespackage[game]))
+        for game in games
+    )
+    data = splice_encoded([("games", encoded_games)])
+    return f"[{splice_encoded([('cmd', ctx.dumper('DataPackage')), ('data', data)])}]"
+
+
 def get_checked_checks(ctx: Context, team: int, slot: int) -> typing.List[int]:
     return ctx.locations.get_checked(ctx.location_checks, team, slot)
 
@@ -1840,7 +2296,7 @@ def get_slot_points(ctx: Context, team: int, slot: int) -> int:
             ctx.get_hint_cost(slot) * ctx.hints_used[team, slot])
 
 
-async def process_client_cmd(ctx: Context, client: Client, args: dict):
+async def process_client_cmd(ctx: Context, client: Client, args: typing.Dict[str, typing.Any]) -> None:
     try:
         cmd: str = args["cmd"]
     except:
@@ -1854,6 +2310,7 @@ async def process_client_cmd(ctx: Context, client: Client, args: dict):
                                       "text": f"Command should be str, got {type(cmd)}"}])
         return
 
+    ctx.metrics.count_packet(cmd)
     if cmd == 'Connect':
         if not args or 'password' not in args or type(args['password']) not in [str, type(None)] or \
                 'game' not in args:
@@ -1905,48 +2362,31 @@ async def process_client_cmd(ctx: Context, client: Client, args: dict):
             client.no_locations = bool(client.tags & _non_game_messages.keys())
             # set NoText for old PopTracker clients that predate the tag to save traffic
             client.no_text = "NoText" in client.tags or ("PopTracker" in client.tags and client.version < (0, 5, 1))
-            connected_packet = {
-                "cmd": "Connected",
-                "team": client.team, "slot": client.slot,
-                "players": ctx.get_players_package(),
-                "missing_locations": get_missing_checks(ctx, team, slot),
-                "checked_locations": get_checked_checks(ctx, team, slot),
-                "slot_info": ctx.slot_info,
-                "hint_points": get_slot_points(ctx, team, slot),
-            }
-            reply = [connected_packet]
+            reply = [get_encoded_connected(ctx, team, slot, args.get("slot_data", True))]
             start_inventory = get_start_inventory(ctx, slot, client.remote_start_inventory)
             items = get_received_items(ctx, client.team, client.slot, client.remote_items)
             if (start_inventory or items) and not client.no_items:
-                reply.append({"cmd": 'ReceivedItems', "index": 0, "items": start_inventory + items})
+                reply.append(ctx.dumper({"cmd": 'ReceivedItems', "index": 0, "items": start_inventory + items}))
                 client.send_index = len(start_inventory) + len(items)
-            if not client.auth:  # if this was a Re-Connect, don't print to console
-                client.auth = True
+            joined = not client.auth  # if this was a Re-Connect, don't print to console
+            client.auth = True
+            # sent ahead of what joining broadcasts, as replies and broadcasts reach the client in order
+            await ctx.send_encoded_msgs(client, f"[{','.join(reply)}]")
+            if joined:
                 await on_client_joined(ctx, client)
-            if args.get("slot_data", True):
-                connected_packet["slot_data"] = ctx.slot_data[client.slot]
-            await ctx.send_msgs(client, reply)
 
     elif cmd == "GetDataPackage":
         exclusions = args.get("exclusions", [])
         if "games" in args:
-            games = {name: game_data for name, game_data in ctx.gamespackage.items()
-                     if name in set(args.get("games", []))}
-            await ctx.send_msgs(client, [{"cmd": "DataPackage",
-                                          "data": {"games": games}}])
+            requested = set(args.get("games", []))
+            games = [name for name in ctx.gamespackage if name in requested]
         # TODO: remove exclusions behaviour around 0.5.0
         elif exclusions:
             exclusions = set(exclusions)
-            games = {name: game_data for name, game_data in ctx.gamespackage.items()
-                     if name not in exclusions}
-
-            package = {"games": games}
-            await ctx.send_msgs(client, [{"cmd": "DataPackage",
-                                          "data": package}])
-
+            games = [name for name in ctx.gamespackage if name not in exclusions]
         else:
-            await ctx.send_msgs(client, [{"cmd": "DataPackage",
-                                          "data": {"games": ctx.gamespackage}}])
+            games = list(ctx.gamespackage)
+        await ctx.send_encoded_msgs(client, get_encoded_data_package(ctx, games))
 
     elif client.auth:
         if cmd == "ConnectUpdate":
@@ -2148,7 +2588,7 @@ async def process_client_cmd(ctx: Context, client: Client, args: dict):
                     await ctx.send_encoded_msgs(bounceclient, msg)
 
         elif cmd == "Get":
-            if "keys" not in args or type(args["keys"]) != list:
+            if "keys" not in args or type(args["keys"]) != list or type(args.get("prefixes", [])) != list:
                 await ctx.send_msgs(client, [{'cmd': 'InvalidPacket', "type": "arguments",
                                               "text": 'Retrieve', "original_cmd": cmd}])
                 return
@@ -2159,6 +2599,9 @@ async def process_client_cmd(ctx: Context, client: Client, args: dict):
                      ctx.stored_data.get(key, None)
                 for key in keys
             }
+            for prefix in args.get("prefixes", []):
+                for key in ctx.data_storage.keys_with_prefix(prefix):
+                    args["keys"][key] = ctx.stored_data[key]
             await ctx.send_msgs(client, [args])
 
         elif cmd == "Set":
@@ -2167,28 +2610,53 @@ async def process_client_cmd(ctx: Context, client: Client, args: dict):
                 await ctx.send_msgs(client, [{'cmd': 'InvalidPacket', "type": "arguments",
                                               "text": 'Set', "original_cmd": cmd}])
                 return
-            args["cmd"] = "SetReply"
-            value = ctx.stored_data.get(args["key"], args.get("default", 0))
-            args["original_value"] = copy.copy(value)
-            args["slot"] = client.slot
+            key = args["key"]
+            targets, delta_targets = ctx.data_storage.notified_clients(key)
+            if args.get("want_reply", False):
+                targets.add(client)
+                delta_targets.discard(client)
+            limited = ctx.datastorage_key_limit or ctx.datastorage_limit
+            existed = key in ctx.stored_data
+            value = ctx.stored_data.get(key, args.get("default", 0))
+            # operations may change the value in place, so it is copied for the replies with the full value or to
+            # restore it if it ends up too large
+            original_value = copy.copy(value) if targets or (limited and existed) else None
             for operation in args["operations"]:
                 func = modify_functions[operation["operation"]]
                 value = func(value, operation["value"])
-            ctx.stored_data[args["key"]] = args["value"] = value
-            targets = set(ctx.stored_data_notification_clients[args["key"]])
-            if args.get("want_reply", False):
-                targets.add(client)
+            size = ctx.data_storage.size_of(value) if limited else None
+            if size is not None and ctx.data_storage.exceeds_limits(key, size, ctx.datastorage_key_limit,
+                                                                    ctx.datastorage_limit):
+                if existed:
+                    ctx.data_storage.set(key, original_value)
+                await ctx.send_msgs(client, [{'cmd': 'InvalidPacket', "type": "arguments",
+                                              "text": f"Set: value of {key} would exceed the data storage limit",
+                                              "original_cmd": cmd}])
+                return
+            ctx.data_storage.set(key, value, size)
+            ctx.save_journal.mark("stored_data", key)
+            args["cmd"] = "SetReply"
+            args["slot"] = client.slot
+            if delta_targets:
+                # the operations are enough to follow a value that the client already has
+                if existed:
+                    ctx.broadcast(delta_targets, [args.copy()])
+                else:
+                    ctx.broadcast(delta_targets, [{**args, "value": value}])
             if targets:
+                args["original_value"] = original_value
+                args["value"] = value
                 ctx.broadcast(targets, [args])
             ctx.save()
 
         elif cmd == "SetNotify":
-            if "keys" not in args or type(args["keys"]) != list:
+            keys = args.get("keys", [])
+            prefixes = args.get("prefixes", [])
+            if type(keys) != list or type(prefixes) != list or "keys" not in args and "prefixes" not in args:
                 await ctx.send_msgs(client, [{'cmd': 'InvalidPacket', "type": "arguments",
                                               "text": 'SetNotify', "original_cmd": cmd}])
                 return
-            for key in args["keys"]:
-                ctx.stored_data_notification_clients[key].add(client)
+            ctx.data_storage.notify(client, keys, prefixes, bool(args.get("deltas", False)))
 
 
 def update_client_status(ctx: Context, client: Client, new_status: ClientStatus):
@@ -2525,6 +2993,7 @@ class ServerCommandProcessor(CommonCommandProcessor):
                 return False
 
         setattr(self.ctx, option_name, value_type(option_value))
+        self.ctx.payload_versions["options"] += 1
         self.output(f"Set option {option_name} to {getattr(self.ctx, option_name)}")
         if option_name in {"release_mode", "remaining_mode", "collect_mode"}:
             self.ctx.broadcast_all([{"cmd": "RoomUpdate", 'permissions': get_permissions(self.ctx)}])
@@ -2534,17 +3003,245 @@ class ServerCommandProcessor(CommonCommandProcessor):
 
     def _cmd_datastore(self):
         """Debug Tool: list writable datastorage keys and approximate the size of their values with pickle."""
-        total: int = 0
-        texts = []
-        for key, value in self.ctx.stored_data.items():
-            size = len(pickle.dumps(value))
-            total += size
-            texts.append(f"Key: {key} | Size: {size}B")
+        data_storage = self.ctx.data_storage
+        texts = [f"Key: {key} | Size: {data_storage.size(key)}B" for key in self.ctx.stored_data]
         texts.insert(0, f"Found {len(self.ctx.stored_data)} keys, "
-                        f"approximately totaling {Utils.format_SI_prefix(total, power=1024)}B")
+                        f"approximately totaling {Utils.format_SI_prefix(data_storage.total_size, power=1024)}B")
         self.output("\n".join(texts))
 
 
+class WorkerConnection:
+    """Stands in for the websocket of a client that is connected to a worker process."""
+    __slots__ = ("worker", "id", "open", "extensions")
+
+    worker: WorkerLink
+    id: int
+    open: bool
+    extensions: typing.List[PerMessageDeflate]
+
+    def __init__(self, worker: WorkerLink, connection: int, compressed: bool) -> None:
+        self.worker = worker
+        self.id = connection
+        self.open = True
+        # the worker negotiated the actual extension, this only tells on_client_joined that it is there
+        self.extensions = [PerMessageDeflate(False, False, 11, 11)] if compressed else []
+
+    async def send(self, msg: str) -> None:
+        self.worker.send_encoded([self.id], msg, reply=True)
+        await self.worker.drain()
+
+    async def close(self) -> None:
+        self.worker.close(self.id)
+
+
+class WorkerLink:
+    """Server side of the connection to one worker process, see MultiServerWorker.
+    Sending only writes, whoever sends awaits drain afterwards, so a worker that falls behind holds up its senders
+    instead of growing the buffer of its connection."""
+    clients: typing.Dict[int, Client]
+    write_buffer_limit: int = 4 * 1024 * 1024
+    """ size of unsent frames above which drain waits for the worker to catch up """
+    stall_timeout: float = 30
+    """ seconds a worker may take to catch up before it is dropped """
+
+    def __init__(self, ctx: Context, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.ctx = ctx
+        self.reader = reader
+        self.writer = writer
+        self.clients = {}
+        writer.transport.set_write_buffer_limits(self.write_buffer_limit)
+
+    def send(self, connections: typing.List[int], data: bytes, reply: bool = False) -> None:
+        """Sends pickled commands, which the worker encodes. Replies are never dropped by the outboxes of the worker."""
+        MultiServerWorker.write_frame(self.writer, ("send", connections, data, reply))
+
+    def send_encoded(self, connections: typing.List[int], msg: str, reply: bool = False) -> None:
+        MultiServerWorker.write_frame(self.writer, ("send_encoded", connections, msg, reply))
+
+    def close(self, connection: int) -> None:
+        MultiServerWorker.write_frame(self.writer, ("close", connection))
+
+    async def drain(self) -> None:
+        """Waits until the worker took enough of what was sent to it. Drops the worker, and with it its clients, if it
+        stalls."""
+        transport = self.writer.transport
+        if transport.get_write_buffer_size() <= self.write_buffer_limit or transport.is_closing():
+            return
+        try:
+            await asyncio.wait_for(self.writer.drain(), self.stall_timeout)
+        except asyncio.TimeoutError:
+            self.ctx.logger.error(f"Worker process did not take what was sent to it for {self.stall_timeout} seconds, "
+                                  f"dropping it.")
+            transport.abort()
+        except ConnectionError:
+            pass  # run cleans up after the lost worker
+
+    async def run(self) -> None:
+        ctx = self.ctx
+        try:
+            while True:
+                command, connection, *arguments = await MultiServerWorker.read_frame(self.reader)
+                if command == "msgs":
+                    client = self.clients.get(connection)
+                    if not client:
+                        continue
+                    if ctx.log_network:
+                        ctx.logger.info(f"Incoming message: {arguments[0]}")
+                    try:
+                        for msg in arguments[0]:
+                            await process_client_cmd(ctx, client, msg)
+                    except Exception as e:
+                        ctx.logger.exception(e)
+                        self.close(connection)
+                elif command == "connect":
+                    client = Client(WorkerConnection(self, connection, arguments[0]), ctx)
+                    self.clients[connection] = client
+                    ctx.endpoints.append(client)
+                    if ctx.log_network:
+                        ctx.logger.info("Incoming connection")
+                    await on_client_connected(ctx, client)
+                elif command == "disconnect":
+                    client = self.clients.pop(connection, None)
+                    if client:
+                        client.socket.open = False
+                        if ctx.log_network:
+                            ctx.logger.info("Disconnected")
+                        await ctx.disconnect(client)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for client in self.clients.values():
+                client.socket.open = False
+                await ctx.disconnect(client)
+            self.clients.clear()
+
+
+class ShardedContext(Context):
+    """Context of a server that leaves websockets, decoding and encoding to worker processes.
+    The state stays in this process, while commands travel to the workers pickled, which is much cheaper than JSON."""
+
+    @staticmethod
+    def by_worker(endpoints: typing.Iterable[Endpoint]) -> typing.Dict[WorkerLink, typing.List[int]]:
+        connections: typing.Dict[WorkerLink, typing.List[int]] = {}
+        for endpoint in endpoints:
+            socket = endpoint.socket
+            if socket and socket.open:
+                connections.setdefault(socket.worker, []).append(socket.id)
+        return connections
+
+    async def send_msgs(self, endpoint: Client, msgs: typing.Iterable[dict]) -> bool:
+        socket = endpoint.socket
+        if not socket or not socket.open:
+            return False
+        socket.worker.send([socket.id], pickle.dumps(msgs, pickle.HIGHEST_PROTOCOL), reply=True)
+        if self.log_network:
+            self.logger.info(f"Outgoing message: {msgs}")
+        await socket.worker.drain()
+        return True
+
+    async def send_encoded_msgs(self, endpoint: Client, msg: str) -> bool:
+        # the outbox of the client in its worker keeps this in order with the broadcasts to it
+        socket = endpoint.socket
+        if not socket or not socket.open:
+            return False
+        socket.worker.send_encoded([socket.id], msg, reply=True)
+        if self.log_network:
+            self.logger.info(f"Outgoing message: {msg}")
+        await socket.worker.drain()
+        return True
+
+    async def broadcast_send_pickled_msgs(self, endpoints: typing.Iterable[Endpoint], data: bytes) -> bool:
+        workers = self.by_worker(endpoints)
+        for worker, connections in workers.items():
+            worker.send(connections, data)
+        # every worker got the broadcast before waiting for any, so a stalled one does not hold up the others
+        for worker in workers:
+            await worker.drain()
+        return True
+
+    def broadcast_msgs(self, endpoints: typing.Iterable[Endpoint], msgs: typing.List[dict]):
+        if self.log_network:
+            self.logger.info(f"Outgoing broadcast: {msgs}")
+        # pickled right away like they are encoded without workers, as values may still change in place afterwards,
+        # but sent from a task like the encoded broadcasts, so they arrive after replies sent in the meantime
+        async_start(self.broadcast_send_pickled_msgs(endpoints, pickle.dumps(msgs, pickle.HIGHEST_PROTOCOL)))
+
+
+class WorkerPool:
+    """Starts the worker processes of a ShardedContext and accepts their connections.
+    Like the server of websockets.serve it has to be awaited to start and closes through ws_server.close()."""
+    links: typing.List[WorkerLink]
+    processes: typing.List[multiprocessing.Process]
+
+    def __init__(self, ctx: ShardedContext, workers: int, cert: typing.Optional[str] = None,
+                 cert_key: typing.Optional[str] = None, loglevel: str = "info") -> None:
+        self.ctx = ctx
+        self.workers = workers
+        self.cert = cert
+        self.cert_key = cert_key
+        self.loglevel = loglevel
+        self.token = secrets.token_bytes(32)
+        self.links = []
+        self.processes = []
+        self.ipc_server: typing.Optional[asyncio.Server] = None
+
+    def __await__(self):
+        return self.start().__await__()
+
+    @property
+    def ws_server(self) -> WorkerPool:
+        return self
+
+    async def start(self) -> WorkerPool:
+        self.ipc_server = await asyncio.start_server(self.accept, "127.0.0.1", 0)
+        address = self.ipc_server.sockets[0].getsockname()[:2]
+        listening_socket = MultiServerWorker.create_listening_socket(self.ctx.host, self.ctx.port)
+        spawn = multiprocessing.get_context("spawn")
+        try:
+            for index in range(1, self.workers + 1):
+                process = spawn.Process(target=MultiServerWorker.run, name=f"ServerWorker{index}", daemon=True,
+                                        args=(index, listening_socket, address, self.token,
+                                              [server_per_message_deflate_factory], self.cert, self.cert_key,
+                                              self.loglevel))
+                process.start()
+                self.processes.append(process)
+        finally:
+            listening_socket.close()
+        return self
+
+    async def accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            token = await asyncio.wait_for(reader.readexactly(len(self.token)), 10)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            token = b""
+        if not hmac.compare_digest(token, self.token):
+            writer.close()
+            return
+        link = WorkerLink(self.ctx, reader, writer)
+        self.links.append(link)
+        try:
+            await link.run()
+        finally:
+            self.links.remove(link)
+            writer.close()
+            if not self.ctx.exit_event.is_set():
+                self.ctx.logger.error("Lost connection to a worker process.")
+
+    def close(self) -> None:
+        """Stops the workers, which close their client connections."""
+        if self.ipc_server:
+            self.ipc_server.close()
+        for link in self.links:
+            link.writer.close()
+
+    async def wait_closed(self) -> None:
+        for link in list(self.links):
+            await link.writer.wait_closed()
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join)
+
+
 async def console(ctx: Context):
     import sys
     queue = asyncio.Queue()
@@ -2631,10 +3328,85 @@ def parse_args() -> argparse.Namespace:
     #0 -> recommended for tournaments to force a level playing field, only allow an exact version match
     """)
     parser.add_argument('--log_network', default=defaults["log_network"], action="store_true")
+    parser.add_argument('--datastorage_key_limit', default=defaults["datastorage_key_limit"], type=int,
+                        help="most bytes a single value in the data storage may take up, 0 for no limit")
+    parser.add_argument('--datastorage_limit', default=defaults["datastorage_limit"], type=int,
+                        help="most bytes all values in the data storage may take up, 0 for no limit")
+    parser.add_argument('--metrics_file', default=defaults["metrics_file"],
+                        help="write counters and timings of the room to this file every 15 seconds, "
+                             "in the text format of Prometheus")
+    parser.add_argument('--workers', default=defaults["workers"], type=int,
+                        help="handle websockets, decoding and encoding of packets in this many worker processes, "
+                             "so a very large room can use more than one core. 0 to handle them in this process.")
     args = parser.parse_args()
     return args
 
 
+def format_metrics(rooms: typing.Iterable[typing.Tuple[str, Context]]) -> str:
+    """Metrics of rooms by name in the text format of Prometheus."""
+    families: typing.Dict[str, typing.Tuple[str, str, typing.List[str]]] = {}
+
+    def add(name: str, kind: str, description: str, room: str, value: float, suffix: str = "",
+            **labels: str) -> None:
+        samples = families.setdefault(f"archipelago_{name}", (kind, description, []))[2]
+        label_text = ",".join(f'{label}="{escape_label(label_value)}"'
+                              for label, label_value in {"room": room, **labels}.items())
+        samples.append(f"archipelago_{name}{suffix}{{{label_text}}} {value}")
+
+    def escape_label(value: str) -> str:
+        return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    for room, ctx in rooms:
+        for cmd, count in sorted(ctx.metrics.packets.items()):
+            add("packets_received_total", "counter", "Packets received from clients by cmd.", room, count, cmd=cmd)
+        for name, (count, seconds) in sorted(ctx.metrics.get_timings().items()):
+            description = f"Time spent on {name}."
+            add(f"{name}_seconds", "summary", description, room, count, "_count")
+            add(f"{name}_seconds", "summary", description, room, seconds, "_sum")
+        add("clients", "gauge", "Connected clients.", room, len(ctx.endpoints))
+        add("authenticated_clients", "gauge", "Connected clients that are connected to a slot.", room,
+            sum(1 for client in ctx.endpoints if client.auth))
+        outbox_stats = ctx.get_outbox_stats()
+        add("outbox_frames", "gauge", "Frames queued to be sent to clients.", room, outbox_stats["queued_frames"])
+        add("outbox_size", "gauge", "Characters queued to be sent to clients.", room, outbox_stats["queued_size"])
+        add("outbox_largest_size", "gauge", "Characters queued to be sent to the client that is furthest behind.",
+            room, outbox_stats["largest_queue_size"])
+        add("outbox_dropped_messages_total", "counter", "Text messages dropped for clients that fell behind.",
+            room, outbox_stats["dropped_messages"])
+        add("outbox_coalesced_frames_total", "counter", "Frames that were sent as part of an earlier frame.",
+            room, outbox_stats["coalesced_frames"])
+        add("outbox_overflow_disconnects_total", "counter", "Clients disconnected for falling too far behind.",
+            room, outbox_stats["overflow_disconnects"])
+        add("save_snapshot_bytes", "gauge", "Size of the last full save.", room, ctx.save_journal.snapshot_size)
+        add("save_changes_bytes", "gauge", "Size of the changes saved since the last full save.", room,
+            ctx.save_journal.changes_size)
+        add("datastorage_bytes", "gauge", "Pickled size of all values in the data storage.", room,
+            ctx.data_storage.total_size)
+        add("datastorage_keys", "gauge", "Keys in the data storage.", room, len(ctx.stored_data))
+
+    lines: typing.List[str] = []
+    for name, (kind, description, samples) in families.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+async def write_metrics(path: str, rooms: typing.Callable[[], typing.Iterable[typing.Tuple[str, Context]]],
+                        interval: float = 15) -> None:
+    """Writes the metrics of rooms to path every interval seconds, until cancelled.
+    The file is replaced at once, so that it is never read halfway through being written."""
+    while True:
+        try:
+            temp_path = path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(format_metrics(rooms()))
+            os.replace(temp_path, path)
+        except Exception as e:
+            logging.exception(e)
+        await asyncio.sleep(interval)
+
+
 async def auto_shutdown(ctx, to_cancel=None):
     with contextlib.suppress(asyncio.TimeoutError):
         await asyncio.wait_for(ctx.exit_event.wait(), ctx.auto_shutdown)
@@ -2661,23 +3433,18 @@ async def auto_shutdown(ctx, to_cancel=None):
                     await asyncio.wait_for(ctx.exit_event.wait(), seconds)
 
 
-def load_server_cert(path: str, cert_key: typing.Optional[str]) -> "ssl.SSLContext":
-    import ssl
-    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-    ssl_context.load_default_certs()
-    ssl_context.load_cert_chain(path, cert_key if cert_key else path)
-    return ssl_context
-
-
 async def main(args: argparse.Namespace):
     Utils.init_logging(name="Server",
                        loglevel=args.loglevel.lower(),
                        add_timestamp=args.logtime)
 
-    ctx = Context(args.host, args.port, args.server_password, args.password, args.location_check_points,
-                  args.hint_cost, not args.disable_item_cheat, args.release_mode, args.collect_mode,
-                  args.countdown_mode, args.remaining_mode,
-                  args.auto_shutdown, args.compatibility, args.log_network)
+    context_class = ShardedContext if args.workers > 0 else Context
+    ctx = context_class(args.host, args.port, args.server_password, args.password, args.location_check_points,
+                        args.hint_cost, not args.disable_item_cheat, args.release_mode, args.collect_mode,
+                        args.countdown_mode, args.remaining_mode,
+                        args.auto_shutdown, args.compatibility, args.log_network)
+    ctx.datastorage_key_limit = args.datastorage_key_limit
+    ctx.datastorage_limit = args.datastorage_limit
     data_filename = args.multidata
 
     if not data_filename:
@@ -2709,20 +3476,25 @@ async def main(args: argparse.Namespace):
 
     ctx.init_save(not args.disable_save)
 
-    ssl_context = load_server_cert(args.cert, args.cert_key) if args.cert else None
-
-    ctx.server = websockets.serve(
-        functools.partial(server, ctx=ctx),
-        host=ctx.host,
-        port=ctx.port,
-        ssl=ssl_context,
-        extensions=[server_per_message_deflate_factory],
-    )
+    if args.workers > 0:
+        ctx.server = WorkerPool(ctx, args.workers, args.cert, args.cert_key, args.loglevel.lower())
+    else:
+        ssl_context = load_server_cert(args.cert, args.cert_key) if args.cert else None
+
+        ctx.server = websockets.serve(
+            functools.partial(server, ctx=ctx),
+            host=ctx.host,
+            port=ctx.port,
+            ssl=ssl_context,
+            extensions=[server_per_message_deflate_factory],
+        )
     ip = args.host if args.host else Utils.get_public_ipv4()
     logging.info('Hosting game at %s:%d (%s)' % (ip, ctx.port,
                                                  'No password' if not ctx.password else 'Password: %s' % ctx.password))
 
     await ctx.server
+    if args.metrics_file:
+        async_start(write_metrics(args.metrics_file, lambda: [(ctx.seed_name, ctx)]), name="metrics")
     console_task = asyncio.create_task(console(ctx))
     if ctx.auto_shutdown:
         ctx.shutdown_task = asyncio.create_task(auto_shutdown(ctx, [console_task]))
@@ -2730,11 +3502,14 @@ async def main(args: argparse.Namespace):
     console_task.cancel()
     if ctx.shutdown_task:
         await ctx.shutdown_task
+    if isinstance(ctx.server, WorkerPool):
+        await ctx.server.wait_closed()
 
 
 client_message_processor = ClientMessageProcessor
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     try:
         asyncio.run(main(parse_args()))
     except asyncio.exceptions.CancelledError:
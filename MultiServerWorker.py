@@ -0,0 +1,140 @@
+"""
+Worker processes of a MultiServer started with --workers.
+
+Every worker accepts websocket connections from the listening socket it shares with the other workers, decodes the
+packets clients send and encodes and sends the ones that go out to them, so TLS, compression and JSON run on more than
+one core. The MultiServer process keeps the only Context and talks to each worker over a local connection with length
+prefixed pickles:
+
+worker -> server: ("connect", connection, compressed), ("msgs", connection, [cmd, ...]), ("disconnect", connection)
+server -> worker: ("send", [connection, ...], pickled [cmd, ...], reply),
+                  ("send_encoded", [connection, ...], text, reply), ("close", connection)
+
+What goes out to a client is queued in its Outbox, so a slow client only holds up its own messages.
+
+This module is imported by the worker processes, so it does not import MultiServer.
+"""
+from __future__ import annotations
+
+import asyncio
+import collections
+import itertools
+import logging
+import pickle
+import socket
+import struct
+import typing
+
+import websockets
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+
+import Utils
+from NetUtils import Outbox, decode, encode, load_server_cert
+
+if typing.TYPE_CHECKING:
+    from websockets.extensions import ServerExtensionFactory
+    from NetUtils import ServerConnection
+
+frame_header = struct.Struct("<I")
+logger = logging.getLogger("ServerWorker")
+
+
+async def read_frame(reader: asyncio.StreamReader) -> typing.Any:
+    size, = frame_header.unpack(await reader.readexactly(frame_header.size))
+    return pickle.loads(await reader.readexactly(size))
+
+
+def write_frame(writer: asyncio.StreamWriter, frame: typing.Any) -> None:
+    data = pickle.dumps(frame, pickle.HIGHEST_PROTOCOL)
+    writer.write(frame_header.pack(len(data)) + data)
+
+
+def create_listening_socket(host: typing.Optional[str], port: int) -> socket.socket:
+    """Binds the socket the workers accept clients from. Without a host it listens on all interfaces, like
+    websockets.serve."""
+    if not host and socket.has_dualstack_ipv6():
+        return socket.create_server(("", port), family=socket.AF_INET6, dualstack_ipv6=True)
+    return socket.create_server((host or "", port))
+
+
+class Worker:
+    connections: typing.Dict[int, "ServerConnection"]
+    outboxes: typing.Dict[int, Outbox]
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self.connections = {}
+        self.outboxes = {}
+        self.connection_ids = itertools.count(1)
+        self.outbox_stats: typing.Counter[str] = collections.Counter()
+
+    async def handle(self, websocket: "ServerConnection", path: str = "/") -> None:
+        connection = next(self.connection_ids)
+        self.connections[connection] = websocket
+        self.outboxes[connection] = Outbox(websocket, self.outbox_stats)
+        compressed = any(isinstance(extension, PerMessageDeflate) for extension in websocket.extensions)
+        write_frame(self.writer, ("connect", connection, compressed))
+        try:
+            async for data in websocket:
+                write_frame(self.writer, ("msgs", connection, decode(data)))
+                await self.writer.drain()
+        except Exception as e:
+            if not isinstance(e, websockets.WebSocketException):
+                logger.exception(e)
+        finally:
+            del self.connections[connection]
+            self.outboxes.pop(connection).clear()
+            if not self.writer.is_closing():
+                write_frame(self.writer, ("disconnect", connection))
+
+    async def receive(self, reader: asyncio.StreamReader) -> None:
+        """Carries out what the server sends, until it goes away."""
+        while True:
+            try:
+                frame = await read_frame(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return
+            command = frame[0]
+            if command == "close":
+                websocket = self.connections.get(frame[1])
+                if websocket:
+                    asyncio.create_task(websocket.close())
+                continue
+            if command == "send":
+                reply = frame[3]
+                msgs = pickle.loads(frame[2])
+                data = encode(msgs)
+                text = not reply and all(msg["cmd"] == "PrintJSON" for msg in msgs)
+                messages = len(msgs)
+            elif command == "send_encoded":
+                data = frame[2]
+                reply = frame[3]
+                text = False
+                messages = 1
+            else:
+                logger.error(f"Unknown command from server: {command}")
+                continue
+            for connection in frame[1]:
+                outbox = self.outboxes.get(connection)
+                if outbox:
+                    outbox.put(data, text, messages, reply)
+
+
+async def serve(listening_socket: socket.socket, address: typing.Tuple[str, int], token: bytes,
+                extensions: typing.Sequence["ServerExtensionFactory"], cert: typing.Optional[str] = None,
+                cert_key: typing.Optional[str] = None) -> None:
+    reader, writer = await asyncio.open_connection(*address)
+    writer.write(token)
+    worker = Worker(writer)
+    ssl_context = load_server_cert(cert, cert_key) if cert else None
+    async with websockets.serve(worker.handle, sock=listening_socket, ssl=ssl_context, extensions=extensions):
+        await worker.receive(reader)
+    writer.close()
+
+
+def run(index: int, listening_socket: socket.socket, address: typing.Tuple[str, int], token: bytes,
+        extensions: typing.Sequence["ServerExtensionFactory"], cert: typing.Optional[str] = None,
+        cert_key: typing.Optional[str] = None, loglevel: str = "info") -> None:
+    """Entry point of a worker process."""
+    Utils.init_logging(f"ServerWorker{index}", loglevel=loglevel)
+    asyncio.run(serve(listening_socket, address, token, extensions, cert, cert_key))
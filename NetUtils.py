@@ -1,15 +1,22 @@
 from __future__ import annotations
 
-from collections.abc import Mapping, Sequence
+from collections.abc import Mapping, MutableMapping, Sequence
+import asyncio
+import collections
 import typing
 import enum
+import logging
+import math
+import struct
 import warnings
+import zlib
 from json import JSONEncoder, JSONDecoder
 
 if typing.TYPE_CHECKING:
+    import ssl
     from websockets import WebSocketServerProtocol as ServerConnection
 
-from Utils import ByValue, Version
+from Utils import ByValue, Version, restricted_dumps, restricted_loads
 
 
 class HintStatus(ByValue, enum.IntEnum):
@@ -135,8 +142,12 @@ _encode = JSONEncoder(
 ).encode
 
 
-def encode(obj: typing.Any) -> str:
-    return _encode(_scan_for_TypedTuples(obj))
+def splice_encoded(fields: typing.Iterable[typing.Tuple[str, str]], encoded_object: str = "{}") -> str:
+    """Adds fields with already encoded values to the end of an encoded JSON object, without decoding anything."""
+    parts = [f"{_encode(key)}:{value}" for key, value in fields]
+    if encoded_object != "{}":
+        parts.insert(0, encoded_object[1:-1])
+    return "{" + ",".join(parts) + "}"
 
 
 def get_any_version(data: dict) -> Version:
@@ -162,15 +173,119 @@ def _object_hook(o: typing.Any) -> typing.Any:
             return hook(o)
         cls = allowlist.get(o.get("class", None), None)
         if cls:
-            for key in tuple(o):
-                if key not in cls._fields:
-                    del (o[key])
-            return cls(**o)
+            # like cls(**o) without the unknown keys, but a lot faster for the thousands of NetworkItems of a packet
+            defaults = cls._field_defaults
+            try:
+                return cls._make([o[field] if field in o else defaults[field] for field in cls._fields])
+            except KeyError as e:
+                raise TypeError(f"{cls.__name__} is missing {e}") from None
 
     return o
 
 
-decode = JSONDecoder(object_hook=_object_hook).decode
+_decode = JSONDecoder(object_hook=_object_hook).decode
+
+
+def _orjson_default(obj: typing.Any) -> typing.Any:
+    if isinstance(obj, tuple):
+        fields = getattr(obj, "_fields", None)
+        if fields is not None:  # NamedTuple is not actually a parent class
+            data = dict(zip(fields, obj))
+            data["class"] = obj.__class__.__name__
+            return data
+        return list(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+def _has_non_finite_float(obj: typing.Any) -> bool:
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_has_non_finite_float(key) or _has_non_finite_float(value) for key, value in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return any(_has_non_finite_float(value) for value in obj)
+    return False
+
+
+class JSONCodec:
+    """
+    Turns commands into the JSON text of the protocol and back, including NamedTuples like NetworkItem, which are sent
+    as objects with a "class" field. This one uses the json module of the standard library.
+    """
+    name: typing.ClassVar[str] = "json"
+
+    def encode(self, obj: typing.Any) -> str:
+        return _encode(_scan_for_TypedTuples(obj))
+
+    def decode(self, data: str) -> typing.Any:
+        return _decode(data)
+
+
+class OrjsonCodec(JSONCodec):
+    """
+    Uses orjson, which writes NamedTuples as it goes instead of working on a copy of everything with them replaced.
+    Text that could contain a "class" field is decoded by the json module, which builds the NamedTuples faster than
+    going over what orjson decoded again. So is whatever orjson can't handle, like integers beyond 64 bits or NaN.
+    orjson writes NaN and infinity as null, so anything it wrote null into is looked through for them and, if there
+    are any, encoded by the json module as well, which writes them as NaN and Infinity.
+    """
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+        self.dumps = orjson.dumps
+        self.loads = orjson.loads
+        self.option = orjson.OPT_NON_STR_KEYS
+
+    def encode(self, obj: typing.Any) -> str:
+        try:
+            data = self.dumps(obj, default=_orjson_default, option=self.option)
+        except TypeError:  # includes orjson.JSONEncodeError
+            return super().encode(obj)
+        if b"null" in data and _has_non_finite_float(obj):
+            return super().encode(obj)
+        return data.decode("utf-8")
+
+    def decode(self, data: str) -> typing.Any:
+        # "class" might also be written with escapes
+        if '"class"' in data or "\\u" in data:
+            return super().decode(data)
+        try:
+            return self.loads(data)
+        except ValueError:  # includes orjson.JSONDecodeError
+            return super().decode(data)
+
+
+codecs: typing.Dict[str, typing.Type[JSONCodec]] = {codec_type.name: codec_type
+                                                    for codec_type in (JSONCodec, OrjsonCodec)}
+codec: JSONCodec
+""" used by encode and decode, see use_codec """
+
+
+def use_codec(name: typing.Optional[str] = None) -> JSONCodec:
+    """Makes encode and decode use the codec of that name, or without a name the fastest one that is installed."""
+    global codec
+    if name:
+        codec = codecs[name]()
+    else:
+        try:
+            codec = OrjsonCodec()
+        except ImportError:
+            codec = JSONCodec()
+    return codec
+
+
+def encode(obj: typing.Any) -> str:
+    return codec.encode(obj)
+
+
+def decode(data: str) -> typing.Any:
+    return codec.decode(data)
+
+
+use_codec()
 
 
 class Endpoint:
@@ -182,6 +297,128 @@ class Endpoint:
         self.socket = socket
 
 
+class Outbox:
+    """
+    Frames waiting to be sent to one websocket, written by a single task while there are any.
+    Consecutive frames are joined into one, which is possible as every frame is a JSON list of commands.
+    A client that can't keep up loses its queued text first, which is replaced by a notice of how many messages it
+    missed. If it falls behind by more than limit even without text, it gets disconnected. Replies to its own requests
+    are never dropped and don't count towards limit, so a reply larger than that, like a full data package, is only
+    slow to arrive.
+    """
+    frames: typing.Deque[typing.Tuple[str, int, bool, bool]]
+    """ encoded frame, number of commands in it, whether it is text that may be dropped and whether it is a reply """
+    size: int
+    """ characters in frames """
+    text_size: int
+    """ characters in frames that are text """
+    reply_size: int
+    """ characters in frames that are replies """
+    skipped: int
+    """ text commands dropped since a frame was last sent """
+    stats: typing.Counter[str]
+    """ dropped_messages, coalesced_frames and overflow_disconnects, usually shared by all outboxes of a server """
+    text_limit: int = 1024 * 1024
+    limit: int = 16 * 1024 * 1024
+    frame_limit: int = 64 * 1024
+    """ frames are not joined beyond this many characters """
+
+    def __init__(self, socket: "ServerConnection", stats: typing.Optional[typing.Counter[str]] = None) -> None:
+        self.socket = socket
+        self.frames = collections.deque()
+        self.size = 0
+        self.text_size = 0
+        self.reply_size = 0
+        self.skipped = 0
+        self.stats = collections.Counter() if stats is None else stats
+        self.task: typing.Optional[asyncio.Task[None]] = None
+        self.closing = False
+
+    def put(self, frame: str, text: bool = False, messages: int = 1, reply: bool = False) -> None:
+        if self.closing or not self.socket.open:
+            return
+        self.frames.append((frame, messages, text, reply))
+        self.size += len(frame)
+        if text:
+            self.text_size += len(frame)
+        if reply:
+            self.reply_size += len(frame)
+        if self.size - self.reply_size > self.text_limit:
+            self.drop_text()
+            if self.size - self.reply_size > self.limit:
+                self.clear()
+                self.closing = True
+                self.stats["overflow_disconnects"] += 1
+                logging.warning("Disconnecting a client that can't keep up with the messages sent to it.")
+                self.task = asyncio.create_task(self.socket.close())
+                return
+        if not self.task:
+            self.task = asyncio.create_task(self.send())
+
+    def drop_text(self) -> None:
+        if not self.text_size:
+            return
+        kept: typing.Deque[typing.Tuple[str, int, bool, bool]] = collections.deque()
+        for frame, messages, text, reply in self.frames:
+            if text:
+                self.size -= len(frame)
+                self.skipped += messages
+                self.stats["dropped_messages"] += messages
+            else:
+                kept.append((frame, messages, text, reply))
+        self.frames = kept
+        self.text_size = 0
+
+    def clear(self) -> None:
+        self.frames.clear()
+        self.size = 0
+        self.text_size = 0
+        self.reply_size = 0
+
+    def _pop_frame(self) -> str:
+        frame, _, text, reply = self.frames.popleft()
+        self.size -= len(frame)
+        if text:
+            self.text_size -= len(frame)
+        if reply:
+            self.reply_size -= len(frame)
+        return frame
+
+    def next_frame(self) -> str:
+        frame = self._pop_frame()
+        if self.skipped:
+            notice = encode([{"cmd": "PrintJSON", "data": [{"text": f"{self.skipped} messages were skipped, "
+                                                                      f"as they could not be sent fast enough."}]}])
+            frame = notice[:-1] + "," + frame[1:]
+            self.skipped = 0
+        while self.frames and len(frame) + len(self.frames[0][0]) <= self.frame_limit:
+            following = self._pop_frame()
+            frame = frame[:-1] + "," + following[1:]
+            self.stats["coalesced_frames"] += 1
+        return frame
+
+    async def send(self) -> None:
+        try:
+            while self.frames and self.socket.open:
+                await self.socket.send(self.next_frame())
+        except Exception as e:
+            import websockets
+            if not isinstance(e, websockets.ConnectionClosed):
+                logging.exception(e)
+        finally:
+            if not self.socket.open:
+                self.clear()
+            self.task = None
+
+
+def load_server_cert(path: str, cert_key: typing.Optional[str]) -> "ssl.SSLContext":
+    import ssl
+    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ssl_context.load_default_certs()
+    ssl_context.load_cert_chain(path, cert_key if cert_key else path)
+    return ssl_context
+
+
 class HandlerMeta(type):
     def __new__(mcs, name, bases, attrs):
         handlers = attrs["handlers"] = {}
@@ -415,8 +652,16 @@ class Hint(typing.NamedTuple):
 
 
 class _LocationStore(dict, typing.MutableMapping[int, typing.Dict[int, typing.Tuple[int, int, int]]]):
+    # Indices of the locations by receiving player and item, and by receiving player and sending player.
+    # They are built on first use and assume the store does not get modified after that, like the MultiServer does.
+    # Entries are (position in the store, sending player, location, flags) so results can keep the order of the store.
+    _item_index: typing.Optional[typing.Dict[typing.Tuple[int, int], typing.List[typing.Tuple[int, int, int, int]]]]
+    _receiver_index: typing.Optional[typing.Dict[int, typing.Dict[int, typing.List[int]]]]
+
     def __init__(self, values: typing.MutableMapping[int, typing.Dict[int, typing.Tuple[int, int, int]]]):
         super().__init__(values)
+        self._item_index = None
+        self._receiver_index = None
 
         if not self:
             raise ValueError(f"Rejecting game with 0 players")
@@ -427,21 +672,35 @@ class _LocationStore(dict, typing.MutableMapping[int, typing.Dict[int, typing.Tu
         if len(self.get(0, {})):
             raise ValueError("Invalid player id 0 for location")
 
-    def find_item(self, slots: typing.Set[int], seeked_item_id: int
-                  ) -> typing.Generator[typing.Tuple[int, int, int, int, int], None, None]:
+    def _build_indices(self) -> None:
+        item_index: typing.Dict[typing.Tuple[int, int], typing.List[typing.Tuple[int, int, int, int]]] = {}
+        receiver_index: typing.Dict[int, typing.Dict[int, typing.List[int]]] = {}
+        position = 0
         for finding_player, check_data in self.items():
             for location_id, (item_id, receiving_player, item_flags) in check_data.items():
-                if receiving_player in slots and item_id == seeked_item_id:
-                    yield finding_player, location_id, item_id, receiving_player, item_flags
+                item_index.setdefault((receiving_player, item_id), []).append(
+                    (position, finding_player, location_id, item_flags))
+                receiver_index.setdefault(receiving_player, {}).setdefault(finding_player, []).append(location_id)
+                position += 1
+        self._item_index = item_index
+        self._receiver_index = receiver_index
+
+    def find_item(self, slots: typing.Set[int], seeked_item_id: int
+                  ) -> typing.Generator[typing.Tuple[int, int, int, int, int], None, None]:
+        if self._item_index is None:
+            self._build_indices()
+        found = [(entry, receiving_player) for receiving_player in slots
+                 for entry in self._item_index.get((receiving_player, seeked_item_id), ())]
+        if len(slots) > 1:
+            found.sort()
+        for (_, finding_player, location_id, item_flags), receiving_player in found:
+            yield finding_player, location_id, seeked_item_id, receiving_player, item_flags
 
     def get_for_player(self, slot: int) -> typing.Dict[int, typing.Set[int]]:
-        import collections
-        all_locations: typing.Dict[int, typing.Set[int]] = collections.defaultdict(set)
-        for source_slot, location_data in self.items():
-            for location_id, values in location_data.items():
-                if values[1] == slot:
-                    all_locations[source_slot].add(location_id)
-        return all_locations
+        if self._receiver_index is None:
+            self._build_indices()
+        return {source_slot: set(location_ids)
+                for source_slot, location_ids in self._receiver_index.get(slot, {}).items()}
 
     def get_checked(self, state: typing.Dict[typing.Tuple[int, int], typing.Set[int]], team: int, slot: int
                     ) -> typing.List[int]:
@@ -510,6 +769,83 @@ class MultiData(typing.TypedDict):
     race_mode: int
 
 
+multidata_format_version = 4
+"""
+Format of the .archipelago files written by write_multidata. After the version byte, every top level key of the
+multidata is its own frame of a length prefixed name and a length prefixed, zlib compressed pickle of its value.
+Format 3 and older are a single zlib compressed pickle of the whole multidata.
+"""
+_frame_header = struct.Struct("<HQ")  # length of the name, length of the compressed data
+
+
+class _Frame(typing.NamedTuple):
+    data: memoryview
+
+
+class MultiDataSections(MutableMapping[str, typing.Any]):
+    """
+    Multidata of format 4, which only decompresses and unpickles a section once it gets accessed.
+    Sections that never got accessed get written back by write_multidata as they were read.
+    """
+    _sections: dict[str, typing.Any]
+
+    def __init__(self, data: bytes) -> None:
+        self._sections = {}
+        view = memoryview(data)
+        position = 1
+        while position < len(view):
+            if position + _frame_header.size > len(view):
+                raise ValueError("Truncated multidata.")
+            name_length, data_length = _frame_header.unpack_from(view, position)
+            position += _frame_header.size
+            end = position + name_length + data_length
+            if end > len(view):
+                raise ValueError("Truncated multidata.")
+            name = str(view[position:position + name_length], "utf-8")
+            self._sections[name] = _Frame(view[position + name_length:end])
+            position = end
+
+    def __getitem__(self, key: str) -> typing.Any:
+        value = self._sections[key]
+        if isinstance(value, _Frame):
+            value = self._sections[key] = restricted_loads(zlib.decompress(value.data))
+        return value
+
+    def __setitem__(self, key: str, value: typing.Any) -> None:
+        self._sections[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self._sections[key]
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self._sections)
+
+    def __len__(self) -> int:
+        return len(self._sections)
+
+    def encoded_section(self, key: str) -> memoryview | None:
+        """The compressed data of a section, if it was not accessed since it was read."""
+        value = self._sections[key]
+        return value.data if isinstance(value, _Frame) else None
+
+
+def write_multidata(file: typing.BinaryIO, multidata: Mapping[str, typing.Any], compression: int = 6) -> None:
+    """
+    Writes multidata in the current format to a binary file. Sections are serialized and compressed one at a time, so
+    the whole multidata never has to be held in memory as one pickle.
+    compression is the zlib level, from 1 (fastest) to 9 (smallest).
+    """
+    file.write(bytes([multidata_format_version]))
+    for name in multidata:
+        data = multidata.encoded_section(name) if isinstance(multidata, MultiDataSections) else None
+        if data is None:
+            data = zlib.compress(restricted_dumps(multidata[name]), compression)
+        encoded_name = name.encode("utf-8")
+        file.write(_frame_header.pack(len(encoded_name), len(data)))
+        file.write(encoded_name)
+        file.write(data)
+
+
 if typing.TYPE_CHECKING:  # type-check with pure python implementation until we have a typing stub
     LocationStore = _LocationStore
 else:
@@ -0,0 +1,280 @@
+"""
+Opt-in profiling of generation, enabled with Generate's --profile_report.
+
+Every span records wall time, CPU time of the thread it ran on and the change of the memory traced by tracemalloc while
+it ran, together with counters like swaps, sweeps and can_reach calls that happened inside of it. The memory delta is
+process wide, so it includes other threads, and it is negative if the span freed more than it allocated. The report is
+written as a Chrome trace event file, which can be opened as a flame graph in Perfetto (ui.perfetto.dev), speedscope or
+chrome://tracing. Totals per stage and per player are stored next to the events under "otherData".
+
+While no report is running, spans and counters cost no more than a function call.
+"""
+from __future__ import annotations
+
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+import tracemalloc
+import typing
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+__all__ = ["ProfileReport", "start", "stop", "profile", "span", "count", "profiled", "spanned"]
+
+T = TypeVar("T")
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class Span:
+    __slots__ = ("name", "category", "player", "args", "thread", "parent", "start", "wall", "cpu",
+                 "memory_delta", "counters")
+
+    name: str
+    category: str
+    player: Optional[int]
+    args: Dict[str, Any]
+    thread: int
+    parent: Optional[Span]
+    start: float
+    wall: float
+    cpu: float
+    memory_delta: int
+    counters: typing.Counter[str]
+
+    def __init__(self, name: str, category: str, player: Optional[int], args: Dict[str, Any], thread: int,
+                 parent: Optional[Span]) -> None:
+        self.name = name
+        self.category = category
+        self.player = player
+        self.args = args
+        self.thread = thread
+        self.parent = parent
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.memory_delta = 0
+        self.counters = Counter()
+
+
+class ProfileReport:
+    """Collects the spans and counters of one generation."""
+    spans: List[Span]
+    counters: typing.Counter[str]
+    trace_memory: bool
+
+    def __init__(self, trace_memory: bool = True) -> None:
+        self.spans = []
+        self.counters = Counter()
+        self.trace_memory = trace_memory
+        self._origin = time.perf_counter()
+        self._local = threading.local()
+        self._threads: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def _stack(self) -> List[Span]:
+        stack: Optional[List[Span]] = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _thread(self) -> int:
+        ident = threading.get_ident()
+        with self._lock:
+            return self._threads.setdefault(ident, len(self._threads) + 1)
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str = "generation", player: Optional[int] = None,
+             **args: Any) -> Iterator[Span]:
+        stack = self._stack()
+        current = Span(name, category, player, args, self._thread(), stack[-1] if stack else None)
+        stack.append(current)
+        memory = tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+        cpu = time.thread_time()
+        current.start = time.perf_counter()
+        try:
+            yield current
+        finally:
+            current.wall = time.perf_counter() - current.start
+            current.cpu = time.thread_time() - cpu
+            if self.trace_memory:
+                current.memory_delta = tracemalloc.get_traced_memory()[0] - memory
+            stack.pop()
+            if stack:
+                # the counters of a span are included in the ones of the span it ran in
+                stack[-1].counters.update(current.counters)
+            with self._lock:
+                self.spans.append(current)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        stack = self._stack()
+        if stack:
+            stack[-1].counters[name] += amount
+        with self._lock:
+            self.counters[name] += amount
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals of every span name and every player, without counting spans that ran inside a span of the same
+        name twice."""
+        stages: Dict[str, Dict[str, Any]] = {}
+        players: Dict[int, Dict[str, Any]] = {}
+
+        def add(totals: Dict[str, Any], span_: Span) -> None:
+            totals["calls"] = totals.get("calls", 0) + 1
+            totals["wall"] = totals.get("wall", 0.0) + span_.wall
+            totals["cpu"] = totals.get("cpu", 0.0) + span_.cpu
+            totals["memory_delta"] = totals.get("memory_delta", 0) + span_.memory_delta
+            counters: Dict[str, int] = totals.setdefault("counters", {})
+            for counter, amount in span_.counters.items():
+                counters[counter] = counters.get(counter, 0) + amount
+
+        def nested(span_: Span) -> bool:
+            parent = span_.parent
+            while parent:
+                if parent.name == span_.name and parent.player == span_.player:
+                    return True
+                parent = parent.parent
+            return False
+
+        for span_ in sorted(self.spans, key=lambda s: s.start):
+            if nested(span_):
+                continue
+            if span_.player is None:
+                add(stages.setdefault(span_.name, {}), span_)
+            else:
+                player = players.setdefault(span_.player, {"stages": {}})
+                for key in ("player_name", "game"):
+                    if key in span_.args:
+                        player[key] = span_.args[key]
+                add(player, span_)
+                add(player["stages"].setdefault(span_.name, {}), span_)
+        return {"stages": stages, "players": players, "counters": dict(self.counters)}
+
+    def to_trace(self) -> Dict[str, Any]:
+        events: List[Dict[str, Any]] = []
+        for span_ in sorted(self.spans, key=lambda s: (s.thread, s.start)):
+            args: Dict[str, Any] = {"cpu_ms": round(span_.cpu * 1000, 3), "memory_delta_bytes": span_.memory_delta,
+                                    **span_.args, **span_.counters}
+            if span_.player is not None:
+                args["player"] = span_.player
+            events.append({
+                "name": span_.name if span_.player is None else f"{span_.name} (Player {span_.player})",
+                "cat": span_.category,
+                "ph": "X",
+                "ts": round((span_.start - self._origin) * 1_000_000, 1),
+                "dur": round(span_.wall * 1_000_000, 1),
+                "pid": 1,
+                "tid": span_.thread,
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.summary()}
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_trace(), f, indent=1, default=str)
+
+
+_report: Optional[ProfileReport] = None
+_patched: Dict[type, Callable[..., bool]] = {}
+_started_tracemalloc = False
+
+
+def _counting_can_reach(cls: type, original: Callable[..., bool]) -> Callable[..., bool]:
+    counter = f"{cls.__name__}.can_reach"
+
+    def can_reach(self: Any, state: Any) -> bool:
+        report = _report
+        if report:
+            report.count(counter)
+        return original(self, state)
+    return can_reach
+
+
+def start(trace_memory: bool = True) -> ProfileReport:
+    """Starts collecting a new report, replacing any that is still running."""
+    global _report, _started_tracemalloc
+    from BaseClasses import Entrance, Location, Region
+
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+    # can_reach is far too hot to check for a running report, so it only gets counted while one runs
+    for cls in (Location, Region, Entrance):
+        if cls not in _patched:
+            _patched[cls] = cls.__dict__["can_reach"]
+            cls.can_reach = _counting_can_reach(cls, _patched[cls])
+    _report = ProfileReport(trace_memory)
+    return _report
+
+
+def stop() -> Optional[ProfileReport]:
+    """Stops collecting and returns the report that was running, if any."""
+    global _report, _started_tracemalloc
+    report, _report = _report, None
+    for cls, original in _patched.items():
+        cls.can_reach = original
+    _patched.clear()
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+    return report
+
+
+@contextlib.contextmanager
+def profile(path: Optional[str]) -> Iterator[Optional[ProfileReport]]:
+    """Collects a report for the duration of the context and writes it to path. Does nothing if path is empty."""
+    if not path:
+        yield None
+        return
+    report = start()
+    try:
+        yield report
+    finally:
+        stop()
+        report.write(path)
+        logging.info(f"Wrote profile report with {len(report.spans)} spans to {path}.")
+
+
+@contextlib.contextmanager
+def span(name: str, category: str = "generation", player: Optional[int] = None, **args: Any) -> Iterator[None]:
+    """Records the wrapped block into the running report, if there is one."""
+    report = _report
+    if report is None:
+        yield
+    else:
+        with report.span(name, category, player, **args):
+            yield
+
+
+def count(name: str, amount: int = 1) -> None:
+    """Adds to a counter of the running report and of its innermost span on this thread, if there is a report."""
+    report = _report
+    if report is not None:
+        report.count(name, amount)
+
+
+def profiled(func: Callable[..., T], name: str, category: str = "generation",
+             player: Optional[int] = None) -> Callable[..., T]:
+    """Wraps func to run inside a span, for work that gets submitted to another thread."""
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        with span(name, category, player):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def spanned(category: str = "generation", label: Optional[str] = None) -> Callable[[F], F]:
+    """Decorator that runs every call of the function inside a span. If label names a keyword argument that the call
+    passes, its value is added to the span name."""
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _report is None:
+                return func(*args, **kwargs)
+            name = func.__name__
+            if label and label in kwargs:
+                name = f"{name} ({kwargs[label]})"
+            with _report.span(name, category):
+                return func(*args, **kwargs)
+        return typing.cast(F, wrapper)
+    return decorator
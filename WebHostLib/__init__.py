@@ -29,7 +29,15 @@ app.config["HOSTERS"] = 8  # maximum concurrent room hosters
 app.config["SELFLAUNCH"] = True  # application process is in charge of launching Rooms.
 app.config["SELFLAUNCHCERT"] = None  # can point to a SSL Certificate to encrypt Room websocket connections
 app.config["SELFLAUNCHKEY"] = None  # can point to a SSL Certificate Key to encrypt Room websocket connections
+app.config["ROOM_METRICS_PATH"] = None  # can point to a folder each room hoster writes metrics of its rooms into
+# share of a core a room hoster has to be using for one of its rooms to get moved to another hoster. None to never move
+app.config["HOSTER_CPU_LIMIT"] = 0.9
+# most bytes a single value and all values of the data storage of a room may take up pickled, 0 for no limit
+app.config["DATASTORAGE_KEY_LIMIT"] = 0
+app.config["DATASTORAGE_LIMIT"] = 0
 app.config["SELFGEN"] = True  # application process is in charge of scheduling Generations.
+# where the application process gets told about new Rooms, Generations and Commands. None to look for them every 0.1s
+app.config["WAKEUP_ADDRESS"] = ("127.0.0.1", 38280)
 app.config["DEBUG"] = False
 app.config["PORT"] = 80
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -40,6 +48,8 @@ app.config["SECRET_KEY"] = bytes(socket.gethostname(), encoding="utf-8")
 app.config["JOB_THRESHOLD"] = 1
 # after what time in seconds should generation be aborted, freeing the queue slot. Can be set to None to disable.
 app.config["JOB_TIME"] = 600
+# estimated memory in bytes each web process may use to keep decoded multidata and data packages for trackers
+app.config["TRACKER_DATA_CACHE_MEMORY"] = 128 * 1024 * 1024
 # memory limit for generator processes in bytes
 app.config["GENERATOR_MEMORY_LIMIT"] = 4294967296
 app.config['SESSION_PERMANENT'] = True
@@ -1,13 +1,15 @@
 from datetime import datetime, timezone
-from typing import Any, TypedDict
+from typing import Any, Iterable, TypedDict
 from uuid import UUID
 
-from flask import abort
+from flask import Response, abort, make_response, request
 
 from NetUtils import ClientStatus, Hint, NetworkItem, SlotType
+from Utils import restricted_loads
 from WebHostLib import cache
 from WebHostLib.api import api_endpoints
-from WebHostLib.models import Room
+from WebHostLib.customserver import get_save_generation
+from WebHostLib.models import Room, SaveChange
 from WebHostLib.tracker import TrackerData
 
 
@@ -158,6 +160,119 @@ def tracker_data(tracker: UUID) -> dict[str, Any]:
     }
 
 
+class TrackerChanges(TypedDict):
+    generation: int
+    reset: bool
+    player_items_received: list[PlayerItemsReceived]
+    player_checks_done: list[PlayerChecksDone]
+    hints: list[PlayerHints]
+    player_status: list[PlayerStatus]
+
+
+def _collect_changes(changes: Iterable[list[tuple[str, str, Any, Any]]], tracker_changes: TrackerChanges) -> bool:
+    """
+    Sums up changes taken by a SaveJournal into tracker_changes.
+
+    :return: False if a section that is tracked got replaced as a whole, so its changes are not known per player.
+    """
+    items: dict[tuple[int, int], list[NetworkItem]] = {}
+    checks: dict[tuple[int, int], set[int]] = {}
+    hints: dict[tuple[int, int], set[Hint]] = {}
+    status: dict[tuple[int, int], ClientStatus] = {}
+    for change in changes:
+        for operation, section, key, value in change:
+            if section not in {"received_items", "location_checks", "hints", "client_game_state"}:
+                continue
+            if operation == "replace":
+                return False
+            if section == "received_items":
+                team, player, remote = key
+                if remote and operation == "extend":
+                    items.setdefault((team, player), []).extend(value)
+            elif section == "location_checks":
+                checks[key] = value if operation == "set" else set()
+            elif section == "hints":
+                hints[key] = value if operation == "set" else set()
+            else:
+                status[key] = value if operation == "set" else ClientStatus.CLIENT_UNKNOWN
+
+    for (team, player), player_items in sorted(items.items()):
+        tracker_changes["player_items_received"].append({"team": team, "player": player, "items": player_items})
+    for (team, player), locations in sorted(checks.items()):
+        tracker_changes["player_checks_done"].append({"team": team, "player": player, "locations": sorted(locations)})
+    for (team, player), player_hints in sorted(hints.items()):
+        tracker_changes["hints"].append({"team": team, "player": player, "hints": sorted(player_hints)})
+    for (team, player), player_status in sorted(status.items()):
+        tracker_changes["player_status"].append({"team": team, "player": player, "status": player_status})
+    return True
+
+
+@api_endpoints.route("/tracker_changes/<suuid:tracker>")
+def tracker_changes(tracker: UUID) -> Response:
+    """
+    Outputs json data to <root_path>/api/tracker_changes/<id of current session tracker>?since=<generation>.
+
+    :param tracker: UUID of current session tracker.
+
+    :return: What changed for the players of the room since the save generation given as since, or everything if it is
+        missing or no longer in the room's change log. Responses carry the generation as ETag, so polling with
+        If-None-Match only costs a single query while nothing gets saved.
+    """
+    room: Room | None = Room.get(tracker=tracker)
+    if not room:
+        abort(404)
+
+    first, generation = get_save_generation(room)
+    etag = str(generation)
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        return response
+
+    result: TrackerChanges = {
+        "generation": generation,
+        "reset": False,
+        "player_items_received": [],
+        "player_checks_done": [],
+        "hints": [],
+        "player_status": [],
+    }
+    since = request.args.get("since", type=int)
+    if since is None or not first or not first <= since <= generation:
+        result["reset"] = True
+    else:
+        # changes saved after the generation was read are left for the next poll, which asks for them by the ETag
+        changes = room.save_changes.select(lambda change: change.id > since and change.id <= generation) \
+            .order_by(SaveChange.id)
+        result["reset"] = not _collect_changes(
+            (restricted_loads(change.data) for change in changes.prefetch(SaveChange.data)), result)
+        # a multisave written in between deletes the changes it contains, so some of them may have been missed
+        if not result["reset"] and get_save_generation(room)[0] != first:
+            result["reset"] = True
+    if result["reset"]:
+        for key in ("player_items_received", "player_checks_done", "hints", "player_status"):
+            result[key].clear()
+        tracker_data = TrackerData(room, generation)
+        for team, players in tracker_data.get_all_players().items():
+            for player in players:
+                result["player_items_received"].append(
+                    {"team": team, "player": player, "items": tracker_data.get_player_received_items(team, player)})
+                result["player_checks_done"].append(
+                    {"team": team, "player": player,
+                     "locations": sorted(tracker_data.get_player_checked_locations(team, player))})
+                result["player_status"].append(
+                    {"team": team, "player": player,
+                     "status": tracker_data.get_player_client_status(team, player)})
+        for team, players in tracker_data.get_all_slots().items():
+            for player in players:
+                result["hints"].append(
+                    {"team": team, "player": player, "hints": sorted(tracker_data.get_player_hints(team, player))})
+
+    response = make_response(result)
+    response.set_etag(etag)
+    return response
+
+
 class PlayerGroups(TypedDict):
     slot: int
     name: str
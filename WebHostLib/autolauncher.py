@@ -1,21 +1,39 @@
 from __future__ import annotations
 
+import atexit
 import json
 import logging
 import multiprocessing
+import os
+import tempfile
+import time
 import typing
 from datetime import timedelta, datetime
 from threading import Event, Thread
 from typing import Any
 from uuid import UUID
 
-from pony.orm import db_session, select, commit, PrimaryKey
+from pony.orm import db_session, select, commit, PrimaryKey, raw_sql
 
-from Utils import restricted_loads
+from Utils import cache_argsless, restricted_loads
+from . import wakeup
 from .locker import Locker, AlreadyRunningException
 
 _stop_event = Event()
 
+# seconds between looking through the database for work without being woken up for it, if wake-ups can be received
+rescan_interval = 10
+# seconds between looking for overloaded hosters to move a room away from
+rebalance_interval = 60
+# per-room timeout check for the databases it can be written for, as PonyORM can't translate it
+_room_timeout_sql: dict[str, str] = {
+    "sqlite": "\"room\".\"last_activity\" >= "
+              "strftime('%Y-%m-%d %H:%M:%f', $now, '-' || (\"room\".\"timeout\" + 5) || ' seconds')",
+    "postgres": "\"room\".\"last_activity\" >= $now - (\"room\".\"timeout\" + 5) * interval '1 second'",
+    "cockroach": "\"room\".\"last_activity\" >= $now - (\"room\".\"timeout\" + 5) * interval '1 second'",
+    "mysql": "`room`.`last_activity` >= $now - INTERVAL (`room`.`timeout` + 5) SECOND",
+}
+
 
 def stop() -> None:
     """Stops previously launched threads"""
@@ -113,27 +131,121 @@ def cleanup():
         logging.info(f"{rooms} Rooms, {seeds} Seeds and {slots} Slots have been deleted.")
 
 
+def get_wakeups(config: dict) -> wakeup.Wakeups | None:
+    """Returns where the web processes wake up the autolauncher, None if they don't."""
+    if not config["WAKEUP_ADDRESS"]:
+        return None
+    host, port = config["WAKEUP_ADDRESS"]
+    return wakeup.listen(host, port)
+
+
+def parse_wakeup_ids(items: typing.Iterable[str]) -> set[UUID]:
+    ids: set[UUID] = set()
+    for item in items:
+        try:
+            ids.add(UUID(hex=item))
+        except ValueError:
+            logging.warning(f"Received wake-up for invalid id {item!r}")
+    return ids
+
+
+def get_rooms_to_host(room_ids: typing.Collection[UUID] | None = None) -> list[UUID]:
+    """Returns the ids of the rooms, out of room_ids if given, that had activity within their timeout."""
+    now = datetime.utcnow()
+    rooms = select(room for room in Room if room.last_activity >= now - timedelta(days=3))
+    if room_ids is not None:
+        rooms = rooms.filter(lambda room: room.id in room_ids)
+    timeout_sql = _room_timeout_sql.get(db.provider_name)
+    if timeout_sql:
+        return [room.id for room in rooms.filter(lambda room: raw_sql(timeout_sql))]
+    return [room.id for room in rooms if room.last_activity >= now - timedelta(seconds=room.timeout + 5)]
+
+
+@cache_argsless
+def get_static_server_data_path() -> str:
+    """Writes the static server data for all hosters started by this process, once, and returns where it is."""
+    handle, path = tempfile.mkstemp(prefix="ap_static_server_data_")
+    os.close(handle)
+
+    def remove() -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # still mapped by a hoster on Windows
+
+    atexit.register(remove)
+    write_static_server_data(path)
+    return path
+
+
+def place_room(hosters: typing.Sequence[MultiworldInstance], room_id: UUID) -> None:
+    """Starts the room on the least loaded hoster, unless a hoster still has it."""
+    if not any(room_id in hoster.room_ids for hoster in hosters):
+        min(hosters, key=MultiworldInstance.placement_key).start_room(room_id)
+
+
+def pick_room_to_move(hosters: typing.Sequence[MultiworldInstance]) -> tuple[MultiworldInstance, UUID] | None:
+    """
+    Picks the room with the most clients of an overloaded hoster that has other rooms as well, if the least loaded
+    hoster uses less than half of its CPU limit.
+    """
+    target = min(hosters, key=MultiworldInstance.placement_key)
+    if target.load and target.cpu_limit and target.load.cpu >= target.cpu_limit / 2:
+        return None
+    for hoster in sorted(hosters, key=lambda hoster: hoster.load.cpu if hoster.load else 0, reverse=True):
+        if not hoster.overloaded:
+            break
+        rooms = [(clients, room_id) for room_id, clients in hoster.load.rooms.items() if room_id in hoster.room_ids]
+        if len(rooms) > 1:
+            return hoster, max(rooms)[1]
+    return None
+
+
 def autohost(config: dict):
     def keep_running():
         stop_event = _stop_event
         try:
             with Locker("autohost"):
                 cleanup()
+                wakeups = get_wakeups(config)
                 hosters = []
                 for x in range(config["HOSTERS"]):
-                    hoster = MultiworldInstance(config, x)
+                    hoster = MultiworldInstance(config, x, push_commands=wakeups is not None)
                     hosters.append(hoster)
                     hoster.start()
 
+                if wakeups:
+                    wakeups.watch("room")
+                    wakeups.watch("command")
+                next_scan = 0.0
+                next_rebalance = time.monotonic() + rebalance_interval
+                moving: set[UUID] = set()
                 while not stop_event.wait(0.1):
+                    moved = {room_id for hoster in hosters for room_id in hoster.update() if room_id in moving}
+                    moving -= moved
+                    if time.monotonic() >= next_rebalance:
+                        next_rebalance = time.monotonic() + rebalance_interval
+                        move = pick_room_to_move(hosters)
+                        if move:
+                            hoster, room_id = move
+                            logging.info(f"Moving room {room_id} away from {hoster.name}, "
+                                         f"which used {hoster.load.cpu:.0%} CPU.")
+                            moving.add(room_id)
+                            hoster.move_room(room_id)
+
+                    room_ids: set[UUID] | None = None
+                    if wakeups and time.monotonic() < next_scan:
+                        room_ids = parse_wakeup_ids(wakeups.take("room")) | moved
+                        for room_id in parse_wakeup_ids(wakeups.take("command")):
+                            for hoster in hosters:
+                                hoster.push_commands(room_id)
+                        if not room_ids:
+                            continue
+                    else:
+                        next_scan = time.monotonic() + rescan_interval
                     with db_session:
-                        rooms = select(
-                            room for room in Room if
-                            room.last_activity >= datetime.utcnow() - timedelta(days=3))
-                        for room in rooms:
-                            # we have to filter twice, as the per-room timeout can't currently be PonyORM transpiled.
-                            if room.last_activity >= datetime.utcnow() - timedelta(seconds=room.timeout + 5):
-                                hosters[room.id.int % len(hosters)].start_room(room.id)
+                        for room_id in get_rooms_to_host(room_ids):
+                            place_room(hosters, room_id)
 
         except AlreadyRunningException:
             logging.info("Autohost reports as already running, not starting another.")
@@ -165,7 +277,14 @@ def autogen(config: dict):
                             commit()
                         select(generation for generation in Generation if generation.state == STATE_ERROR).delete()
 
+                    wakeups = get_wakeups(config)
+                    if wakeups:
+                        wakeups.watch("generation")
+                    next_scan = 0.0
                     while not stop_event.wait(0.1):
+                        if wakeups and time.monotonic() < next_scan and not wakeups.take("generation"):
+                            continue
+                        next_scan = time.monotonic() + rescan_interval
                         with db_session:
                             # for update locks the database row(s) during transaction, preventing writes from elsewhere
                             to_start = select(
@@ -180,15 +299,26 @@ def autogen(config: dict):
 
 
 class MultiworldInstance():
-    def __init__(self, config: dict, id: int):
+    load: HosterLoad | None
+    """ what the hoster process last reported about itself """
+
+    def __init__(self, config: dict, id: int, push_commands: bool = False):
         self.room_ids = set()
         self.process: typing.Optional[multiprocessing.Process] = None
         self.ponyconfig = config["PONY"]
         self.cert = config["SELFLAUNCHCERT"]
         self.key = config["SELFLAUNCHKEY"]
         self.host = config["HOST_ADDRESS"]
+        self.metrics_path = config["ROOM_METRICS_PATH"]
         self.rooms_to_start = multiprocessing.Queue()
         self.rooms_shutting_down = multiprocessing.Queue()
+        # without wake-ups for commands, rooms look for them by themselves more often
+        self.rooms_with_commands = multiprocessing.Queue() if push_commands else None
+        self.rooms_to_move = multiprocessing.Queue()
+        self.loads = multiprocessing.Queue()
+        self.load = None
+        self.cpu_limit = config["HOSTER_CPU_LIMIT"]
+        self.datastorage_limits = config["DATASTORAGE_KEY_LIMIT"], config["DATASTORAGE_LIMIT"]
         self.name = f"MultiHoster{id}"
 
     def start(self):
@@ -196,22 +326,52 @@ class MultiworldInstance():
             return False
 
         process = multiprocessing.Process(group=None, target=run_server_process,
-                                          args=(self.name, self.ponyconfig, get_static_server_data(),
+                                          args=(self.name, self.ponyconfig, get_static_server_data_path(),
                                                 self.cert, self.key, self.host,
-                                                self.rooms_to_start, self.rooms_shutting_down),
+                                                self.rooms_to_start, self.rooms_shutting_down, self.metrics_path,
+                                                self.rooms_with_commands, self.rooms_to_move, self.loads,
+                                                self.datastorage_limits),
                                           name=self.name)
         process.start()
         self.process = process
 
-    def start_room(self, room_id):
+    def update(self) -> list[UUID]:
+        """Takes in what the hoster process reported since the last call and returns the rooms that shut down."""
+        shut_down = []
         while not self.rooms_shutting_down.empty():
-            self.room_ids.remove(self.rooms_shutting_down.get(block=True, timeout=None))
+            room_id = self.rooms_shutting_down.get(block=True, timeout=None)
+            self.room_ids.discard(room_id)
+            shut_down.append(room_id)
+        while not self.loads.empty():
+            self.load = self.loads.get(block=True, timeout=None)
+        return shut_down
+
+    @property
+    def overloaded(self) -> bool:
+        return bool(self.cpu_limit and self.load and self.load.cpu >= self.cpu_limit)
+
+    def placement_key(self) -> tuple[float, int, int, int]:
+        """Orders hosters from least to most loaded: by CPU used in steps of 10%, then by connected clients, then by
+        rooms, including the ones started since the last report, then by memory."""
+        load = self.load or HosterLoad({}, 0, 0)
+        return round(load.cpu, 1), load.clients, len(self.room_ids), load.rss
+
+    def start_room(self, room_id):
         if room_id in self.room_ids:
             pass  # should already be hosted currently.
         else:
             self.room_ids.add(room_id)
             self.rooms_to_start.put(room_id)
 
+    def move_room(self, room_id):
+        """Has the room saved and shut down, so that it can be started on another hoster."""
+        self.rooms_to_move.put(room_id)
+
+    def push_commands(self, room_id):
+        """Tells the room to fetch its commands now, if it is hosted by this instance."""
+        if self.rooms_with_commands and room_id in self.room_ids:
+            self.rooms_with_commands.put(room_id)
+
     def stop(self):
         if self.process:
             self.process.terminate()
@@ -226,5 +386,5 @@ class MultiworldInstance():
 
 
 from .models import Room, Generation, STATE_QUEUED, STATE_STARTED, STATE_ERROR, db, Seed, Slot
-from .customserver import run_server_process, get_static_server_data
+from .customserver import HosterLoad, run_server_process, write_static_server_data
 from .generate import gen_game
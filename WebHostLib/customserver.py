@@ -5,7 +5,9 @@ import collections
 import datetime
 import functools
 import logging
+import mmap
 import multiprocessing
+import os
 import pickle
 import random
 import socket
@@ -21,11 +23,12 @@ import Utils
 
 from MultiServer import (
     Context, server, auto_shutdown, ServerCommandProcessor, ClientMessageProcessor, load_server_cert,
-    server_per_message_deflate_factory,
+    server_per_message_deflate_factory, apply_save_changes, write_metrics,
 )
+from NetUtils import MultiDataSections, write_multidata
 from Utils import restricted_loads, cache_argsless
 from .locker import Locker
-from .models import Command, GameDataPackage, Room, db
+from .models import Command, GameDataPackage, Room, SaveChange, UUID, db
 
 
 class CustomClientMessageProcessor(ClientMessageProcessor):
@@ -55,6 +58,20 @@ MultiServer.client_message_processor = CustomClientMessageProcessor
 del MultiServer
 
 
+class HosterLoad(typing.NamedTuple):
+    """How busy a room hoster process is, as it reports to the autolauncher."""
+    rooms: typing.Dict[UUID, int]
+    """ connected clients of each room """
+    cpu: float
+    """ share of a core used since the last report """
+    rss: int
+    """ resident memory in bytes, 0 without psutil """
+
+    @property
+    def clients(self) -> int:
+        return sum(self.rooms.values())
+
+
 class DBCommandProcessor(ServerCommandProcessor):
     def output(self, text: str):
         self.ctx.logger.info(text)
@@ -62,6 +79,10 @@ class DBCommandProcessor(ServerCommandProcessor):
 
 class WebHostContext(Context):
     room_id: int
+    command_interval: float = 5
+    """ seconds between looking for commands of the room, unless told that there are some through commands_waiting """
+    moving: bool = False
+    """ shutting down to be started again by another hoster """
 
     def __init__(self, static_server_data: dict, logger: logging.Logger):
         # static server data is used during _load_game_data to load required data,
@@ -74,6 +95,7 @@ class WebHostContext(Context):
         self.main_loop = asyncio.get_running_loop()
         self.video = {}
         self.tags = ["AP", "WebHost"]
+        self.commands_waiting = threading.Event()
 
     def __del__(self):
         try:
@@ -87,7 +109,6 @@ class WebHostContext(Context):
         for key, value in self.static_server_data.items():
             # NOTE: attributes are mutable and shared, so they will have to be copied before being modified
             setattr(self, key, value)
-        self.non_hintable_names = collections.defaultdict(frozenset, self.non_hintable_names)
 
     def listen_to_db_commands(self):
         cmdprocessor = DBCommandProcessor(self)
@@ -101,7 +122,8 @@ class WebHostContext(Context):
                         command.delete()
                     commit()
             del commands
-            time.sleep(5)
+            self.commands_waiting.wait(self.command_interval)
+            self.commands_waiting.clear()
 
     @db_session
     def load(self, room_id: int):
@@ -118,13 +140,17 @@ class WebHostContext(Context):
         static_gamespackage = self.gamespackage  # this is shared across all rooms
         static_item_name_groups = self.item_name_groups
         static_location_name_groups = self.location_name_groups
+        static_non_hintable_names = self.non_hintable_names
+        self.non_hintable_names = collections.defaultdict(frozenset)
         self.gamespackage = {"Archipelago": static_gamespackage.get("Archipelago", {})}  # this may be modified by _load
         self.item_name_groups = {"Archipelago": static_item_name_groups.get("Archipelago", {})}
         self.location_name_groups = {"Archipelago": static_location_name_groups.get("Archipelago", {})}
-        missing_checksum = False
 
+        # only the games of the room get taken from the static data
         for game in list(multidata.get("datapackage", {})):
             game_data = multidata["datapackage"][game]
+            if game in static_non_hintable_names:
+                self.non_hintable_names[game] = static_non_hintable_names[game]
             if "checksum" in game_data:
                 if static_gamespackage.get(game, {}).get("checksum") == game_data["checksum"]:
                     # non-custom. remove from multidata and use static data
@@ -137,38 +163,51 @@ class WebHostContext(Context):
                         continue
                     else:
                         self.logger.warning(f"Did not find game_data_package for {game}: {game_data['checksum']}")
-            else:
-                missing_checksum = True  # Game rolled on old AP and will load data package from multidata
+            # a game without checksum was rolled on old AP and gets its data package loaded from multidata
             self.gamespackage[game] = static_gamespackage.get(game, {})
             self.item_name_groups[game] = static_item_name_groups.get(game, {})
             self.location_name_groups[game] = static_location_name_groups.get(game, {})
 
-        if not game_data_packages and not missing_checksum:
-            # all static -> use the static dicts directly
-            self.gamespackage = static_gamespackage
-            self.item_name_groups = static_item_name_groups
-            self.location_name_groups = static_location_name_groups
         return self._load(multidata, game_data_packages, True)
 
     def init_save(self, enabled: bool = True):
         self.saving = enabled
         if self.saving:
             with db_session:
-                savegame_data = Room.get(id=self.room_id).multisave
+                savegame_data = get_room_save(Room.get(id=self.room_id))
                 if savegame_data:
-                    self.set_save(restricted_loads(Room.get(id=self.room_id).multisave))
+                    self.set_save(savegame_data)
             self._start_async_saving(atexit_save=False)
         threading.Thread(target=self.listen_to_db_commands, daemon=True).start()
 
     @db_session
     def _save(self, exit_save: bool = False) -> bool:
-        room = Room.get(id=self.room_id)
-        # Does not use Utils.restricted_dumps because we'd rather make a save than not make one
-        room.multisave = pickle.dumps(self.get_save())
-        # saving only occurs on activity, so we can "abuse" this information to mark this as last_activity
-        if not exit_save:  # we don't want to count a shutdown as activity, which would restart the server again
-            room.last_activity = datetime.datetime.utcnow()
-        return True
+        with self.metrics.time("save"):
+            room = Room.get(id=self.room_id)
+            save = self.get_save()
+            try:
+                # Does not use Utils.restricted_dumps because we'd rather make a save than not make one
+                if self.save_journal.needs_snapshot:
+                    self.save_journal.take_snapshot(save)
+                    room.multisave = pickle.dumps(save)
+                    room.save_changes.clear()
+                    # marks where the changes after this snapshot start, see get_save_generation
+                    SaveChange(room=room, data=pickle.dumps([]))
+                    self.save_journal.wrote(len(room.multisave), snapshot=True)
+                else:
+                    changes = self.save_journal.take_changes(save)
+                    if changes:
+                        data = pickle.dumps(changes)
+                        SaveChange(room=room, data=data)
+                        self.save_journal.wrote(len(data))
+                # saving only occurs on activity, so we can "abuse" this information to mark this as last_activity
+                if not exit_save:  # we don't want to count a shutdown as activity, which would restart the server again
+                    room.last_activity = datetime.datetime.utcnow()
+                commit()
+            except Exception:
+                self.save_journal.invalidate()
+                raise
+            return True
 
     def get_save(self) -> dict:
         d = super(WebHostContext, self).get_save()
@@ -176,10 +215,80 @@ class WebHostContext(Context):
         return d
 
 
+def get_room_save(room: Room, until: typing.Optional[int] = None) -> typing.Dict[str, typing.Any]:
+    """
+    Loads the multisave of a room with the changes that were saved since, empty if the room was never saved.
+
+    :param until: id of the last change to apply, so the save matches a generation read before. All changes if None.
+    """
+    if not room.multisave:
+        return {}
+    save = restricted_loads(room.multisave)
+    changes = room.save_changes
+    if until is not None:
+        changes = changes.select(lambda change: change.id <= until)
+    for change in changes.order_by(SaveChange.id):
+        apply_save_changes(save, restricted_loads(change.data))
+    return save
+
+
+def get_save_generation(room: Room) -> typing.Tuple[int, int]:
+    """
+    Returns the ids of the first and the last change saved for a room since its multisave, both 0 if there are none.
+    Every multisave is followed by an empty change, so the last id grows with every save of the room and the changes
+    after it can be replayed from the change log for as long as the first id is not larger.
+    """
+    first, last = select((min(change.id), max(change.id)) for change in SaveChange if change.room == room).get()
+    return first or 0, last or 0
+
+
 def get_random_port():
     return random.randint(49152, 65535)
 
 
+class StaticGameData(typing.Mapping[str, typing.Any]):
+    """
+    One kind of static server data by game, read from the file written by write_static_server_data. The data of a game
+    only gets unpickled once it is used in this process, so hosters only hold the games of their rooms.
+    """
+    _prefix: str
+    _games: typing.List[str]
+
+    def __init__(self, sections: MultiDataSections, kind: str) -> None:
+        self._sections = sections
+        self._prefix = f"{kind}:"
+        self._games = [name[len(self._prefix):] for name in sections if name.startswith(self._prefix)]
+
+    def __getitem__(self, game: str) -> typing.Any:
+        return self._sections[self._prefix + game]
+
+    def __contains__(self, game: object) -> bool:
+        return isinstance(game, str) and self._prefix + game in self._sections
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self._games)
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+
+def write_static_server_data(path: str) -> None:
+    """Writes the static server data to path, as a section per kind and game that can be mapped by every hoster."""
+    sections = {f"{kind}:{game}": value
+                for kind, games in get_static_server_data().items() for game, value in games.items()}
+    with open(path + ".tmp", "wb") as f:
+        write_multidata(f, sections, 1)
+    os.replace(path + ".tmp", path)
+
+
+def map_static_server_data(path: str) -> typing.Dict[str, StaticGameData]:
+    """Maps the file written by write_static_server_data read-only, so the pages of it are shared between hosters."""
+    with open(path, "rb") as f:
+        sections = MultiDataSections(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    return {kind: StaticGameData(sections, kind)
+            for kind in ("non_hintable_names", "gamespackage", "item_name_groups", "location_name_groups")}
+
+
 @cache_argsless
 def get_static_server_data() -> dict:
     import worlds
@@ -210,7 +319,6 @@ def get_static_server_data() -> dict:
 
 
 def set_up_logging(room_id) -> logging.Logger:
-    import os
     # logger setup
     logger = logging.getLogger(f"RoomLogger {room_id}")
 
@@ -229,10 +337,16 @@ def set_up_logging(room_id) -> logging.Logger:
     return logger
 
 
-def run_server_process(name: str, ponyconfig: dict, static_server_data: dict,
+def run_server_process(name: str, ponyconfig: dict, static_server_data_path: str,
                        cert_file: typing.Optional[str], cert_key_file: typing.Optional[str],
-                       host: str, rooms_to_run: multiprocessing.Queue, rooms_shutting_down: multiprocessing.Queue):
+                       host: str, rooms_to_run: multiprocessing.Queue, rooms_shutting_down: multiprocessing.Queue,
+                       metrics_path: typing.Optional[str] = None,
+                       rooms_with_commands: typing.Optional[multiprocessing.Queue] = None,
+                       rooms_to_move: typing.Optional[multiprocessing.Queue] = None,
+                       loads: typing.Optional[multiprocessing.Queue] = None,
+                       datastorage_limits: typing.Tuple[int, int] = (0, 0)):
     from setproctitle import setproctitle
+    from . import to_url
 
     setproctitle(name)
     Utils.init_logging(name)
@@ -247,6 +361,7 @@ def run_server_process(name: str, ponyconfig: dict, static_server_data: dict,
         resource.setrlimit(resource.RLIMIT_NOFILE, (file_limit, file_limit))
         del resource, file_limit
 
+    static_server_data = map_static_server_data(static_server_data_path)
     # establish DB connection for multidata and multisave
     db.bind(**ponyconfig)
     db.generate_mapping(check_tables=False)
@@ -275,14 +390,20 @@ def run_server_process(name: str, ponyconfig: dict, static_server_data: dict,
     gc.collect()  # free intermediate objects used during setup
 
     loop = asyncio.get_event_loop()
+    # rooms of this process by their id in URLs, for the metrics
+    running_rooms: typing.Dict[str, WebHostContext] = {}
 
     async def start_room(room_id):
         with Locker(f"RoomLocker {room_id}"):
             try:
                 logger = set_up_logging(room_id)
                 ctx = WebHostContext(static_server_data, logger)
+                ctx.datastorage_key_limit, ctx.datastorage_limit = datastorage_limits
+                if rooms_with_commands:
+                    ctx.command_interval = 15
                 ctx.load(room_id)
                 ctx.init_save()
+                running_rooms[to_url(room_id)] = ctx
                 assert ctx.server is None
                 try:
                     ctx.server = websockets.serve(
@@ -339,16 +460,19 @@ def run_server_process(name: str, ponyconfig: dict, static_server_data: dict,
                     ctx._save()
                     setattr(asyncio.current_task(), "save", None)
             finally:
+                running_rooms.pop(to_url(room_id), None)
                 try:
                     ctx.save_dirty = False  # make sure the saving thread does not write to DB after final wakeup
                     ctx.exit_event.set()  # make sure the saving thread stops at some point
+                    ctx.commands_waiting.set()
                     # NOTE: async saving should probably be an async task and could be merged with shutdown_task
-                    with db_session:
-                        # ensure the Room does not spin up again on its own, minute of safety buffer
-                        room = Room.get(id=room_id)
-                        room.last_activity = datetime.datetime.utcnow() - \
-                                             datetime.timedelta(minutes=1, seconds=room.timeout)
-                    del room
+                    if not ctx.moving:
+                        with db_session:
+                            # ensure the Room does not spin up again on its own, minute of safety buffer
+                            room = Room.get(id=room_id)
+                            room.last_activity = datetime.datetime.utcnow() - \
+                                                 datetime.timedelta(minutes=1, seconds=room.timeout)
+                        del room
                     logging.info(f"Shutting down room {room_id} on {name}.")
                 finally:
                     await asyncio.sleep(5)
@@ -375,9 +499,52 @@ def run_server_process(name: str, ponyconfig: dict, static_server_data: dict,
                 logging.info(f"Starting room {next_room} on {name}.")
                 del task  # delete reference to task object
 
+    def wake_for_commands():
+        while 1:
+            ctx = running_rooms.get(to_url(rooms_with_commands.get(block=True, timeout=None)))
+            if ctx:
+                ctx.commands_waiting.set()
+
+    def move_room(room_id: UUID):
+        """Shuts the room down after saving it, leaving it active for the autolauncher to start it elsewhere."""
+        ctx = running_rooms.get(to_url(room_id))
+        if ctx and not ctx.exit_event.is_set():
+            ctx.moving = True
+            ctx.logger.info("Moving to another process.")
+            ctx.server.ws_server.close()
+            ctx.exit_event.set()
+
+    def receive_moves():
+        while 1:
+            loop.call_soon_threadsafe(move_room, rooms_to_move.get(block=True, timeout=None))
+
+    async def report_loads():
+        try:
+            import psutil
+            process = psutil.Process()
+        except ImportError:
+            process = None
+        cpu_time, wall_time = time.process_time(), time.monotonic()
+        while 1:
+            await asyncio.sleep(5)
+            last_cpu_time, last_wall_time = cpu_time, wall_time
+            cpu_time, wall_time = time.process_time(), time.monotonic()
+            loads.put(HosterLoad({ctx.room_id: len(ctx.endpoints) for ctx in list(running_rooms.values())},
+                                 (cpu_time - last_cpu_time) / (wall_time - last_wall_time),
+                                 process.memory_info().rss if process else 0))
+
     starter = Starter()
     starter.daemon = True
     starter.start()
+    if rooms_with_commands:
+        threading.Thread(target=wake_for_commands, name="CommandWaker", daemon=True).start()
+    if rooms_to_move:
+        threading.Thread(target=receive_moves, name="RoomMover", daemon=True).start()
+    if loads:
+        loop.create_task(report_loads())
+    if metrics_path:
+        loop.create_task(write_metrics(os.path.join(metrics_path, f"{name}.prom"),
+                                       lambda: list(running_rooms.items())))
     try:
         loop.run_forever()
     finally:
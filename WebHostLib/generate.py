@@ -20,6 +20,7 @@ from settings import ServerOptions, GeneratorOptions
 from .check import get_yaml_data, roll_options
 from .models import Generation, STATE_ERROR, STATE_QUEUED, Seed, UUID
 from .upload import upload_zip_to_db
+from .wakeup import notify
 
 
 def get_meta(options_source: dict, race: bool = False) -> dict[str, list[str] | dict[str, Any]]:
@@ -102,6 +103,7 @@ def start_generation(options: dict[str, dict | str], meta: dict[str, Any]):
             return render_template("seedError.html", seed_error=meta["error"], details=details)
 
         commit()
+        notify(app.config["WAKEUP_ADDRESS"], "generation", gen.id.hex)
 
         return redirect(url_for("wait_seed", seed=gen.id))
     else:
@@ -13,6 +13,7 @@ from worlds.AutoWorld import AutoWorldRegister, World
 from . import app, cache
 from .markdown import render_markdown
 from .models import Seed, Room, Command, UUID, uuid4
+from .wakeup import notify
 from Utils import title_sorted
 
 class WebWorldTheme(StrEnum):
@@ -170,6 +171,7 @@ def new_room(seed: UUID):
         abort(404)
     room = Room(seed=seed, owner=session["_id"], tracker=uuid4())
     commit()
+    notify(app.config["WAKEUP_ADDRESS"], "room", room.id.hex)
     return redirect(url_for("host_room", room=room.id))
 
 
@@ -219,6 +221,7 @@ def host_room_command(room: UUID):
         if cmd:
             Command(room=room, commandtext=cmd)
             commit()
+            notify(app.config["WAKEUP_ADDRESS"], "command", room.id.hex)
     return redirect(url_for("host_room", room=room.id))
 
 
@@ -237,6 +240,8 @@ def host_room(room: UUID):
         # we only set last_activity if needed, otherwise parallel access on /room will cause an internal server error
         # due to "pony.orm.core.OptimisticCheckError: Object Room was updated outside of current transaction"
         room.last_activity = now  # will trigger a spinup, if it's not already running
+        commit()
+        notify(app.config["WAKEUP_ADDRESS"], "room", room.id.hex)
 
     browser_tokens = "Mozilla", "Chrome", "Safari"
     automated = ("update" in request.args
@@ -24,6 +24,7 @@ class Room(db.Entity):
     creation_time = Required(datetime, default=lambda: datetime.utcnow(), index=True)  # index used by landing page
     owner = Required(UUID, index=True)
     commands = Set('Command')
+    save_changes = Set('SaveChange')
     seed = Required('Seed', index=True)
     multisave = Optional(buffer, lazy=True)
     show_spoiler = Required(int, default=0)  # 0 -> never, 1 -> after completion, -> 2 always
@@ -44,6 +45,14 @@ class Seed(db.Entity):
     meta = Required(LongStr, default=lambda: "{\"race\": false}")  # additional meta information/tags
 
 
+class SaveChange(db.Entity):
+    """Changes of a room's save since its multisave was written, to be replayed onto it in order of id.
+    Writing the multisave adds an empty change, so ids double as save generations."""
+    id = PrimaryKey(int, auto=True)
+    room = Required(Room, index=True)
+    data = Required(buffer, lazy=True)
+
+
 class Command(db.Entity):
     id = PrimaryKey(int, auto=True)
     room = Required(Room)
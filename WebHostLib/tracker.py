@@ -1,5 +1,9 @@
 import datetime
 import collections
+import functools
+import itertools
+import sys
+import threading
 from dataclasses import dataclass
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, NamedTuple, Counter
 from uuid import UUID
@@ -12,6 +16,7 @@ from MultiServer import Context, get_saving_second
 from NetUtils import ClientStatus, Hint, NetworkItem, NetworkSlot, SlotType
 from Utils import restricted_loads, KeyedDefaultDict
 from . import app, cache
+from .customserver import get_room_save
 from .models import GameDataPackage, Room
 
 # Multisave is currently updated, at most, every minute.
@@ -40,6 +45,91 @@ def _cache_results(func: Callable) -> Callable:
     return method_wrapper
 
 
+class _SizedLRUCache:
+    """Keeps the values that were used last, up to a total size, for data that never changes once it exists.
+    Shared by all threads of a web process, so that requests for the same room don't decode the same data again.
+    """
+    size: int
+
+    def __init__(self, max_size: Callable[[], int]):
+        self.max_size = max_size
+        self.size = 0
+        self._entries: "collections.OrderedDict[Any, Tuple[Any, int]]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any, create: Callable[[], Tuple[Any, int]]) -> Any:
+        """Returns the value of key, or creates the value and its size with create if it is not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                return entry[0]
+        # created without holding the lock, so other requests don't have to wait for it
+        value, size = create()
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = value, size
+                self.size += size
+                max_size = self.max_size()
+                while self.size > max_size:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self.size -= evicted_size
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+def _estimate_size(obj: Any) -> int:
+    """Memory taken up by obj and the containers and values in it, counting each object once."""
+    seen = {id(obj)}
+    stack = [obj]
+    size = 0
+    while stack:
+        current = stack.pop()
+        size += sys.getsizeof(current)
+        if isinstance(current, dict):
+            children = itertools.chain(current.keys(), current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            children = current
+        else:
+            continue
+        for child in children:
+            if id(child) not in seen:
+                seen.add(id(child))
+                stack.append(child)
+    return size
+
+
+class _GameTables(NamedTuple):
+    item_id_to_name: Dict[int, str]
+    location_id_to_name: Dict[int, str]
+    item_name_to_id: Dict[str, int]
+    location_name_to_id: Dict[str, int]
+
+
+def _load_game_tables(checksum: str) -> Tuple[_GameTables, int]:
+    game_package = restricted_loads(GameDataPackage.get(checksum=checksum).data)
+    tables = _GameTables(
+        KeyedDefaultDict(lambda code: f"Unknown Item (ID: {code})", {
+            id: name for name, id in game_package["item_name_to_id"].items()}),
+        KeyedDefaultDict(lambda code: f"Unknown Location (ID: {code})", {
+            id: name for name, id in game_package["location_name_to_id"].items()}),
+        game_package["item_name_to_id"],
+        game_package["location_name_to_id"],
+    )
+    return tables, _estimate_size(tables)
+
+
+# sized by the estimated memory of the decoded values
+_multidata_cache = _SizedLRUCache(lambda: app.config["TRACKER_DATA_CACHE_MEMORY"])
+""" decoded multidata by seed id """
+_game_tables_cache = _SizedLRUCache(lambda: app.config["TRACKER_DATA_CACHE_MEMORY"])
+""" lookup tables of data packages by checksum """
+
+
 @dataclass
 class TrackerData:
     """A helper dataclass that is instantiated each time an HTTP request comes in for tracker data.
@@ -52,11 +142,23 @@ class TrackerData:
     _multisave: Dict[str, Any]
     _tracker_cache: Dict[str, Any]
 
-    def __init__(self, room: Room):
-        """Initialize a new RoomMultidata object for the current room."""
+    def __init__(self, room: Room, save_generation: Optional[int] = None):
+        """
+        Initialize a new RoomMultidata object for the current room.
+
+        :param save_generation: id of the last save change to load, all of them if None.
+        """
         self.room = room
-        self._multidata = Context.decompress(room.seed.multidata)
-        self._multisave = restricted_loads(room.multisave) if room.multisave else {}
+        seed = room.seed
+
+        def decompress_multidata() -> Tuple[Dict[str, Any], int]:
+            # every section gets decoded up front, so the cached multidata does not grow once it is measured
+            multidata = dict(Context.decompress(seed.multidata))
+            return multidata, _estimate_size(multidata)
+
+        # the multidata of a seed never changes, so only the multisave has to be loaded for every request
+        self._multidata = _multidata_cache.get(seed.id, decompress_multidata)
+        self._multisave = get_room_save(room, save_generation)
         self._tracker_cache = {}
 
         self.item_name_to_id: Dict[str, Dict[str, int]] = {}
@@ -70,15 +172,14 @@ class TrackerData:
             game_name: KeyedDefaultDict(lambda code: f"Unknown Game {game_name} - Location (ID: {code})")
         })
         for game, game_package in self._multidata["datapackage"].items():
-            game_package = restricted_loads(GameDataPackage.get(checksum=game_package["checksum"]).data)
-            self.item_id_to_name[game] = KeyedDefaultDict(lambda code: f"Unknown Item (ID: {code})", {
-                id: name for name, id in game_package["item_name_to_id"].items()})
-            self.location_id_to_name[game] = KeyedDefaultDict(lambda code: f"Unknown Location (ID: {code})", {
-                id: name for name, id in game_package["location_name_to_id"].items()})
+            checksum = game_package["checksum"]
+            tables: _GameTables = _game_tables_cache.get(checksum, functools.partial(_load_game_tables, checksum))
+            self.item_id_to_name[game] = tables.item_id_to_name
+            self.location_id_to_name[game] = tables.location_id_to_name
 
             # Normal lookup tables as well.
-            self.item_name_to_id[game] = game_package["item_name_to_id"]
-            self.location_name_to_id[game] = game_package["location_name_to_id"]
+            self.item_name_to_id[game] = tables.item_name_to_id
+            self.location_name_to_id[game] = tables.location_name_to_id
 
     def get_seed_name(self) -> str:
         """Retrieves the seed name."""
@@ -0,0 +1,68 @@
+"""
+Wake-ups for the autolauncher, so it only has to look into the database when something was added for it to schedule.
+
+Whoever adds a room to host, a generation or a command commits it and then sends a datagram "<kind> <id>" to the
+address the autolauncher listens on. Datagrams that get lost only delay things until the autolauncher's next full look.
+"""
+from __future__ import annotations
+
+import collections
+import functools
+import logging
+import socket
+import threading
+import typing
+
+
+class Wakeups:
+    """Collects the ids of wake-ups of each watched kind, until they are taken."""
+    _pending: typing.Dict[str, typing.Set[str]]
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.socket = sock
+        self._lock = threading.Lock()
+        self._pending = collections.defaultdict(set)
+        self._watched: typing.Set[str] = set()
+        threading.Thread(target=self._receive, name="AP_Wakeups", daemon=True).start()
+
+    def watch(self, kind: str) -> None:
+        """Starts collecting wake-ups of kind, which are thrown away otherwise."""
+        self._watched.add(kind)
+
+    def take(self, kind: str) -> typing.Set[str]:
+        """Returns the ids of the wake-ups of kind received since the last call."""
+        with self._lock:
+            return self._pending.pop(kind, set())
+
+    def _receive(self) -> None:
+        while True:
+            data = self.socket.recv(256)
+            kind, _, item = data.decode(errors="replace").partition(" ")
+            if kind in self._watched:
+                with self._lock:
+                    self._pending[kind].add(item)
+
+
+@functools.lru_cache(maxsize=None)
+def listen(host: str, port: int) -> typing.Optional[Wakeups]:
+    """Starts receiving wake-ups on host and port, once per process. Returns None if that address can't be used."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.bind((host, port))
+    except OSError as e:
+        sock.close()
+        logging.warning(f"Could not listen for wake-ups on {host}:{port}, falling back to polling: {e}")
+        return None
+    return Wakeups(sock)
+
+
+def notify(address: typing.Optional[typing.Sequence[typing.Any]], kind: str, item: typing.Any = "") -> None:
+    """Wakes up the autolauncher listening on address, if there is one, for item of kind."""
+    if not address:
+        return
+    host, port = address
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(f"{kind} {item}".encode(), (host, port))
+    except OSError:
+        pass  # the autolauncher will still find it by itself
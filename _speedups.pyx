@@ -1,6 +1,5 @@
 #cython: language_level=3
 #distutils: language = c
-#distutils: depends = intset.h
 
 """
 Provides faster implementation of some core parts.
@@ -14,6 +13,7 @@ from cpython cimport PyObject
 from typing import Any, Dict, Iterable, Iterator, Generator, Sequence, Tuple, TypeVar, Union, Set, List, TYPE_CHECKING
 from cymem.cymem cimport Pool
 from libc.stdint cimport int64_t, uint32_t
+from libc.stdlib cimport qsort
 from collections import defaultdict
 
 cdef extern from *:
@@ -31,27 +31,6 @@ ctypedef int64_t ap_id_t
 cdef ap_player_t MAX_PLAYER_ID = 1000000  # limit the size of indexing array
 cdef size_t INVALID_SIZE = <size_t>(-1)  # this is all 0xff... adding 1 results in 0, but it's not negative
 
-# configure INTSET for player
-cdef extern from *:
-    """
-    #define INTSET_NAME ap_player_set
-    #define INTSET_TYPE uint32_t  // has to match ap_player_t
-    """
-
-# create INTSET for player
-cdef extern from "intset.h":
-    """
-    #undef INTSET_NAME
-    #undef INTSET_TYPE
-    """
-    ctypedef struct ap_player_set:
-        pass
-
-    ap_player_set* ap_player_set_new(size_t bucket_count) nogil
-    void ap_player_set_free(ap_player_set* set) nogil
-    bint ap_player_set_add(ap_player_set* set, ap_player_t val) nogil
-    bint ap_player_set_contains(ap_player_set* set, ap_player_t val) nogil
-
 
 cdef struct LocationEntry:
     # layout is so that
@@ -69,6 +48,22 @@ cdef struct IndexEntry:
     size_t count
 
 
+cdef struct ReceiverEntry:
+    ap_id_t item
+    size_t entry  # index into entries
+
+
+cdef int compare_receiver_entries(const void* a, const void* b) noexcept nogil:
+    # by item, then by position in entries, which keeps the order of entries for the same item
+    cdef const ReceiverEntry* x = <const ReceiverEntry*>a
+    cdef const ReceiverEntry* y = <const ReceiverEntry*>b
+    if x.item != y.item:
+        return -1 if x.item < y.item else 1
+    if x.entry != y.entry:
+        return -1 if x.entry < y.entry else 1
+    return 0
+
+
 if TYPE_CHECKING:
     State = Dict[Tuple[int, int], Set[int]]
 else:
@@ -96,6 +91,10 @@ cdef class LocationStore:
     cdef list _items  # ~64KB/1000 players, speed up items (56 per tuple + 8 per list entry)
     cdef list _proxies  # ~92KB/1000 players, speed up self[player] (56 per struct + 28 per len + 8 per list entry)
     cdef PyObject** _raw_proxies  # 8K/1000 players, faster access to _proxies, but does not keep a ref
+    # entries grouped by receiver and sorted by item, built on first use by find_item or get_for_player
+    cdef ReceiverEntry* receiver_entries  # 1.6MB/100k items
+    cdef IndexEntry* receiver_index  # 16KB/1000 players
+    cdef size_t receiver_index_size  # 0 until built
 
     def get_size(self):
         from sys import getsizeof
@@ -106,6 +105,8 @@ cdef class LocationStore:
         size += sum(sizeof(item) for item in self._items)
         size += sum(sizeof(proxy) for proxy in self._proxies)
         size += sizeof(self._raw_proxies[0]) * self.sender_index_size
+        if self.receiver_index_size:
+            size += sizeof(ReceiverEntry) * self.entry_count + sizeof(IndexEntry) * self.receiver_index_size
         return size
 
     def __init__(self, locations_dict: Dict[int, Dict[int, Sequence[int]]]) -> None:
@@ -215,47 +216,90 @@ cdef class LocationStore:
         return self._items
 
     # specialized accessors
+    cdef int _index_receivers(self) except -1:
+        cdef size_t i
+        cdef size_t position
+        cdef ap_player_t receiver
+        cdef ap_player_t max_receiver = 0
+        for i in range(self.entry_count):
+            max_receiver = max(max_receiver, self.entries[i].receiver)
+        # allocations are zeroed, so all counts start at 0
+        self.receiver_index = <IndexEntry*>self._mem.alloc(max_receiver + 1, sizeof(IndexEntry))
+        if self.entry_count:
+            self.receiver_entries = <ReceiverEntry*>self._mem.alloc(self.entry_count, sizeof(ReceiverEntry))
+        # counting sort by receiver, then sort each receiver by item
+        for i in range(self.entry_count):
+            self.receiver_index[self.entries[i].receiver].count += 1
+        position = 0
+        for receiver in range(max_receiver + 1):
+            self.receiver_index[receiver].start = position
+            position += self.receiver_index[receiver].count
+            self.receiver_index[receiver].count = 0
+        for i in range(self.entry_count):
+            receiver = self.entries[i].receiver
+            position = self.receiver_index[receiver].start + self.receiver_index[receiver].count
+            self.receiver_entries[position].item = self.entries[i].item
+            self.receiver_entries[position].entry = i
+            self.receiver_index[receiver].count += 1
+        for receiver in range(max_receiver + 1):
+            if self.receiver_index[receiver].count > 1:
+                qsort(self.receiver_entries + self.receiver_index[receiver].start, self.receiver_index[receiver].count,
+                      sizeof(ReceiverEntry), compare_receiver_entries)
+        self.receiver_index_size = max_receiver + 1
+        return 0
+
     def find_item(self, slots: Set[int], seeked_item_id: int) -> Generator[Tuple[int, int, int, int, int], None, None]:
         cdef ap_id_t item = seeked_item_id
         cdef ap_player_t receiver
-        cdef ap_player_set* receivers
-        cdef size_t slot_count = len(slots)
-        if slot_count == 1:
-            # specialized implementation for single slot
-            receiver = list(slots)[0]
-            with nogil:
-                for entry in self.entries[:self.entry_count]:
-                    if entry.item == item and entry.receiver == receiver:
-                        with gil:
-                            yield entry.sender, entry.location, entry.item, entry.receiver, entry.flags
-        elif slot_count:
-            # generic implementation with lookup in set
-            receivers = ap_player_set_new(min(1023, slot_count))  # limit top level struct to 16KB
-            if not receivers:
-                raise MemoryError()
-            try:
-                for receiver in slots:
-                    if not ap_player_set_add(receivers, receiver):
-                        raise MemoryError()
-                with nogil:
-                    for entry in self.entries[:self.entry_count]:
-                        if entry.item == item and ap_player_set_contains(receivers, entry.receiver):
-                            with gil:
-                                yield entry.sender, entry.location, entry.item, entry.receiver, entry.flags
-            finally:
-                ap_player_set_free(receivers)
+        cdef size_t l, r, m, end
+        cdef LocationEntry* entry
+        cdef list found = []
+        if not slots:
+            return
+        if not self.receiver_index_size:
+            self._index_receivers()
+        for slot in slots:
+            if slot < 1 or slot >= self.receiver_index_size:
+                continue
+            receiver = slot
+            # binary search for the first entry of the item
+            l = self.receiver_index[receiver].start
+            end = l + self.receiver_index[receiver].count
+            r = end
+            while l < r:
+                m = (l + r) // 2
+                if self.receiver_entries[m].item < item:
+                    l = m + 1
+                else:
+                    r = m
+            while l < end and self.receiver_entries[l].item == item:
+                found.append(self.receiver_entries[l].entry)
+                l += 1
+        if len(slots) > 1:
+            found.sort()  # back into the order of entries
+        for i in found:
+            entry = self.entries + <size_t>i
+            yield entry.sender, entry.location, entry.item, entry.receiver, entry.flags
 
     def get_for_player(self, slot: int) -> Dict[int, Set[int]]:
-        cdef ap_player_t receiver = slot
+        cdef ap_player_t receiver
+        cdef size_t i, start
+        cdef LocationEntry* entry
         all_locations: Dict[int, Set[int]] = {}
-        with nogil:
-            for entry in self.entries[:self.entry_count]:
-                if entry.receiver == receiver:
-                    with gil:
-                        sender: int = entry.sender
-                        if sender not in all_locations:
-                            all_locations[sender] = set()
-                        all_locations[sender].add(entry.location)
+        if slot < 1:
+            return all_locations
+        if not self.receiver_index_size:
+            self._index_receivers()
+        if slot >= self.receiver_index_size:
+            return all_locations
+        receiver = slot
+        start = self.receiver_index[receiver].start
+        for i in range(start, start + self.receiver_index[receiver].count):
+            entry = self.entries + self.receiver_entries[i].entry
+            sender: int = entry.sender
+            if sender not in all_locations:
+                all_locations[sender] = set()
+            all_locations[sender].add(entry.location)
         return all_locations
 
     def get_checked(self, state: State, team: int, slot: int) -> List[int]:
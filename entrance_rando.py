@@ -220,12 +220,15 @@ class ERPlacementState:
     def test_speculative_connection(self, source_exit: Entrance, target_entrance: Entrance,
                                     usable_exits: set[Entrance]) -> bool:
         copied_state = self.collection_state.copy()
+        player = self.world.player
         # simulated connection. A real connection is unsafe because the region graph is shallow-copied and would
-        # propagate back to the real multiworld.
-        copied_state.reachable_regions[self.world.player].add(target_entrance.connected_region)
-        copied_state.blocked_connections[self.world.player].remove(source_exit)
-        copied_state.blocked_connections[self.world.player].update(target_entrance.connected_region.exits)
-        copied_state.update_reachable_regions(self.world.player)
+        # propagate back to the real multiworld. The sets are replaced instead of modified, as they are shared with
+        # the real state until the copy updates its reachable regions.
+        copied_state.reachable_regions[player] = (copied_state.reachable_regions[player]
+                                                  | {target_entrance.connected_region})
+        copied_state.blocked_connections[player] = ((copied_state.blocked_connections[player] - {source_exit})
+                                                    | set(target_entrance.connected_region.exits))
+        copied_state.update_reachable_regions(player)
         copied_state.sweep_for_advancements()
         # test that at there are newly reachable randomized exits that are ACTUALLY reachable
         available_randomized_exits = copied_state.blocked_connections[self.world.player]
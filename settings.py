@@ -609,6 +609,24 @@ class ServerOptions(Group):
         OFF = 0
         ON = 1
 
+    class DatastorageKeyLimit(int):
+        """Most bytes a single value in the data storage of a room may take up, 0 for no limit"""
+
+    class DatastorageLimit(int):
+        """Most bytes all values in the data storage of a room may take up together, 0 for no limit"""
+
+    class MetricsFile(str):
+        """
+        File to write counters and timings of the room to every 15 seconds, in the text format of Prometheus,
+        which for example the textfile collector of its node exporter can read. Null to write none.
+        """
+
+    class Workers(int):
+        """
+        Number of worker processes that handle websockets, decoding and encoding of packets,
+        so a very large room can use more than one core. 0 handles them in the server process.
+        """
+
     host: str | None = None
     port: int = 38281
     password: str | None = None
@@ -628,6 +646,10 @@ class ServerOptions(Group):
     auto_shutdown: AutoShutdown = AutoShutdown(0)
     compatibility: Compatibility = Compatibility(2)
     log_network: LogNetwork = LogNetwork(0)
+    datastorage_key_limit: DatastorageKeyLimit = DatastorageKeyLimit(0)
+    datastorage_limit: DatastorageLimit = DatastorageLimit(0)
+    metrics_file: MetricsFile | None = None
+    workers: Workers = Workers(0)
 
 
 class GeneratorOptions(Group):
@@ -687,6 +709,12 @@ class GeneratorOptions(Group):
         start_inventory -> Move remaining items to start_inventory, generate additional filler items to fill locations.
         """
 
+    class MultidataCompression(int):
+        """
+        zlib compression level of the .archipelago file, from 1 (fastest) to 9 (smallest)
+        higher levels take a lot longer on large multiworlds for a slightly smaller file
+        """
+
     enemizer_path: EnemizerPath = EnemizerPath("EnemizerCLI/EnemizerCLI.Core")  # + ".exe" is implied on Windows
     player_files_path: PlayerFilesPath = PlayerFilesPath("Players")
     players: Players = Players(0)
@@ -696,6 +724,7 @@ class GeneratorOptions(Group):
     race: Race = Race(0)
     plando_options: PlandoOptions = PlandoOptions("bosses, connections, texts")
     panic_method: PanicMethod = PanicMethod("swap")
+    multidata_compression: MultidataCompression = MultidataCompression(6)
     loglevel: str = "info"
     logtime: bool = False
 
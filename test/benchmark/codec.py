@@ -0,0 +1,55 @@
+"""Micro benchmark comparing the codecs of NetUtils on packets like the ones that keep a server busy"""
+
+from timeit import timeit
+from typing import Any, Dict, List
+
+import path_change
+
+
+def make_packets() -> Dict[str, List[Dict[str, Any]]]:
+    from NetUtils import NetworkItem, NetworkPlayer, NetworkSlot, SlotType
+
+    return {
+        "ReceivedItems (5000)": [{"cmd": "ReceivedItems", "index": 0, "items": [
+            NetworkItem(77000 + n % 300, 78000 + n, 1 + n % 50, n % 4) for n in range(5000)]}],
+        "LocationInfo (500)": [{"cmd": "LocationInfo", "locations": [
+            NetworkItem(77000 + n % 300, 78000 + n, 1 + n % 50, n % 4) for n in range(500)]}],
+        "PrintJSON (140)": [{"cmd": "PrintJSON", "type": "ItemSend", "receiving": 2,
+                             "item": NetworkItem(77000 + n, 78000 + n, 1, 1), "data": [
+                                 {"text": "1", "type": "player_id"}, {"text": " sent "},
+                                 {"text": str(77000 + n), "player": 2, "flags": 1, "type": "item_id"},
+                                 {"text": " to "}, {"text": "2", "type": "player_id"},
+                                 {"text": " ("}, {"text": str(78000 + n), "player": 1, "type": "location_id"},
+                                 {"text": ")"}]} for n in range(140)],
+        "Connected (50 players)": [{"cmd": "Connected", "team": 0, "slot": 1,
+                                    "players": [NetworkPlayer(0, n, f"Player{n}", f"Player{n}") for n in range(50)],
+                                    "missing_locations": list(range(78000, 78500)),
+                                    "checked_locations": list(range(78500, 78600)),
+                                    "slot_info": {n: NetworkSlot(f"Player{n}", "Game", SlotType.player)
+                                                  for n in range(50)},
+                                    "hint_points": 0}],
+        "LocationChecks (500)": [{"cmd": "LocationChecks", "locations": list(range(78000, 78500))}],
+    }
+
+
+def main() -> None:
+    path_change.change_home()
+    from NetUtils import codecs
+
+    packets = make_packets()
+    for name, codec_type in codecs.items():
+        try:
+            codec = codec_type()
+        except ImportError:
+            print(f"{name} is not installed")
+            continue
+        for packet_name, packet in packets.items():
+            encoded = codec.encode(packet)
+            encode_time = min(timeit(lambda: codec.encode(packet), number=20) for _ in range(5)) / 20
+            decode_time = min(timeit(lambda: codec.decode(encoded), number=20) for _ in range(5)) / 20
+            print(f"{name:>6} {packet_name:<24} encode: {encode_time * 1000:7.3f} ms  "
+                  f"decode: {decode_time * 1000:7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+def run_reachability_benchmark(players: int = 20, regions_per_player: int = 64, locations_per_region: int = 4) -> None:
+    """
+    Run a benchmark of a full fill of a large multiworld, once with full reachability updates and once with
+    incremental reachability, and confirm both produce the same placements.
+
+    :param players: Amount of generated worlds in the multiworld.
+    :param regions_per_player: Amount of regions per world, connected as a binary tree gated by one key item each.
+    :param locations_per_region: Amount of locations in each region.
+    """
+    import argparse
+    import collections
+    import gc
+    import logging
+    import typing
+
+    from time_it import TimeIt
+
+    from Utils import init_logging
+    from BaseClasses import CollectionState, Item, ItemClassification, Location, MultiWorld, Region
+    from worlds.AutoWorld import World, call_all
+    from worlds.generic.Rules import set_item_dependencies
+    from Fill import distribute_items_restrictive
+
+    init_logging("Benchmark Runner")
+    logger = logging.getLogger("Benchmark")
+
+    key_names = [f"Key {region}" for region in range(1, regions_per_player)]
+    location_names = [f"Location {region}-{location}" for region in range(regions_per_player)
+                      for location in range(locations_per_region)]
+
+    rule_evaluations: typing.Counter[bool] = collections.Counter()
+
+    class BenchmarkWorld(World):
+        """Binary tree of regions where every region beyond the root is locked behind its own key."""
+        game = "Reachability Benchmark"
+        hidden = True
+        item_name_to_id = {name: code for code, name in enumerate(key_names + ["Filler"], 1)}
+        location_name_to_id = {name: code for code, name in enumerate(location_names, 1)}
+
+        def create_item(self, name: str) -> Item:
+            classification = ItemClassification.filler if name == "Filler" else ItemClassification.progression
+            return Item(name, classification, self.item_name_to_id[name], self.player)
+
+        def create_regions(self) -> None:
+            regions = [Region("Menu" if number == 0 else f"Region {number}", self.player, self.multiworld)
+                       for number in range(regions_per_player)]
+            for number, region in enumerate(regions):
+                region.locations += [Location(self.player, name, self.location_name_to_id[name], region)
+                                     for name in (f"Location {number}-{location}"
+                                                  for location in range(locations_per_region))]
+                if number:
+                    # like most real worlds, deeper regions also check for everything needed to get there
+                    keys = []
+                    ancestor = number
+                    while ancestor:
+                        keys.append(f"Key {ancestor}")
+                        ancestor = (ancestor - 1) // 2
+                    entrance = regions[(number - 1) // 2].connect(region, rule=self.make_rule(tuple(keys)))
+                    set_item_dependencies(entrance, keys)
+            self.multiworld.regions += regions
+
+        def make_rule(self, keys: typing.Tuple[str, ...]) -> typing.Callable[[CollectionState], bool]:
+            def rule(state: CollectionState) -> bool:
+                rule_evaluations[BenchmarkWorld.incremental_reachability] += 1
+                return state.has_all(keys, self.player)
+            return rule
+
+        def create_items(self) -> None:
+            self.multiworld.itempool += [self.create_item(name) for name in key_names]
+            self.multiworld.itempool += [self.create_item("Filler")
+                                         for _ in range(len(location_names) - len(key_names))]
+
+    def fill(incremental: bool) -> typing.Dict[typing.Tuple[int, str], typing.Tuple[int, str]]:
+        BenchmarkWorld.incremental_reachability = incremental
+        multiworld = MultiWorld(players)
+        multiworld.game = {player: BenchmarkWorld.game for player in multiworld.player_ids}
+        multiworld.player_name = {player: f"Tester{player}" for player in multiworld.player_ids}
+        multiworld.set_seed(0)
+        args = argparse.Namespace()
+        for name, option in BenchmarkWorld.options_dataclass.type_hints.items():
+            setattr(args, name, {player: option.from_any(option.default) for player in multiworld.player_ids})
+        multiworld.set_options(args)
+        multiworld.state = CollectionState(multiworld)
+        for step in ("create_regions", "create_items"):
+            call_all(multiworld, step)
+        gc.collect()
+        with TimeIt(f"{players} players filled with incremental_reachability={incremental}", logger):
+            distribute_items_restrictive(multiworld)
+        logger.info(f"{rule_evaluations[incremental]} entrance rule evaluations "
+                    f"with incremental_reachability={incremental}.")
+        return {(location.player, location.name): (location.item.player, location.item.name)
+                for location in multiworld.get_filled_locations()}
+
+    full_placements = fill(False)
+    incremental_placements = fill(True)
+    if full_placements == incremental_placements:
+        logger.info("Placements are identical.")
+    else:
+        logger.error("Placements differ between full and incremental reachability.")
+
+
+if __name__ == "__main__":
+    from path_change import change_home
+    change_home()
+    run_reachability_benchmark()
@@ -1,10 +1,11 @@
-from typing import List, Iterable
+from typing import Callable, Dict, List, Iterable
+import random
 import unittest
 
 from Options import Accessibility
 from test.general import generate_items, generate_locations, generate_test_multiworld
 from Fill import FillError, balance_multiworld_progression, fill_restrictive, \
-    distribute_early_items, distribute_items_restrictive
+    distribute_early_items, distribute_items_restrictive, find_balancing_replacements
 from BaseClasses import Entrance, LocationProgressType, MultiWorld, Region, Item, Location, \
     ItemClassification
 from worlds.generic.Rules import CollectionRule, add_item_rule, locality_rules, set_rule
@@ -143,6 +144,22 @@ class TestFillRestrictive(unittest.TestCase):
         self.assertEqual(1, len(player1.locations))
         self.assertEqual(player1.locations[0], loc2)
 
+    def test_skips_unreachable_locations(self):
+        """Tests that `fill_restrictive` picks the first fillable location in order and keeps the order of the rest"""
+        multiworld = generate_test_multiworld()
+        player1 = generate_player_data(multiworld, 1, 6, 0, 3)
+        locations = player1.locations
+        for location in locations[:4:2]:
+            set_rule(location, lambda state: False)
+        add_item_rule(locations[1], lambda item: item is not player1.basic_items[-1])
+
+        remaining = locations.copy()
+        fill_restrictive(multiworld, multiworld.state, remaining, player1.basic_items.copy())
+
+        self.assertEqual([None, player1.basic_items[1], None, player1.basic_items[2], player1.basic_items[0], None],
+                         [location.item for location in locations])
+        self.assertEqual([locations[0], locations[2], locations[5]], remaining)
+
     def test_minimal_fill(self):
         """Test that fill for minimal player can have unreachable items"""
         multiworld = generate_test_multiworld()
@@ -880,3 +897,169 @@ class TestBalanceMultiworldProgression(unittest.TestCase):
 
         self.assertRegionContains(
             self.player1.regions[2], self.player2.prog_items[0])
+
+
+class TestSphereTrace(TestBalanceMultiworldProgression):
+    def test_playthrough_from_trace(self) -> None:
+        """Tests that the playthrough built from a sphere trace is the same as one calculated from scratch"""
+        self.multiworld.spoiler.create_playthrough()
+        expected = self.multiworld.spoiler.playthrough
+        self.multiworld.spoiler.create_playthrough(sphere_trace=self.multiworld.get_sphere_trace(keep_states=True))
+        self.assertEqual(expected, self.multiworld.spoiler.playthrough)
+        self.assertEqual(4, len(expected))
+
+    def test_accessibility_from_trace(self) -> None:
+        """Tests that the sphere trace gives the same accessibility result as a fresh check"""
+        sphere_trace = self.multiworld.get_sphere_trace()
+        self.assertTrue(sphere_trace.beatable)
+        self.assertEqual(3, len(sphere_trace.spheres))
+        self.assertTrue(self.multiworld.fulfills_accessibility(sphere_trace=sphere_trace))
+
+        blocked_location = next(location for location in self.player1.regions[2].locations
+                                if not location.advancement)
+        set_rule(blocked_location, lambda state: False)
+        sphere_trace = self.multiworld.get_sphere_trace()
+        self.assertEqual({blocked_location}, sphere_trace.unreachable)
+        with self.assertRaises(FillError):
+            self.multiworld.fulfills_accessibility()
+        with self.assertRaises(FillError):
+            self.multiworld.fulfills_accessibility(sphere_trace=sphere_trace)
+
+
+def linear_replacements(candidates: List[Location],
+                        is_balanced: Callable[[List[Location], int], bool]) -> List[Location]:
+    """The candidate tests of progression balancing as they were before they got bounded, one test per candidate."""
+    candidates = candidates.copy()
+    replaced: List[Location] = []
+    while candidates:
+        testing = candidates.pop()
+        if not is_balanced(replaced, len(candidates)):
+            replaced.append(testing)
+    return replaced
+
+
+class TestFindBalancingReplacements(unittest.TestCase):
+    def setUp(self) -> None:
+        self.calls = 0
+
+    def weighted_test(self, candidates: List[Location], weights: Dict[Location, int],
+                      needed: int) -> Callable[[List[Location], int], bool]:
+        """Returns a test that is balanced if the collected candidates weigh at least `needed` together."""
+        def is_balanced(replaced: List[Location], prefix: int) -> bool:
+            self.calls += 1
+            return sum(weights[location] for location in replaced + candidates[:prefix]) >= needed
+
+        return is_balanced
+
+    def test_result_changes_in_searched_range(self) -> None:
+        """Tests that the search finds where the test results change and replaces the same candidates as before"""
+        candidates = [Location(1, f"location{i}") for i in range(10)]
+        is_balanced = self.weighted_test(candidates, dict.fromkeys(candidates, 1), 4)
+        expected = linear_replacements(candidates, is_balanced)
+        self.assertEqual(candidates[3::-1], expected)
+        linear_calls, self.calls = self.calls, 0
+        self.assertEqual(expected, find_balancing_replacements(candidates, is_balanced))
+        self.assertLess(self.calls, linear_calls)
+
+    def test_unbalanced_with_all_candidates(self) -> None:
+        """Tests that every candidate gets replaced after one test if not even all of them are enough"""
+        candidates = [Location(1, f"location{i}") for i in range(5)]
+        is_balanced = self.weighted_test(candidates, dict.fromkeys(candidates, 1), 6)
+        self.assertEqual(candidates[::-1], find_balancing_replacements(candidates, is_balanced))
+        self.assertEqual(1, self.calls)
+
+    def test_matches_linear_scan(self) -> None:
+        """Tests that the same candidates get replaced as with one test per candidate, for any monotone test"""
+        rng = random.Random(0)
+        for _ in range(500):
+            candidates = [Location(1, f"location{i}") for i in range(rng.randrange(12))]
+            weights = {location: rng.choice((0, 0, 1, 2, 5)) for location in candidates}
+            needed = rng.randrange(sum(weights.values()) + 2)
+            is_balanced = self.weighted_test(candidates, weights, needed)
+            with self.subTest(weights=list(weights.values()), needed=needed):
+                self.assertEqual(linear_replacements(candidates, is_balanced),
+                                 find_balancing_replacements(candidates, is_balanced))
+
+
+class TestBalancingSphereReuse(unittest.TestCase):
+    def setUp(self) -> None:
+        multiworld = generate_test_multiworld(3)
+        self.multiworld = multiworld
+        player1 = generate_player_data(multiworld, 1, prog_item_count=5, basic_item_count=24)
+        player2 = generate_player_data(multiworld, 2, prog_item_count=3, basic_item_count=19)
+        player3 = generate_player_data(multiworld, 3, prog_item_count=2, basic_item_count=19)
+        for player in (player1, player2, player3):
+            prog_items = {item.name for item in player.prog_items}
+            multiworld.completion_condition[player.id] = \
+                lambda state, prog_items=prog_items, player=player.id: state.has_all(prog_items, player)
+            multiworld.worlds[player.id].options.progression_balancing.value = 99
+
+        def key(player: PlayerDefinition, index: int) -> CollectionRule:
+            return lambda state: state.has(player.prog_items[index].name, player.id)
+
+        # a long chain of spheres for player1, which holds the keys of the other players
+        regions = [player1.generate_region(player1.menu, 6)]
+        for index in range(5):
+            regions.append(player1.generate_region(regions[-1], 6, key(player1, index)))
+        items = player1.basic_items + player2.basic_items + player3.basic_items
+        items = fill_region(multiworld, regions[0], [player1.prog_items[0]] + items)
+        items = fill_region(multiworld, regions[1], [player1.prog_items[1]] + items)
+        items = fill_region(multiworld, regions[2], [player1.prog_items[2], player3.prog_items[0]] + items)
+        items = fill_region(multiworld, regions[3], [player1.prog_items[3]] + items)
+        items = fill_region(multiworld, regions[4], [player1.prog_items[4], player2.prog_items[0]] + items)
+        # player2 stays unbalanced for several spheres in a row without any items being moved
+        player2.prog_items[0].location.progress_type = LocationProgressType.PRIORITY
+        items = fill_region(multiworld, regions[5], [player2.prog_items[2]] + items)
+
+        region = player2.generate_region(player2.menu, 3)
+        items = fill_region(multiworld, region, items)
+        region = player2.generate_region(region, 8, key(player2, 0))
+        items = fill_region(multiworld, region, items)
+        region = player2.generate_region(region, 7, key(player2, 2))
+        items = fill_region(multiworld, region, [player2.prog_items[1]] + items)
+
+        region = player3.generate_region(player3.menu, 3)
+        items = fill_region(multiworld, region, items)
+        region = player3.generate_region(region, 15, key(player3, 0))
+        items = fill_region(multiworld, region, [player3.prog_items[1]] + items)
+        self.assertFalse(items)
+
+    def test_same_placements(self) -> None:
+        """Tests that balancing moves the same items as when every sphere was found again after looking ahead"""
+        placements = {location.name: location.item.name for location in self.multiworld.get_locations()}
+        balance_multiworld_progression(self.multiworld)
+        moved = {location.name: location.item.name for location in self.multiworld.get_locations()
+                 if placements[location.name] != location.item.name}
+        # the result of balancing before spheres were kept between candidate searches
+        self.assertEqual({
+            "player1_region1_location1": "player2_progitem2",
+            "player1_region1_location2": "player3_progitem0",
+            "player1_region3_location1": "player1_item1",
+            "player1_region6_location0": "player1_item0",
+        }, moved)
+
+
+class TestPlaythrough(unittest.TestCase):
+    def setUp(self) -> None:
+        self.multiworld = generate_test_multiworld()
+        self.player1 = generate_player_data(self.multiworld, 1, 12, 12)
+        for location, item in zip(self.player1.locations, self.player1.prog_items):
+            self.multiworld.push_item(location, item, False)
+
+    def test_culls_unrequired_locations(self) -> None:
+        """Tests that the playthrough only keeps the locations that are required to beat the game"""
+        items = self.player1.prog_items
+        self.multiworld.completion_condition[1] = lambda state: state.has_all((items[1].name, items[9].name), 1)
+        self.multiworld.spoiler.create_playthrough()
+        self.assertEqual({str(self.player1.locations[1]): str(items[1]), str(self.player1.locations[9]): str(items[9])},
+                         self.multiworld.spoiler.playthrough["1"])
+
+    def test_culls_alternatives(self) -> None:
+        """Tests that only one of two interchangeable locations is kept"""
+        items = self.player1.prog_items
+        self.multiworld.completion_condition[1] = lambda state: state.has(items[0].name, 1) and \
+            state.has_any((items[5].name, items[6].name), 1)
+        self.multiworld.spoiler.create_playthrough()
+        sphere = self.multiworld.spoiler.playthrough["1"]
+        self.assertEqual(2, len(sphere))
+        self.assertIn(str(self.player1.locations[0]), sphere)
@@ -0,0 +1,74 @@
+import time
+import unittest
+from typing import List
+
+from BaseClasses import Item, ItemClassification, MultiWorld, Region
+from worlds.AutoWorld import call_all
+from . import TestWorld, setup_multiworld
+
+
+class TestIsolatedGeneration(unittest.TestCase):
+    players = 4
+
+    def setUp(self) -> None:
+        self.multiworld = setup_multiworld([TestWorld] * self.players, (), seed=0)
+        for player in self.multiworld.player_ids:
+            world = self.multiworld.worlds[player]
+            world.isolated_generation = True
+            world.create_regions = self.make_create_regions(self.multiworld, player)
+            world.create_items = self.make_create_items(self.multiworld, player)
+
+    @staticmethod
+    def make_create_regions(multiworld: MultiWorld, player: int):
+        def create_regions() -> None:
+            menu = Region("Menu", player, multiworld)
+            cave = Region("Cave", player, multiworld)
+            multiworld.regions += [menu, cave]
+            menu.connect(cave)
+            # the first players take the longest, so they finish last if they run at the same time
+            time.sleep(0.01 * (4 - player))
+            multiworld.register_indirect_condition(cave, menu.exits[0])
+        return create_regions
+
+    @staticmethod
+    def make_create_items(multiworld: MultiWorld, player: int):
+        def create_items() -> None:
+            for number in range(3):
+                time.sleep(0.005 * (4 - player))
+                multiworld.itempool.append(Item(f"Item {number}", ItemClassification.filler, None, player))
+        return create_items
+
+    def item_order(self) -> List[str]:
+        return [f"{item.player}: {item.name}" for item in self.multiworld.itempool]
+
+    def test_same_order_as_sequential(self) -> None:
+        """Ensure isolated worlds add to the multiworld in the same order as if they were called one by one."""
+        call_all(self.multiworld, "create_regions")
+        call_all(self.multiworld, "create_items")
+        self.assertEqual([f"{player}: Item {number}" for player in self.multiworld.player_ids for number in range(3)],
+                         self.item_order())
+        self.assertEqual(list(self.multiworld.player_ids),
+                         [region.player for region in self.multiworld.indirect_connections])
+
+    def test_mixed_with_sequential_worlds(self) -> None:
+        """Ensure worlds that aren't isolated are called in between the isolated ones, keeping the player order."""
+        self.multiworld.worlds[2].isolated_generation = False
+        call_all(self.multiworld, "create_regions")
+        call_all(self.multiworld, "create_items")
+        self.assertEqual([f"{player}: Item {number}" for player in self.multiworld.player_ids for number in range(3)],
+                         self.item_order())
+        self.assertEqual(list(self.multiworld.player_ids),
+                         [region.player for region in self.multiworld.indirect_connections])
+
+    def test_error_in_player_order(self) -> None:
+        """Ensure the error of the first failing player is raised, regardless of which thread fails first."""
+        def fail(player: int):
+            def generate_early() -> None:
+                time.sleep(0.01 * (4 - player))
+                raise ValueError(f"player {player}")
+            return generate_early
+
+        for player in (2, 3):
+            self.multiworld.worlds[player].generate_early = fail(player)
+        with self.assertRaisesRegex(ValueError, "player 2"):
+            call_all(self.multiworld, "generate_early")
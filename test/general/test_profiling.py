@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+import unittest
+
+import Profiling
+from BaseClasses import CollectionState, Location
+from Fill import distribute_items_restrictive
+from worlds.AutoWorld import AutoWorldRegister, call_all
+from . import setup_solo_multiworld
+
+
+class TestProfiling(unittest.TestCase):
+    def tearDown(self) -> None:
+        Profiling.stop()
+
+    def test_inactive(self) -> None:
+        """Tests that spans and counters do nothing without a running report"""
+        with Profiling.span("nothing"):
+            Profiling.count("nothing")
+        self.assertIsNone(Profiling.stop())
+
+    def test_nested_counters(self) -> None:
+        """Tests that counters are added to the innermost span and every span it ran in"""
+        report = Profiling.start(trace_memory=False)
+        with Profiling.span("outer"):
+            Profiling.count("swaps")
+            with Profiling.span("inner", player=1, player_name="Tester1"):
+                Profiling.count("swaps", 2)
+            with Profiling.span("outer"):
+                Profiling.count("sweeps")
+        self.assertIs(report, Profiling.stop())
+
+        summary = report.summary()
+        self.assertEqual({"swaps": 3, "sweeps": 1}, summary["counters"])
+        # the nested span of the same name is already part of the outer one
+        self.assertEqual(1, summary["stages"]["outer"]["calls"])
+        self.assertEqual({"swaps": 3, "sweeps": 1}, summary["stages"]["outer"]["counters"])
+        self.assertEqual("Tester1", summary["players"][1]["player_name"])
+        self.assertEqual({"swaps": 2}, summary["players"][1]["stages"]["inner"]["counters"])
+
+    def test_generation_report(self) -> None:
+        """Tests that a report of a generation covers the stages, the fill and the counted can_reach calls"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "profile.json")
+            with Profiling.profile(path):
+                multiworld = setup_solo_multiworld(AutoWorldRegister.world_types["Timespinner"])
+                distribute_items_restrictive(multiworld)
+                call_all(multiworld, "post_fill")
+                multiworld.can_beat_game(CollectionState(multiworld))
+            with open(path) as f:
+                report = json.load(f)
+
+        # the counting can_reach is removed again once the report is done
+        self.assertEqual("BaseClasses", Location.can_reach.__module__)
+        names = {event["name"] for event in report["traceEvents"]}
+        self.assertIn("create_regions", names)
+        self.assertIn("create_regions (Player 1)", names)
+        self.assertIn("fill_restrictive (Progression)", names)
+        self.assertTrue(all(event["ph"] == "X" and event["dur"] >= 0 for event in report["traceEvents"]))
+        summary = report["otherData"]
+        self.assertIn("distribute_items_restrictive", summary["stages"])
+        self.assertIn("generate_early", summary["players"]["1"]["stages"])
+        self.assertGreater(summary["counters"]["sweeps"], 0)
+        self.assertGreater(summary["counters"]["Location.can_reach"], 0)
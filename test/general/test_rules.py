@@ -0,0 +1,72 @@
+import unittest
+from unittest import mock
+
+from BaseClasses import CollectionState, Item, ItemClassification, Location, Region
+from worlds.generic.Rules import (CompiledRule, RuleBatch, add_rule, can_reach_region_rule, has_all_rule, has_any_rule,
+                                  has_group_rule, has_rule, set_rule)
+from . import generate_test_multiworld
+
+
+class TestCompiledRules(unittest.TestCase):
+    def setUp(self) -> None:
+        self.multiworld = generate_test_multiworld(2)
+        self.multiworld.worlds[1].item_name_groups = {"Tools": {"Hammer", "Saw"}}
+        menu = self.multiworld.get_region("Menu", 1)
+        self.cave = Region("Cave", 1, self.multiworld)
+        self.multiworld.regions.append(self.cave)
+        menu.connect(self.cave, rule=lambda state: state.has("Lamp", 1))
+        self.state = CollectionState(self.multiworld)
+
+    def collect(self, item_name: str, player: int = 1) -> None:
+        self.state.collect(Item(item_name, ItemClassification.progression, None, player), True)
+
+    def test_same_as_state_methods(self) -> None:
+        """Ensure each compiled rule gives the same result as the CollectionState method it stands for."""
+        rules = (
+            (has_rule("Hammer", 1), lambda state: state.has("Hammer", 1)),
+            (has_rule("Hammer", 1, 2), lambda state: state.count("Hammer", 1) >= 2),
+            (has_all_rule(("Hammer", "Saw"), 1), lambda state: state.has_all(("Hammer", "Saw"), 1)),
+            (has_any_rule(("Hammer", "Lamp"), 1), lambda state: state.has_any(("Hammer", "Lamp"), 1)),
+            (has_group_rule(self.multiworld, "Tools", 1, 2), lambda state: state.has_group("Tools", 1, 2)),
+            (can_reach_region_rule(self.cave), self.cave.can_reach),
+            (has_rule("Hammer", 2) & can_reach_region_rule(self.cave),
+             lambda state: state.has("Hammer", 2) and self.cave.can_reach(state)),
+        )
+        for item_name, player in (("Hammer", 2), ("Hammer", 1), ("Lamp", 1), ("Hammer", 1), ("Saw", 1)):
+            self.collect(item_name, player)
+            for compiled_rule, rule in rules:
+                with self.subTest(rule=compiled_rule, collected=item_name):
+                    self.assertEqual(rule(self.state), compiled_rule(self.state))
+
+    def test_add_rule_stays_compiled(self) -> None:
+        """Ensure adding a compiled rule to a compiled rule keeps it compiled, and anything else doesn't."""
+        location = Location(1, "Shelf", None, self.cave)
+        set_rule(location, has_rule("Hammer", 1))
+        add_rule(location, has_rule("Saw", 1))
+        self.assertIsInstance(location.access_rule, CompiledRule)
+        add_rule(location, lambda state: True)
+        self.assertNotIsInstance(location.access_rule, CompiledRule)
+
+    def test_batch_same_as_can_reach(self) -> None:
+        """Ensure a RuleBatch finds the same reachable locations as checking each location, with or without NumPy."""
+        menu = self.multiworld.get_region("Menu", 1)
+        rules = [has_rule("Hammer", 1), has_any_rule(("Saw", "Lamp"), 1), has_all_rule(("Hammer", "Saw"), 1),
+                 has_group_rule(self.multiworld, "Tools", 1, 2), lambda state: state.has("Saw", 1),
+                 can_reach_region_rule(self.cave), CompiledRule()]
+        locations = []
+        for region in (menu, self.cave):
+            for number, rule in enumerate(rules):
+                location = Location(1, f"{region.name} {number}", None, region)
+                location.access_rule = rule
+                region.locations.append(location)
+                locations.append(location)
+
+        for numpy_available in (True, False):
+            with self.subTest(numpy=numpy_available):
+                self.state = CollectionState(self.multiworld)
+                with mock.patch.dict("sys.modules", {} if numpy_available else {"numpy": None}):
+                    rule_batch = RuleBatch(locations)
+                for item_name in ("Saw", "Hammer", "Lamp", "Hammer"):
+                    self.collect(item_name)
+                    self.assertEqual([location for location in locations if location.can_reach(self.state)],
+                                     rule_batch.reachable(self.state, locations))
@@ -1,7 +1,11 @@
 import unittest
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Set, Tuple
 
+from BaseClasses import CollectionState, Item, ItemClassification, Region
 from worlds.AutoWorld import AutoWorldRegister, call_all
-from . import setup_solo_multiworld
+from worlds.generic.Rules import add_rule, set_item_dependencies
+from . import generate_test_multiworld, setup_solo_multiworld
 
 
 class TestBase(unittest.TestCase):
@@ -27,3 +31,138 @@ class TestBase(unittest.TestCase):
                     with self.subTest("Step", step=step):
                         call_all(multiworld, step)
                         self.assertTrue(multiworld.get_all_state(False, allow_partial_entrances=True))
+
+
+class TestIncrementalReachability(unittest.TestCase):
+    def setUp(self) -> None:
+        self.multiworld = generate_test_multiworld()
+        self.world = self.multiworld.worlds[1]
+        self.rule_calls = Counter()
+        menu = self.multiworld.get_region("Menu", 1)
+        regions = {name: Region(name, 1, self.multiworld) for name in ("Cave", "Tower", "Peak", "Lake", "Shrine")}
+        self.multiworld.regions += regions.values()
+
+        def counted(name: str, rule):
+            def counted_rule(state: CollectionState) -> bool:
+                self.rule_calls[name] += 1
+                return rule(state)
+            return counted_rule
+
+        set_item_dependencies(menu.connect(regions["Cave"], "Cave Door",
+                                           counted("Cave Door", lambda state: state.has("Lamp", 1))), ("Lamp",))
+        set_item_dependencies(regions["Cave"].connect(regions["Tower"], "Tower Door",
+                                                      lambda state: state.has_all(("Key", "Lamp"), 1)), ("Key", "Lamp"))
+        peak = regions["Tower"].connect(regions["Peak"], "Peak Climb",
+                                        lambda state: state.can_reach_region("Lake", 1) and state.has("Rope", 1))
+        set_item_dependencies(peak, ("Rope",))
+        self.multiworld.register_indirect_condition(regions["Lake"], peak)
+        # undeclared, so it has to be rechecked on every update
+        menu.connect(regions["Lake"], "Swim", lambda state: state.count("Key", 1) >= 2)
+        set_item_dependencies(regions["Lake"].connect(regions["Shrine"], "Shrine Gate",
+                                                      counted("Shrine Gate", lambda state: state.has("Relic", 1))),
+                              ("Relic",))
+
+    def collect_each(self, item_names: Iterable[str]) -> List[Tuple[Set[str], Dict[str, Any]]]:
+        state = CollectionState(self.multiworld)
+        results = []
+        for item_name in item_names:
+            state.collect(Item(item_name, ItemClassification.progression, None, 1), True)
+            self.assertTrue(self.multiworld.get_region("Menu", 1).can_reach(state))
+            results.append(({region.name for region in state.reachable_regions[1]},
+                            {str(spot): path for spot, path in state.path.items()}))
+        return results
+
+    def test_same_as_full_update(self) -> None:
+        """Ensure incremental updates reach the same regions with the same paths as a full recheck."""
+        for order in (("Filler", "Rope", "Key", "Lamp", "Key", "Relic"),
+                      ("Key", "Key", "Relic", "Rope", "Filler", "Lamp")):
+            with self.subTest(order=order):
+                self.world.incremental_reachability = False
+                expected = self.collect_each(order)
+                self.world.incremental_reachability = True
+                self.assertEqual(expected, self.collect_each(order))
+        self.assertEqual({"Menu", "Cave", "Tower", "Peak", "Lake", "Shrine"}, expected[-1][0])
+
+    def test_skips_unaffected_entrances(self) -> None:
+        """Ensure entrances with declared item dependencies are only rechecked when one of those items is collected."""
+        self.world.incremental_reachability = True
+        self.collect_each(("Filler", "Key", "Filler", "Key", "Filler"))
+        self.assertEqual(1, self.rule_calls["Cave Door"])
+        self.assertEqual(1, self.rule_calls["Shrine Gate"])
+
+        self.rule_calls.clear()
+        self.world.incremental_reachability = False
+        self.collect_each(("Filler", "Key", "Filler", "Key", "Filler"))
+        self.assertEqual(5, self.rule_calls["Cave Door"])
+
+    def test_changed_rule_discards_dependencies(self) -> None:
+        """Ensure rule helpers drop a declaration that might no longer match the rule."""
+        entrance = self.multiworld.get_entrance("Cave Door", 1)
+        add_rule(entrance, lambda state: state.has("Map", 1))
+        self.assertIsNone(entrance.item_dependencies)
+
+
+class TestCopy(unittest.TestCase):
+    def setUp(self) -> None:
+        self.multiworld = generate_test_multiworld(2)
+        menu = self.multiworld.get_region("Menu", 1)
+        cave = Region("Cave", 1, self.multiworld)
+        self.multiworld.regions.append(cave)
+        menu.connect(cave, "Cave Door", lambda state: state.has("Lamp", 1))
+        self.cave = cave
+        self.state = CollectionState(self.multiworld)
+        self.assertFalse(self.cave.can_reach(self.state))
+
+    def test_copy_is_independent(self) -> None:
+        """Ensure changes to a copy don't affect the original state."""
+        copy = self.state.copy()
+        copy.collect(Item("Lamp", ItemClassification.progression, None, 1), True)
+        copy.add_item("Rope", 2)
+        self.assertTrue(self.cave.can_reach(copy))
+        self.assertTrue(copy.has("Rope", 2))
+        self.assertFalse(self.state.has("Lamp", 1))
+        self.assertFalse(self.state.has("Rope", 2))
+        self.assertFalse(self.cave.can_reach(self.state))
+        self.assertNotIn(self.cave, self.state.reachable_regions[1])
+
+    def test_original_is_independent(self) -> None:
+        """Ensure changes to the original state don't affect an earlier copy."""
+        copy = self.state.copy()
+        self.state.collect(Item("Lamp", ItemClassification.progression, None, 1), True)
+        self.assertTrue(self.cave.can_reach(self.state))
+        self.assertFalse(copy.has("Lamp", 1))
+        self.assertFalse(self.cave.can_reach(copy))
+
+    def test_copy_keeps_reachability(self) -> None:
+        """Ensure a copy starts out with the same reachable regions, and shares them until it changes."""
+        self.state.collect(Item("Lamp", ItemClassification.progression, None, 1), True)
+        self.assertTrue(self.cave.can_reach(self.state))
+        copy = self.state.copy()
+        self.assertTrue(self.cave.can_reach(copy))
+        self.assertIs(self.state.reachable_regions[1], copy.reachable_regions[1])
+        self.assertIs(self.state.prog_items[2], copy.prog_items[2])
+        copy.remove(Item("Lamp", ItemClassification.progression, None, 1))
+        self.assertFalse(self.cave.can_reach(copy))
+        self.assertTrue(self.cave.can_reach(self.state))
+
+    def test_rule_cache_is_independent(self) -> None:
+        """Ensure values an access rule caches in a copy's prog_items don't reach the original or other copies."""
+        def cache_rule(state: CollectionState) -> bool:
+            if not state.prog_items[1]["Cache Fresh"]:
+                prog_items = state.own_prog_items(1)
+                prog_items["Cached Lamps"] = state.count("Lamp", 1)
+                prog_items["Cache Fresh"] = 1
+            return state.prog_items[1]["Cached Lamps"] > 0
+
+        door = self.multiworld.get_entrance("Cave Door", 1)
+        door.access_rule = cache_rule
+        sibling = self.state.copy()
+        copy = self.state.copy()
+        copy.add_item("Lamp", 1)
+        self.assertTrue(door.can_reach(copy))
+        self.assertEqual(copy.prog_items[1]["Cached Lamps"], 1)
+        self.assertFalse(door.can_reach(sibling))
+        self.assertEqual(sibling.prog_items[1]["Cached Lamps"], 0)
+        self.assertIsNot(sibling.prog_items[1], self.state.prog_items[1])
+        self.assertNotIn("Cache Fresh", self.state.prog_items[1])
+        self.assertNotIn("Cached Lamps", self.state.prog_items[1])
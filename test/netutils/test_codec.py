@@ -0,0 +1,59 @@
+# Tests for the codecs behind NetUtils.encode and NetUtils.decode
+import json
+import typing
+import unittest
+
+from NetUtils import ClientStatus, HintStatus, JSONCodec, NetworkItem, NetworkPlayer, NetworkSlot, OrjsonCodec, \
+    SlotType, codecs
+from Utils import Version
+
+sample_packets: typing.List[typing.Dict[str, typing.Any]] = [
+    {"cmd": "ReceivedItems", "index": 0, "items": [NetworkItem(100 + n, 200 + n, 1 + n % 3, n % 4) for n in range(50)]},
+    {"cmd": "LocationInfo", "locations": (NetworkItem(1, 2, 3),)},
+    {"cmd": "RoomUpdate", "checked_locations": {1, 2, 3}, "hint_points": 5},
+    {"cmd": "Connected", "players": [NetworkPlayer(0, 1, "Ä Player", "Player")], "slot_info": {
+        1: NetworkSlot("Group", "Game", SlotType.group, [1, 2])}, "slot_data": {"nested": {"a": [(1, 2)]}}},
+    {"cmd": "RoomInfo", "version": Version(0, 6, 0), "hint_status": HintStatus.HINT_FOUND},
+    {"cmd": "Retrieved", "keys": {"client_status": ClientStatus.CLIENT_GOAL, "empty": None, "float": 0.5}},
+]
+
+
+class TestCodecs(unittest.TestCase):
+    instances = [codec_type() for codec_type in codecs.values()]
+
+    def test_same_encoding(self) -> None:
+        """Tests that every codec encodes to the same JSON"""
+        expected = json.loads(JSONCodec().encode(sample_packets))
+        for codec in self.instances:
+            with self.subTest(codec.name):
+                self.assertEqual(expected, json.loads(codec.encode(sample_packets)))
+
+    def test_round_trip(self) -> None:
+        """Tests that NamedTuples of the protocol decode to what was encoded"""
+        for codec in self.instances:
+            with self.subTest(codec.name):
+                decoded = codec.decode(codec.encode(sample_packets))
+                self.assertEqual(sample_packets[0]["items"], decoded[0]["items"])
+                self.assertIsInstance(decoded[0]["items"][0], NetworkItem)
+                self.assertEqual(Version(0, 6, 0), decoded[4]["version"])
+                self.assertEqual(["Ä Player"], [player.alias for player in decoded[3]["players"]])
+
+    def test_escaped_class(self) -> None:
+        """Tests that a "class" written with escapes still decodes to a NamedTuple"""
+        data = '[{"cmd": "Connect", "version": {"major": 0, "minor": 6, "build": 0, "\\u0063lass": "Version"}}]'
+        for codec in self.instances:
+            with self.subTest(codec.name):
+                self.assertEqual(Version(0, 6, 0), codec.decode(data)[0]["version"])
+
+    def test_fallback(self) -> None:
+        """Tests that orjson leaves what it can't handle to the json module"""
+        codec = OrjsonCodec()
+        self.assertEqual('[18446744073709551616]', codec.encode([2 ** 64]))
+        self.assertEqual('[{"v":Infinity,"w":[NaN],"x":null}]',
+                         codec.encode([{"v": float("inf"), "w": (float("nan"),), "x": None}]))
+        self.assertEqual('[{"x":null}]', codec.encode([{"x": None}]))
+        self.assertEqual([float("inf")], codec.decode("[Infinity]"))
+        with self.assertRaises(TypeError):
+            codec.encode([object()])
+        with self.assertRaises(ValueError):
+            codec.decode("[")
@@ -112,6 +112,15 @@ class Base:
             self.assertEqual(sorted(self.store.find_item(set(range(2048)), 13)),
                              [(1, 13, 13, 1, 0)])
 
+        def test_find_item_order(self) -> None:
+            # results come in the order of the store, regardless of how the receivers are indexed
+            expected = [(sender, location, item, receiver, flags)
+                        for sender, locations in self.store.items()
+                        for location, (item, receiver, flags) in locations.items()
+                        if item == 99 and receiver in {3, 4, 5}]
+            self.assertEqual(len(expected), 3)
+            self.assertEqual(list(self.store.find_item({5, 4, 3}, 99)), expected)
+
         def test_get_for_player(self) -> None:
             self.assertEqual(self.store.get_for_player(3), {4: {9}})
             self.assertEqual(self.store.get_for_player(1), {1: {13}, 2: {22, 23}})
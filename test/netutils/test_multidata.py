@@ -0,0 +1,72 @@
+# Tests for the multidata formats read by MultiServer.Context.decompress and written by NetUtils.write_multidata
+import io
+import pickle
+import typing
+import unittest
+import zlib
+
+from NetUtils import MultiDataSections, NetworkSlot, SlotType, write_multidata
+
+sample_data: typing.Dict[str, typing.Any] = {
+    "slot_info": {1: NetworkSlot("Player1", "Archipelago", SlotType.player)},
+    "locations": {1: {11: (21, 1, 0), 12: (22, 1, 1)}},
+    "spheres": [{1: {11}}, {1: {12}}],
+    "seed_name": "1234",
+}
+
+
+def encode(multidata: typing.Mapping[str, typing.Any]) -> bytes:
+    buffer = io.BytesIO()
+    write_multidata(buffer, multidata, 1)
+    return buffer.getvalue()
+
+
+class TestMultiDataSections(unittest.TestCase):
+    def test_round_trip(self) -> None:
+        """Tests that every section reads back as it was written, in the same order"""
+        data = encode(sample_data)
+        self.assertEqual(4, data[0])
+        multidata = MultiDataSections(data)
+        self.assertEqual(list(sample_data), list(multidata))
+        self.assertEqual(sample_data, dict(multidata))
+
+    def test_lazy_sections(self) -> None:
+        """Tests that only sections that get accessed are decoded"""
+        multidata = MultiDataSections(encode(sample_data))
+        self.assertEqual("1234", multidata["seed_name"])
+        self.assertIsNone(multidata.encoded_section("seed_name"))
+        self.assertIsNotNone(multidata.encoded_section("spheres"))
+        self.assertEqual(sample_data["locations"], multidata.pop("locations"))
+        self.assertNotIn("locations", multidata)
+
+    def test_rewrite(self) -> None:
+        """Tests that writing read multidata again keeps the untouched sections and updates the changed ones"""
+        multidata = MultiDataSections(encode(sample_data))
+        untouched = bytes(multidata.encoded_section("spheres"))
+        multidata["slot_info"][2] = NetworkSlot("Player2", "Archipelago", SlotType.player)
+        del multidata["seed_name"]
+        data = encode(multidata)
+        self.assertIn(untouched, data)
+
+        rewritten = MultiDataSections(data)
+        self.assertEqual(["slot_info", "locations", "spheres"], list(rewritten))
+        self.assertEqual("Player2", rewritten["slot_info"][2].name)
+        self.assertEqual(sample_data["spheres"], rewritten["spheres"])
+
+    def test_truncated(self) -> None:
+        """Tests that a cut off file is not mistaken for one with fewer sections"""
+        data = encode(sample_data)
+        with self.assertRaises(ValueError):
+            MultiDataSections(data[:-1])
+
+
+class TestDecompress(unittest.TestCase):
+    def test_formats(self) -> None:
+        """Tests that the server reads the current format as well as format 3"""
+        from MultiServer import Context
+        from Utils import VersionException
+
+        self.assertEqual(sample_data, dict(Context.decompress(encode(sample_data))))
+        self.assertEqual(sample_data, Context.decompress(bytes([3]) + zlib.compress(pickle.dumps(sample_data))))
+        with self.assertRaises(VersionException):
+            Context.decompress(bytes([5]) + encode(sample_data)[1:])
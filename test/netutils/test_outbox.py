@@ -0,0 +1,101 @@
+# Tests for NetUtils.Outbox
+import asyncio
+import json
+import typing
+import unittest
+
+from NetUtils import Outbox, encode
+
+
+class SlowSocket:
+    """Socket that only sends once it is let through"""
+    open = True
+
+    def __init__(self) -> None:
+        self.sent: typing.List[typing.Any] = []
+        self.frames = 0
+        self.ready = asyncio.Event()
+
+    async def send(self, msg: str) -> None:
+        await self.ready.wait()
+        self.frames += 1
+        self.sent.extend(json.loads(msg))
+
+    async def close(self) -> None:
+        self.open = False
+
+
+def text(number: int) -> str:
+    return encode([{"cmd": "PrintJSON", "data": [{"text": str(number)}]}])
+
+
+class TestOutbox(unittest.IsolatedAsyncioTestCase):
+    async def send_all(self, socket: SlowSocket) -> None:
+        socket.ready.set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    async def test_coalescing(self) -> None:
+        """Tests that frames queued while a send is waiting go out together, in order"""
+        socket = SlowSocket()
+        outbox = Outbox(socket)
+        outbox.put(text(0), True)
+        await asyncio.sleep(0)
+        for number in range(1, 5):
+            outbox.put(text(number), True)
+        outbox.put(encode([{"cmd": "Bounced"}]))
+        await self.send_all(socket)
+        self.assertEqual(["0", "1", "2", "3", "4"], [msg["data"][0]["text"] for msg in socket.sent[:5]])
+        self.assertEqual("Bounced", socket.sent[5]["cmd"])
+        self.assertEqual(2, socket.frames)
+        self.assertEqual(4, outbox.stats["coalesced_frames"])
+        self.assertEqual(0, outbox.size)
+
+    async def test_text_dropped(self) -> None:
+        """Tests that a client that falls behind loses its text, but no other messages, and is told so"""
+        socket = SlowSocket()
+        outbox = Outbox(socket)
+        outbox.text_limit = len(text(1)) * 3
+        outbox.put(text(0), True)
+        await asyncio.sleep(0)
+        outbox.put(text(1), True)
+        outbox.put(encode([{"cmd": "RoomUpdate"}]))
+        outbox.put(text(2), True)
+        outbox.put(text(3), True)
+        self.assertEqual(3, outbox.stats["dropped_messages"])
+        self.assertEqual(0, outbox.text_size)
+        outbox.put(text(4), True)
+        self.assertEqual(len(text(4)), outbox.text_size)
+        await self.send_all(socket)
+        self.assertEqual(["PrintJSON", "PrintJSON", "RoomUpdate", "PrintJSON"], [msg["cmd"] for msg in socket.sent])
+        self.assertIn("3 messages were skipped", socket.sent[1]["data"][0]["text"])
+        self.assertEqual(0, outbox.text_size)
+
+    async def test_overflow(self) -> None:
+        """Tests that a client that falls behind too far without any text to drop gets disconnected"""
+        socket = SlowSocket()
+        outbox = Outbox(socket)
+        outbox.text_limit = outbox.limit = 100
+        outbox.put(encode([{"cmd": "Bounced", "data": "x" * 50}]))
+        outbox.put(encode([{"cmd": "Bounced", "data": "x" * 50}]))
+        outbox.put(encode([{"cmd": "Bounced", "data": "x" * 50}]))
+        await asyncio.sleep(0)
+        self.assertFalse(socket.open)
+        self.assertEqual(1, outbox.stats["overflow_disconnects"])
+        self.assertEqual(0, outbox.size)
+
+    async def test_large_reply(self) -> None:
+        """Tests that a reply larger than limit is only slow to arrive, without dropping text or disconnecting"""
+        socket = SlowSocket()
+        outbox = Outbox(socket)
+        outbox.text_limit = outbox.limit = 100
+        outbox.put(encode([{"cmd": "DataPackage", "data": "x" * 200}]), reply=True)
+        outbox.put(text(0), True)
+        outbox.put(encode([{"cmd": "Bounced"}]))
+        await asyncio.sleep(0)
+        self.assertTrue(socket.open)
+        self.assertEqual(0, outbox.stats["overflow_disconnects"])
+        self.assertEqual(0, outbox.stats["dropped_messages"])
+        await self.send_all(socket)
+        self.assertEqual(["DataPackage", "PrintJSON", "Bounced"], [msg["cmd"] for msg in socket.sent])
+        self.assertEqual(0, outbox.reply_size)
@@ -1,5 +1,24 @@
+import asyncio
+import datetime
+import json
+import os
+import pickle
+import socket
+import tempfile
+import typing
 import unittest
-from MultiServer import Context, ServerCommandProcessor
+import zlib
+
+import websockets
+from typing_extensions import override
+
+from MultiServer import Client, Context, ServerCommandProcessor, ShardedContext, WorkerLink, WorkerPool, \
+    format_metrics, get_encoded_connected, get_encoded_data_package, load_save, modify_functions, process_client_cmd, \
+    save_journal_magic, send_items_to, send_new_items, update_aliases
+from NetUtils import GamesPackage, Hint, HintStatus, LocationStore, NetworkItem, NetworkSlot, SlotType, decode, encode
+
+if typing.TYPE_CHECKING:
+    from NetUtils import ServerConnection
 
 
 class TestResolvePlayerName(unittest.TestCase):
@@ -38,3 +57,425 @@ class TestResolvePlayerName(unittest.TestCase):
         assert p.resolve_player("ABC") == (1, 2, "abc"), "case insensitive resolves when 1 match"
         assert p.resolve_player("abcd") == (1, 3, "abCD"), "case insensitive resolves when 1 match"
         assert not p.resolve_player("aB"), "partial name shouldn't resolve to player"
+
+
+class RecordingSocket:
+    open = True
+
+    def __init__(self) -> None:
+        self.sent: typing.List[typing.Any] = []
+
+    async def send(self, msg: str) -> None:
+        self.sent.extend(json.loads(msg))
+
+
+def recording_client(ctx: Context, socket: RecordingSocket) -> Client:
+    return Client(typing.cast("ServerConnection", socket), ctx)
+
+
+class TestItemDelivery(unittest.IsolatedAsyncioTestCase):
+    @override
+    def setUp(self) -> None:
+        self.ctx = Context("", 0, "", "", 0, 0, False)
+        self.sockets = {slot: RecordingSocket() for slot in (1, 2)}
+        self.ctx.clients = {0: {}}
+        for slot, socket in self.sockets.items():
+            client = recording_client(self.ctx, socket)
+            client.team, client.slot = 0, slot
+            self.ctx.clients[0][slot] = [client]
+
+    async def test_coalesced_delivery(self) -> None:
+        """Tests that items sent in the same event loop iteration reach only their receiver, in one message"""
+        for location in (1, 2):
+            send_items_to(self.ctx, 0, 1, NetworkItem(10 + location, location, 2, 0))
+            send_new_items(self.ctx)
+        self.assertEqual({(0, 1)}, self.ctx.pending_item_slots)
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        self.assertFalse(self.ctx.pending_item_slots)
+        self.assertEqual(1, len(self.sockets[1].sent))
+        self.assertEqual(0, self.sockets[1].sent[0]["index"])
+        self.assertEqual([11, 12], [item["item"] for item in self.sockets[1].sent[0]["items"]])
+        self.assertEqual([], self.sockets[2].sent)
+
+        send_items_to(self.ctx, 0, 1, NetworkItem(13, 3, 2, 0))
+        send_new_items(self.ctx)
+        for _ in range(3):
+            await asyncio.sleep(0)
+        self.assertEqual(2, self.sockets[1].sent[1]["index"])
+
+
+class TestDataStorage(unittest.IsolatedAsyncioTestCase):
+    clients: typing.Dict[int, Client]
+
+    @override
+    def setUp(self) -> None:
+        self.ctx = Context("", 0, "", "", 0, 0, False)
+        self.sockets = {slot: RecordingSocket() for slot in (1, 2, 3)}
+        self.clients = {}
+        self.ctx.clients = {0: {}}
+        for slot, socket in self.sockets.items():
+            client = recording_client(self.ctx, socket)
+            client.team, client.slot, client.auth = 0, slot, True
+            self.ctx.clients[0][slot] = [client]
+            self.clients[slot] = client
+
+    async def command(self, slot: int, **args: typing.Any) -> None:
+        await process_client_cmd(self.ctx, self.clients[slot], args)
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    def received(self, slot: int) -> typing.List[typing.Dict[str, typing.Any]]:
+        sent, self.sockets[slot].sent = self.sockets[slot].sent, []
+        return sent
+
+    async def test_deltas(self) -> None:
+        """Tests that clients that want deltas can follow a value with the operations of each Set"""
+        await self.command(2, cmd="SetNotify", keys=["tracker"], deltas=True)
+        await self.command(3, cmd="SetNotify", keys=[], prefixes=["track"])
+        await self.command(1, cmd="Set", key="tracker", default={}, operations=[{"operation": "update",
+                                                                                  "value": {"a": 1}}])
+        value = self.received(2)[0]["value"]
+        self.assertEqual({"a": 1}, value)
+        self.assertEqual({"a": 1}, self.received(3)[0]["value"])
+
+        await self.command(1, cmd="Set", key="tracker", default={}, operations=[{"operation": "update",
+                                                                                  "value": {"b": 2}},
+                                                                                 {"operation": "pop", "value": "a"}])
+        reply = self.received(2)[0]
+        self.assertNotIn("value", reply)
+        self.assertNotIn("original_value", reply)
+        for operation in reply["operations"]:
+            value = modify_functions[operation["operation"]](value, operation["value"])
+        self.assertEqual(self.ctx.stored_data["tracker"], value)
+        reply = self.received(3)[0]
+        self.assertEqual({"a": 1}, reply["original_value"])
+        self.assertEqual({"b": 2}, reply["value"])
+        self.assertEqual([], self.received(1))
+
+    async def test_prefixes(self) -> None:
+        """Tests that Get and SetNotify find keys by prefix, including keys that only get set later"""
+        await self.command(2, cmd="SetNotify", prefixes=["slot_"])
+        for key in ("slot_1", "slot_2", "other"):
+            await self.command(1, cmd="Set", key=key, operations=[{"operation": "replace", "value": key}])
+        self.assertEqual(["slot_1", "slot_2"], [reply["key"] for reply in self.received(2)])
+
+        await self.command(1, cmd="Get", keys=["missing"], prefixes=["slot_"])
+        self.assertEqual({"missing": None, "slot_1": "slot_1", "slot_2": "slot_2"}, self.received(1)[0]["keys"])
+
+        await self.command(2, cmd="SetNotify", keys=[], prefixes=["_read_client_status_0_"])
+        self.ctx.on_client_status_change(0, 3)
+        for _ in range(3):
+            await asyncio.sleep(0)
+        self.assertEqual("_read_client_status_0_3", self.received(2)[0]["key"])
+
+    async def test_limits(self) -> None:
+        """Tests that a Set that would exceed the size limits is refused and leaves the value as it was"""
+        self.ctx.datastorage_key_limit = 100
+        await self.command(1, cmd="Set", key="list", default=[], operations=[{"operation": "update", "value": [1]}])
+        await self.command(1, cmd="Set", key="list", default=[], want_reply=True,
+                           operations=[{"operation": "update", "value": list(range(100))}])
+        self.assertEqual("InvalidPacket", self.received(1)[0]["cmd"])
+        self.assertEqual([1], self.ctx.stored_data["list"])
+
+        self.ctx.datastorage_key_limit = 0
+        self.ctx.datastorage_limit = self.ctx.data_storage.total_size + 10
+        await self.command(1, cmd="Set", key="text", operations=[{"operation": "replace", "value": "x" * 20}])
+        self.assertEqual("InvalidPacket", self.received(1)[0]["cmd"])
+        self.assertNotIn("text", self.ctx.stored_data)
+
+    async def test_reply_order(self) -> None:
+        """Tests that a reply sent directly to a client arrives after the broadcasts that were made to it before"""
+        await process_client_cmd(self.ctx, self.clients[1], {"cmd": "Set", "key": "key", "want_reply": True,
+                                                             "operations": [{"operation": "replace", "value": 1}]})
+        await self.command(1, cmd="Get", keys=["key"])
+        self.assertEqual(["SetReply", "Retrieved"], [reply["cmd"] for reply in self.received(1)])
+
+    async def test_limits_are_not_options(self) -> None:
+        """Tests that the size limits set by the host can not be changed like options of the room"""
+        self.ctx.datastorage_limit = 1000
+        self.assertFalse(ServerCommandProcessor(self.ctx)("/option datastorage_limit 0"))
+        self.assertEqual(1000, self.ctx.datastorage_limit)
+
+    async def test_sizes(self) -> None:
+        """Tests that sizes that were not measured when values were set are measured when asked for"""
+        for key, value in (("a", [1]), ("b", "b" * 100), ("a", [1, 2, 3])):
+            await self.command(1, cmd="Set", key=key, operations=[{"operation": "replace", "value": value}])
+        data_storage = self.ctx.data_storage
+        self.assertEqual(data_storage.size_of([1, 2, 3]), data_storage.size("a"))
+        self.assertEqual(data_storage.size("a") + data_storage.size("b"), data_storage.total_size)
+        self.assertEqual(0, data_storage.size("missing"))
+
+
+class TestMetrics(unittest.IsolatedAsyncioTestCase):
+    async def test_format(self) -> None:
+        """Tests that packets and timings are counted and written once per family, labelled by room"""
+        ctx = Context("", 0, "", "", 0, 0, False)
+        client = recording_client(ctx, RecordingSocket())
+        client.team, client.slot, client.auth = 0, 1, True
+        ctx.endpoints.append(client)
+        ctx.clients = {0: {1: [client]}}
+        for cmd in ("Get", "Get", "Nonsense"):
+            await process_client_cmd(ctx, client, {"cmd": cmd, "keys": []})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            ctx.save_filename = os.path.join(temp_dir, "test.apsave")
+            ctx.saving = True
+            self.assertTrue(ctx.save(now=True))
+
+        text = format_metrics([('room "1"', ctx), ("room 2", Context("", 0, "", "", 0, 0, False))])
+        self.assertIn('archipelago_packets_received_total{room="room \\"1\\"",cmd="Get"} 2\n', text)
+        self.assertIn('archipelago_packets_received_total{room="room \\"1\\"",cmd="unknown"} 1\n', text)
+        self.assertIn('archipelago_encode_seconds_count{room="room \\"1\\""} 2\n', text)
+        self.assertIn('archipelago_save_seconds_count{room="room \\"1\\""} 1\n', text)
+        self.assertIn('archipelago_authenticated_clients{room="room \\"1\\""} 1\n', text)
+        self.assertIn('archipelago_clients{room="room 2"} 0\n', text)
+        self.assertEqual(1, text.count("# TYPE archipelago_clients gauge\n"))
+
+
+class TestSaveJournal(unittest.TestCase):
+    save_filename: str
+
+    @override
+    def setUp(self) -> None:
+        self.ctx = Context("", 0, "", "", 0, 0, False)
+        self.ctx.connect_names = {"Player1": (0, 1)}
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.save_filename = self.ctx.save_filename = os.path.join(self.temp_dir.name, "test.apsave")
+        # saves are written by calling save directly instead of starting the auto save thread of init_save
+        self.ctx.saving = True
+
+    @override
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def save(self) -> bool:
+        return self.ctx.save(now=True)
+
+    def read(self) -> bytes:
+        with open(self.save_filename, "rb") as f:
+            return f.read()
+
+    def load(self) -> typing.Dict[str, typing.Any]:
+        return load_save(self.read())
+
+    def change_save(self) -> None:
+        ctx = self.ctx
+        send_items_to(ctx, 0, 1, NetworkItem(10, 1, 1, 0))
+        ctx.location_checks[0, 1].add(1)
+        ctx.client_game_state[0, 1] = 10
+        ctx.client_activity_timers[0, 1] = datetime.datetime.now(datetime.timezone.utc)
+        ctx.stored_data["key"] = [1]
+        ctx.save_journal.mark("stored_data", "key")
+        ctx.random.random()
+
+    def test_changes_are_appended(self) -> None:
+        """Tests that saves after the first only append their changes, which replay to the full save"""
+        self.assertTrue(self.save())
+        size = os.path.getsize(self.save_filename)
+        self.change_save()
+        self.assertTrue(self.save())
+        self.ctx.name_aliases[0, 1] = "Alias"
+        self.assertTrue(self.save())
+
+        data = self.read()
+        self.assertTrue(data.startswith(save_journal_magic))
+        self.assertGreater(len(data), size)
+        self.assertEqual(pickle.loads(pickle.dumps(self.ctx.get_save())), self.load())
+
+    def test_compaction(self) -> None:
+        """Tests that the save gets written in full again once the changes are larger than it"""
+        self.save()
+        for number in range(200):
+            self.ctx.stored_data[f"key{number}"] = "value" * number
+            self.ctx.save_journal.mark("stored_data", f"key{number}")
+            self.save()
+        self.assertLessEqual(self.ctx.save_journal.changes_size, self.ctx.save_journal.snapshot_size)
+        self.assertEqual(self.ctx.stored_data, self.load()["stored_data"])
+
+    def test_interrupted_write(self) -> None:
+        """Tests that the last change is ignored if it was only partially written"""
+        self.save()
+        expected = pickle.loads(pickle.dumps(self.ctx.get_save()))
+        self.change_save()
+        self.save()
+        with open(self.save_filename, "r+b") as f:
+            f.truncate(os.path.getsize(self.save_filename) - 1)
+        self.assertEqual(expected, self.load())
+
+    def test_old_format(self) -> None:
+        """Tests that a save written as a single compressed pickle still loads and gets converted to a journal"""
+        self.change_save()
+        with open(self.save_filename, "wb") as f:
+            f.write(zlib.compress(pickle.dumps(self.ctx.get_save())))
+        self.assertEqual(self.ctx.stored_data, self.load()["stored_data"])
+        self.save()
+        self.assertTrue(self.read().startswith(save_journal_magic))
+
+
+class TestHintIndex(unittest.TestCase):
+    @override
+    def setUp(self) -> None:
+        self.ctx = Context("", 0, "", "", 0, 0, False)
+        self.hints = [Hint(2, 1, 101, 11, False), Hint(3, 1, 102, 12, False), Hint(1, 2, 201, 21, False)]
+        for hint in self.hints:
+            self.ctx.hints[0, hint.finding_player].add(hint)
+            self.ctx.hints[0, hint.receiving_player].add(hint)
+        self.ctx.index_hints()
+
+    def test_get_hint(self) -> None:
+        """Tests that hints are found by team, finding player and location"""
+        self.assertEqual(self.hints[1], self.ctx.get_hint(0, 1, 102))
+        self.assertIsNone(self.ctx.get_hint(0, 2, 102))
+        self.assertIsNone(self.ctx.get_hint(1, 1, 102))
+
+    def test_recheck_location_hints(self) -> None:
+        """Tests that checking a location only updates its hints and reports the slots that have them"""
+        self.ctx.location_checks[0, 1].add(101)
+        changed: typing.Set[typing.Tuple[int, int]] = set()
+        self.ctx.recheck_location_hints(0, 1, {101}, changed)
+
+        self.assertEqual({(0, 1), (0, 2)}, changed)
+        found = self.hints[0]._replace(found=True, status=HintStatus.HINT_FOUND)
+        self.assertEqual(found, self.ctx.get_hint(0, 1, 101))
+        self.assertIn(found, self.ctx.hints[0, 2])
+        self.assertNotIn(self.hints[0], self.ctx.hints[0, 1])
+        self.assertEqual({self.hints[1]}, self.ctx.hints[0, 3])
+
+        changed.clear()
+        self.ctx.recheck_location_hints(0, 1, {103}, changed)
+        self.assertFalse(changed)
+
+    def test_full_recheck(self) -> None:
+        """Tests that a full recheck keeps the index in line with the hints of every slot"""
+        self.ctx.location_checks[0, 2].add(201)
+        self.ctx.recheck_hints()
+        for hints in self.ctx.hints.values():
+            for hint in hints:
+                self.assertEqual(hint, self.ctx.get_hint(0, hint.finding_player, hint.location))
+        hint = self.ctx.get_hint(0, 2, 201)
+        assert hint is not None
+        self.assertTrue(hint.found)
+
+
+class TestEncodedPayloads(unittest.TestCase):
+    @override
+    def setUp(self) -> None:
+        self.ctx = Context("", 0, "", "", 1, 0, False)
+        self.ctx.locations = LocationStore({1: {11: (21, 1, 0), 12: (22, 1, 0)}})
+        self.ctx.player_names = {(0, 1): "Player1"}
+        self.ctx.clients = {0: {1: []}}
+        self.ctx.slot_info = {1: NetworkSlot("Player1", "Archipelago", SlotType.player)}
+        slot_data: typing.Dict[int, typing.Mapping[str, typing.Any]] = {1: {"option": 1}}
+        self.ctx.slot_data = slot_data
+
+    def connected(self, with_slot_data: bool = True) -> typing.Dict[str, typing.Any]:
+        return decode(f"[{get_encoded_connected(self.ctx, 0, 1, with_slot_data)}]")[0]
+
+    def test_connected(self) -> None:
+        """Tests that Connected is assembled from cached parts that follow checks and aliases"""
+        connected = self.connected()
+        self.assertEqual("Connected", connected["cmd"])
+        self.assertEqual([11, 12], connected["missing_locations"])
+        self.assertEqual([], connected["checked_locations"])
+        self.assertEqual("Player1", connected["slot_info"]["1"].name)
+        self.assertEqual({"option": 1}, connected["slot_data"])
+
+        self.ctx.location_checks[0, 1].add(11)
+        self.ctx.name_aliases[0, 1] = "Alias"
+        update_aliases(self.ctx, 0)
+        connected = self.connected(False)
+        self.assertEqual([12], connected["missing_locations"])
+        self.assertEqual([11], connected["checked_locations"])
+        self.assertEqual(1, connected["hint_points"])
+        self.assertEqual("Alias (Player1)", connected["players"][0].alias)
+        self.assertNotIn("slot_data", connected)
+
+    def test_data_package(self) -> None:
+        """Tests that games of a data package are encoded again once their checksum changes"""
+        gamespackage: typing.Dict[str, GamesPackage] = {"Game1": {"checksum": "1", "item_name_to_id": {"Item": 1}},
+                                                        "Game2": {"checksum": "2", "item_name_to_id": {"Item": 2}}}
+        self.ctx.gamespackage = gamespackage
+        self.assertEqual([{"cmd": "DataPackage", "data": {"games": {"Game2": self.ctx.gamespackage["Game2"]}}}],
+                         decode(get_encoded_data_package(self.ctx, ["Game2"])))
+        self.ctx.gamespackage["Game2"] = {"checksum": "3", "item_name_to_id": {"Item": 3}}
+        self.assertEqual({"games": self.ctx.gamespackage},
+                         decode(get_encoded_data_package(self.ctx, ["Game1", "Game2"]))[0]["data"])
+
+
+class TestWorkers(unittest.IsolatedAsyncioTestCase):
+    @override
+    async def asyncSetUp(self) -> None:
+        with socket.socket() as free_socket:
+            free_socket.bind(("127.0.0.1", 0))
+            self.port = free_socket.getsockname()[1]
+        self.ctx = ShardedContext("127.0.0.1", self.port, "", "", 0, 0, False)
+        self.pool = WorkerPool(self.ctx, 2, loglevel="warning")
+        await self.pool
+
+    @override
+    async def asyncTearDown(self) -> None:
+        self.pool.close()
+        await asyncio.wait_for(self.pool.wait_closed(), 10)
+
+    async def connect(self) -> websockets.WebSocketClientProtocol:
+        for _ in range(200):
+            try:
+                return await websockets.connect(f"ws://127.0.0.1:{self.port}")
+            except OSError:
+                # workers are still starting
+                await asyncio.sleep(0.1)
+        self.fail("Workers did not start")
+
+    async def receive(self, client: websockets.WebSocketClientProtocol) -> typing.Dict[str, typing.Any]:
+        data = await client.recv()
+        assert isinstance(data, str)
+        return decode(data)[0]
+
+    async def test_clients_through_workers(self) -> None:
+        """Tests that clients connected to worker processes are served by the context of the server process"""
+        clients = [await self.connect() for _ in range(3)]
+        for client in clients:
+            self.assertEqual("RoomInfo", (await self.receive(client))["cmd"])
+        self.assertEqual(3, len(self.ctx.endpoints))
+
+        await clients[0].send(encode([{"cmd": "GetDataPackage", "games": []}]))
+        self.assertEqual({"cmd": "DataPackage", "data": {"games": {}}}, await self.receive(clients[0]))
+
+        self.ctx.broadcast(self.ctx.endpoints, [{"cmd": "PrintJSON", "data": [{"text": "Hello"}]}])
+        for client in clients:
+            self.assertEqual("Hello", (await self.receive(client))["data"][0]["text"])
+        await clients[0].close()
+        for _ in range(100):
+            if len(self.ctx.endpoints) == 2:
+                break
+            await asyncio.sleep(0.05)
+        self.assertEqual(2, len(self.ctx.endpoints))
+        for client in clients[1:]:
+            await client.close()
+
+
+class TestWorkerLink(unittest.IsolatedAsyncioTestCase):
+    async def test_stalled_worker(self) -> None:
+        """Tests that sending to a worker that stopped reading waits for it and then drops it"""
+        stalled = asyncio.Event()
+
+        async def never_read(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            await stalled.wait()
+            writer.close()
+
+        ipc_server = await asyncio.start_server(never_read, "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection(*ipc_server.sockets[0].getsockname()[:2])
+        link = WorkerLink(Context("", 0, "", "", 0, 0, False), reader, writer)
+        link.stall_timeout = 0.2
+        link.write_buffer_limit = 1024
+        writer.transport.set_write_buffer_limits(link.write_buffer_limit)
+        for _ in range(1000):
+            link.send_encoded([1], "x" * 100_000)
+            await link.drain()
+            if writer.transport.is_closing():
+                break
+        self.assertTrue(writer.transport.is_closing())
+        stalled.set()
+        ipc_server.close()
+        await ipc_server.wait_closed()
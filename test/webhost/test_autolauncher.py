@@ -0,0 +1,47 @@
+import unittest
+from uuid import UUID, uuid4
+
+
+class TestRoomPlacement(unittest.TestCase):
+    def setUp(self) -> None:
+        from WebHostLib import app
+        from WebHostLib.autolauncher import MultiworldInstance
+
+        self.hosters = [MultiworldInstance(app.config, n) for n in range(3)]
+        self.rooms = [uuid4() for _ in range(4)]
+
+    def report(self, hoster_index: int, cpu: float, rooms: dict[UUID, int]) -> None:
+        from WebHostLib.customserver import HosterLoad
+
+        hoster = self.hosters[hoster_index]
+        hoster.room_ids |= rooms.keys()
+        hoster.load = HosterLoad(rooms, cpu, 0)
+
+    def test_least_loaded(self) -> None:
+        """Verify that rooms get started on the hoster with the least load, but never twice."""
+        from WebHostLib.autolauncher import place_room
+
+        self.report(0, 0.2, {self.rooms[0]: 1})
+        self.report(1, 0.05, {self.rooms[1]: 30})
+        self.report(2, 0.05, {self.rooms[2]: 2})
+        place_room(self.hosters, self.rooms[3])
+        self.assertIn(self.rooms[3], self.hosters[2].room_ids)
+        place_room(self.hosters, self.rooms[0])
+        self.assertEqual({self.rooms[0]}, self.hosters[0].room_ids)
+        self.assertNotIn(self.rooms[0], self.hosters[1].room_ids | self.hosters[2].room_ids)
+
+    def test_move_room(self) -> None:
+        """Verify that the busiest room of an overloaded hoster gets moved, if there is a hoster with CPU to spare."""
+        from WebHostLib.autolauncher import pick_room_to_move
+
+        self.report(0, 0.95, {self.rooms[0]: 10, self.rooms[1]: 50})
+        self.report(1, 0.5, {self.rooms[2]: 10})
+        self.report(2, 0.6, {self.rooms[3]: 10})
+        self.assertIsNone(pick_room_to_move(self.hosters))
+
+        self.report(2, 0.1, {self.rooms[3]: 10})
+        self.assertEqual((self.hosters[0], self.rooms[1]), pick_room_to_move(self.hosters))
+
+        # a room alone on a hoster would only take the load with it
+        self.hosters[0].room_ids.discard(self.rooms[0])
+        self.assertIsNone(pick_room_to_move(self.hosters))
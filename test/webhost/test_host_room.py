@@ -191,3 +191,49 @@ class TestHostFakeRoom(TestBase):
         with db_session:
             commands = select(command for command in Command if command.room.id == self.room_id)  # type: ignore
             self.assertNotIn("/help", (command.commandtext for command in commands))
+
+    def test_host_room_own_post_wakeup(self) -> None:
+        """Verify that the autolauncher gets woken up for a command from the owner."""
+        import time
+        from WebHostLib.wakeup import listen
+
+        wakeups = listen("127.0.0.1", 0)
+        assert wakeups
+        wakeups.watch("command")
+        original_address = self.app.config["WAKEUP_ADDRESS"]
+        self.app.config["WAKEUP_ADDRESS"] = wakeups.socket.getsockname()
+        try:
+            with self.app.app_context(), self.app.test_request_context():
+                self.client.post(url_for("host_room", room=self.room_id), data={"cmd": "/help"})
+        finally:
+            self.app.config["WAKEUP_ADDRESS"] = original_address
+
+        received: set[str] = set()
+        for _ in range(100):
+            received |= wakeups.take("command")
+            if received:
+                break
+            time.sleep(0.01)
+        self.assertEqual({self.room_id.hex}, received)
+
+    def test_rooms_to_host(self) -> None:
+        """Verify that only rooms with activity within their timeout get hosted."""
+        from datetime import datetime, timedelta
+        from pony.orm import db_session
+        from WebHostLib.autolauncher import get_rooms_to_host
+        from WebHostLib.models import Room
+
+        with db_session:
+            room: Room = Room.get(id=self.room_id)
+            room.timeout = 60
+            room.last_activity = datetime.utcnow() - timedelta(seconds=60)
+        with db_session:
+            self.assertIn(self.room_id, get_rooms_to_host())
+            self.assertEqual([self.room_id], get_rooms_to_host({self.room_id}))
+            self.assertEqual([], get_rooms_to_host({uuid4()}))
+
+        with db_session:
+            room = Room.get(id=self.room_id)
+            room.last_activity = datetime.utcnow() - timedelta(seconds=66)
+        with db_session:
+            self.assertNotIn(self.room_id, get_rooms_to_host())
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+
+class TestStaticServerData(unittest.TestCase):
+    def test_mapped(self) -> None:
+        """Verify that mapped static server data reads the same as it was built, unpickling only the used games."""
+        from WebHostLib.customserver import get_static_server_data, map_static_server_data, write_static_server_data
+
+        data = get_static_server_data()
+        with TemporaryDirectory(ignore_cleanup_errors=True) as tempdir:
+            path = os.path.join(tempdir, "static_server_data")
+            write_static_server_data(path)
+            mapped = map_static_server_data(path)
+
+            self.assertEqual(set(data), set(mapped))
+            for kind, games in data.items():
+                self.assertEqual(list(games), list(mapped[kind]))
+            self.assertEqual(data["gamespackage"]["Archipelago"], mapped["gamespackage"]["Archipelago"])
+            self.assertIn("Archipelago", mapped["item_name_groups"])
+            self.assertNotIn("Not a Game", mapped["item_name_groups"])
+            self.assertEqual({}, mapped["location_name_groups"].get("Not a Game", {}))
+
+            sections = mapped["gamespackage"]._sections
+            self.assertIsNone(sections.encoded_section("gamespackage:Archipelago"))
+            for game in mapped["gamespackage"]:
+                if game != "Archipelago":
+                    self.assertIsNotNone(sections.encoded_section(f"gamespackage:{game}"))
+
+    def test_context_loads_lazily(self) -> None:
+        """Verify that creating a room context from mapped static server data does not unpickle the data of any game."""
+        from WebHostLib.customserver import WebHostContext, map_static_server_data, write_static_server_data
+
+        async def create_context(static_server_data: dict) -> WebHostContext:
+            return WebHostContext(static_server_data, logging.getLogger("TestStaticServerData"))
+
+        with TemporaryDirectory(ignore_cleanup_errors=True) as tempdir:
+            path = os.path.join(tempdir, "static_server_data")
+            write_static_server_data(path)
+            mapped = map_static_server_data(path)
+            asyncio.run(create_context(mapped))
+
+            sections = mapped["non_hintable_names"]._sections
+            for kind, games in mapped.items():
+                for game in games:
+                    self.assertIsNotNone(sections.encoded_section(f"{kind}:{game}"), f"{kind}:{game}")
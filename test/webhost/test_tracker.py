@@ -103,3 +103,109 @@ class TestTracker(TestBase):
                 self.assertEqual(response.status_code, 200)
             with self.client.open(url_for("api.tracker_slot_data", tracker=self.tracker_uuid)) as response:
                 self.assertEqual(response.status_code, 200)
+
+    def test_tracker_changes(self) -> None:
+        """Verify that the tracker change feed only sends what was saved after the given generation."""
+        from pony.orm import db_session, flush
+        from NetUtils import ClientStatus, NetworkItem
+        from WebHostLib.models import Room, SaveChange
+
+        with db_session:
+            room = Room.get(id=self.room_id)
+            room.multisave = pickle.dumps({})
+            change = SaveChange(room=room, data=pickle.dumps([]))
+            flush()
+            snapshot = change.id
+
+        with self.app.test_request_context():
+            url = url_for("api.tracker_changes", tracker=self.tracker_uuid)
+            with self.client.open(url) as response:
+                data = response.json
+                self.assertEqual(snapshot, data["generation"])
+                self.assertTrue(data["reset"])
+                # the only slot of the seed is a spectator, which only gets listed with the hints of all slots
+                self.assertEqual([], data["player_items_received"])
+                self.assertEqual([{"team": 0, "player": 1, "hints": []}], data["hints"])
+
+            with self.client.open(url, headers={"If-None-Match": response.headers["ETag"]}) as response:
+                self.assertEqual(304, response.status_code)
+
+            with db_session:
+                SaveChange(room=Room.get(id=self.room_id), data=pickle.dumps([
+                    ("extend", "received_items", (0, 1, True), [NetworkItem(3, 4, 1, 0)]),
+                    ("set", "location_checks", (0, 1), {4}),
+                    ("set", "client_game_state", (0, 1), ClientStatus.CLIENT_GOAL),
+                    ("set", "stored_data", "key", 1),
+                ]))
+            with self.client.open(url, query_string={"since": snapshot}) as response:
+                data = response.json
+                self.assertFalse(data["reset"])
+                self.assertLess(snapshot, data["generation"])
+                self.assertEqual([{"team": 0, "player": 1, "items": [[3, 4, 1, 0]]}], data["player_items_received"])
+                self.assertEqual([{"team": 0, "player": 1, "locations": [4]}], data["player_checks_done"])
+                self.assertEqual([], data["hints"])
+                self.assertEqual([{"team": 0, "player": 1, "status": ClientStatus.CLIENT_GOAL}], data["player_status"])
+
+            with self.client.open(url, query_string={"since": data["generation"]}) as response:
+                self.assertFalse(response.json["reset"])
+                self.assertEqual([], response.json["player_items_received"])
+
+            with self.client.open(url, query_string={"since": snapshot - 1}) as response:
+                self.assertTrue(response.json["reset"])
+                self.assertEqual(data["generation"], response.json["generation"])
+
+    def test_room_save_until(self) -> None:
+        """Verify that a room save can be loaded as of a save generation, leaving out the changes saved after it."""
+        from pony.orm import db_session, flush
+        from WebHostLib.customserver import get_room_save
+        from WebHostLib.models import Room, SaveChange
+
+        with db_session:
+            room = Room.get(id=self.room_id)
+            room.multisave = pickle.dumps({"location_checks": {}})
+            first = SaveChange(room=room, data=pickle.dumps([("set", "location_checks", (0, 1), {1})]))
+            SaveChange(room=room, data=pickle.dumps([("set", "location_checks", (0, 1), {1, 2})]))
+            flush()
+            self.assertEqual({(0, 1): {1}}, get_room_save(room, first.id)["location_checks"])
+            self.assertEqual({(0, 1): {1, 2}}, get_room_save(room)["location_checks"])
+
+    def test_cached_tracker_data(self) -> None:
+        """Verify that trackers of the same seed share the decoded multidata and data package tables."""
+        from pony.orm import db_session
+        from WebHostLib.models import Room
+        from WebHostLib.tracker import TrackerData
+
+        with db_session:
+            first = TrackerData(Room.get(id=self.room_id))
+        with db_session:
+            second = TrackerData(Room.get(id=self.room_id))
+        self.assertIs(first._multidata, second._multidata)
+        for game in first._multidata["datapackage"]:
+            self.assertIs(first.item_id_to_name[game], second.item_id_to_name[game])
+            self.assertIs(first.location_name_to_id[game], second.location_name_to_id[game])
+
+    def test_cache_eviction(self) -> None:
+        """Verify that the cache drops the values that were used longest ago once it gets too large."""
+        from WebHostLib.tracker import _SizedLRUCache
+
+        cache = _SizedLRUCache(lambda: 10)
+        for key in ("a", "b", "c"):
+            cache.get(key, lambda: (key.upper(), 4))
+        self.assertEqual(8, cache.size)
+        self.assertEqual("B", cache.get("b", lambda: ("new", 4)))
+        cache.get("d", lambda: ("D", 4))
+        self.assertEqual("B", cache.get("b", lambda: ("new B", 4)))
+        self.assertEqual("new C", cache.get("c", lambda: ("new C", 4)))
+        cache.get("too large", lambda: ("X", 11))
+        self.assertEqual(0, cache.size)
+
+    def test_estimate_size(self) -> None:
+        """Verify that cached values are sized by the memory of everything in them, counting shared objects once."""
+        import sys
+        from WebHostLib.tracker import _estimate_size
+
+        shared = list(range(1000, 1100))
+        value = {"a": shared, "b": (shared, shared)}
+        self.assertLess(sys.getsizeof(shared) * 2, _estimate_size(shared))
+        self.assertEqual(sys.getsizeof(value) + sys.getsizeof("a") + sys.getsizeof("b") + sys.getsizeof(value["b"]) +
+                         _estimate_size(shared), _estimate_size(value))
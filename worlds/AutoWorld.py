@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import concurrent.futures
 import hashlib
 import logging
+import os
 import pathlib
 import sys
 import time
@@ -11,6 +13,7 @@ from typing import (Any, Callable, ClassVar, Dict, FrozenSet, Iterable, List, Ma
                     TYPE_CHECKING, Type, Union)
 
 from Options import item_and_loc_options, ItemsAccessibility, OptionGroup, PerGameCommonOptions
+import Profiling
 from BaseClasses import CollectionState
 from Utils import Version
 
@@ -161,7 +164,13 @@ class WebWorldRegister(type):
 def _timed_call(method: Callable[..., Any], *args: Any,
                 multiworld: Optional["MultiWorld"] = None, player: Optional[int] = None) -> Any:
     start = time.perf_counter()
-    ret = method(*args)
+    if player and multiworld:
+        with Profiling.span(method.__name__, "stage", player, world=method.__qualname__,
+                            player_name=multiworld.player_name[player], game=multiworld.game[player]):
+            ret = method(*args)
+    else:
+        with Profiling.span(method.__qualname__, "stage"):
+            ret = method(*args)
     taken = time.perf_counter() - start
     if taken > 1.0:
         if player and multiworld:
@@ -187,19 +196,78 @@ def call_single(multiworld: "MultiWorld", method_name: str, player: int, *args:
         return ret
 
 
+parallel_stages: FrozenSet[str] = frozenset({"generate_early", "create_regions", "create_items", "set_rules",
+                                             "connect_entrances"})
+"""Steps of generation in which worlds that set World.isolated_generation are run concurrently."""
+
+
+def _check_new_items(multiworld: "MultiWorld", player: int, new_items: List["Item"]) -> None:
+    for i, item in enumerate(new_items):
+        for other in new_items[i+1:]:
+            assert item is not other, (
+                f"Duplicate item reference of \"{item.name}\" in \"{multiworld.worlds[player].game}\" "
+                f"of player \"{multiworld.player_name[player]}\". Please make a copy instead.")
+
+
+def _call_isolated(multiworld: "MultiWorld", method_name: str, players: List[int], *args: Any) -> None:
+    """
+    Runs a step for consecutive players whose worlds only touch their own data concurrently, then restores the order in
+    which they added to the multiworld's shared itempool and indirect connections, so the result is the same as calling
+    them one by one.
+    """
+    prev_item_count = len(multiworld.itempool)
+    prev_indirect_count = len(multiworld.indirect_connections)
+    with concurrent.futures.ThreadPoolExecutor(min(len(players), os.cpu_count() or 1),
+                                               thread_name_prefix=f"World {method_name}") as pool:
+        futures = [pool.submit(call_single, multiworld, method_name, player, *args) for player in players]
+        # re-raise in player order, so the same error is reported no matter which thread finished first
+        for future in futures:
+            future.result()
+
+    player_order = {player: index for index, player in enumerate(players)}
+    new_items = sorted(multiworld.itempool[prev_item_count:], key=lambda item: player_order[item.player])
+    multiworld.itempool[prev_item_count:] = new_items
+    if len(multiworld.indirect_connections) > prev_indirect_count:
+        indirect_connections = list(multiworld.indirect_connections.items())
+        indirect_connections[prev_indirect_count:] = sorted(indirect_connections[prev_indirect_count:],
+                                                            key=lambda pair: player_order[pair[0].player])
+        multiworld.indirect_connections = dict(indirect_connections)
+    if __debug__:
+        for player in players:
+            _check_new_items(multiworld, player, [item for item in new_items if item.player == player])
+
+
+def _call_one(multiworld: "MultiWorld", method_name: str, player: int, *args: Any) -> None:
+    prev_item_count = len(multiworld.itempool)
+    call_single(multiworld, method_name, player, *args)
+    if __debug__:
+        _check_new_items(multiworld, player, multiworld.itempool[prev_item_count:])
+
+
+def _call_batch(multiworld: "MultiWorld", method_name: str, players: List[int], *args: Any) -> None:
+    if len(players) > 1:
+        _call_isolated(multiworld, method_name, players, *args)
+    elif players:
+        _call_one(multiworld, method_name, players[0], *args)
+
+
 def call_all(multiworld: "MultiWorld", method_name: str, *args: Any) -> None:
-    world_types: Set[AutoWorldRegister] = set()
+    with Profiling.span(method_name, "stage"):
+        _call_all(multiworld, method_name, *args)
+
+
+def _call_all(multiworld: "MultiWorld", method_name: str, *args: Any) -> None:
+    # runs of consecutive isolated players are called together and the other players one by one in between them,
+    # so everything is still added to the multiworld in player order
+    batch: List[int] = []
     for player in multiworld.player_ids:
-        prev_item_count = len(multiworld.itempool)
-        world_types.add(multiworld.worlds[player].__class__)
-        call_single(multiworld, method_name, player, *args)
-        if __debug__:
-            new_items = multiworld.itempool[prev_item_count:]
-            for i, item in enumerate(new_items):
-                for other in new_items[i+1:]:
-                    assert item is not other, (
-                        f"Duplicate item reference of \"{item.name}\" in \"{multiworld.worlds[player].game}\" "
-                        f"of player \"{multiworld.player_name[player]}\". Please make a copy instead.")
+        if method_name in parallel_stages and multiworld.worlds[player].isolated_generation:
+            batch.append(player)
+        else:
+            _call_batch(multiworld, method_name, batch, *args)
+            batch = []
+            _call_one(multiworld, method_name, player, *args)
+    _call_batch(multiworld, method_name, batch, *args)
 
     call_stage(multiworld, method_name, *args)
 
@@ -314,6 +382,17 @@ class World(metaclass=AutoWorldRegister):
     If False, everything is rechecked at every step, which is slower computationally, 
     but may be desirable in complex/dynamic worlds."""
 
+    incremental_reachability: bool = False
+    """If True, Entrances that declare Entrance.item_dependencies are only re-evaluated when one of those items has been
+    collected since the last reachability update, instead of on every update.
+    Requires explicit_indirect_conditions and correct use of MultiWorld.register_indirect_condition()."""
+
+    isolated_generation: bool = False
+    """If True, generate_early, create_regions, create_items, set_rules and connect_entrances of this world may run at
+    the same time as those of other isolated worlds, in separate threads.
+    Only set this if these steps only use self.random and only add to or modify this player's own data in the
+    MultiWorld, such as its regions, itempool entries, precollected items and indirect conditions."""
+
     multiworld: "MultiWorld"
     """autoset on creation. The MultiWorld object for the currently generating multiworld."""
     player: int
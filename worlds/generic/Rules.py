@@ -1,4 +1,5 @@
 import collections
+import itertools
 import logging
 import typing
 
@@ -98,20 +99,193 @@ def exclusion_rules(multiworld: MultiWorld, player: int, exclude_locations: typi
 
 def set_rule(spot: typing.Union["BaseClasses.Location", "BaseClasses.Entrance"], rule: CollectionRule):
     spot.access_rule = rule
+    _discard_item_dependencies(spot)
 
 
 def add_rule(spot: typing.Union["BaseClasses.Location", "BaseClasses.Entrance"], rule: CollectionRule, combine="and"):
+    _discard_item_dependencies(spot)
     old_rule = spot.access_rule
     # empty rule, replace instead of add
     if old_rule is Location.access_rule or old_rule is Entrance.access_rule:
         spot.access_rule = rule if combine == "and" else old_rule
     else:
-        if combine == "and":
+        if combine == "and" and isinstance(rule, CompiledRule) and isinstance(old_rule, CompiledRule):
+            # stays compiled, so it can still be evaluated by RuleBatch
+            spot.access_rule = rule & old_rule
+        elif combine == "and":
             spot.access_rule = lambda state: rule(state) and old_rule(state)
         else:
             spot.access_rule = lambda state: rule(state) or old_rule(state)
 
 
+class CompiledRule:
+    """
+    An access rule made only of item counts and Region reachability, which RuleBatch can evaluate for many Locations
+    at once. It is fulfilled if, for each (player, item_names, count) in item_counts, the player has at least count
+    of these items in total, and each of regions can be reached.
+    Build these with has_rule, has_all_rule, has_any_rule, has_group_rule and can_reach_region_rule, and combine them
+    with `&`. Like any other rule, it can be called with a CollectionState.
+    """
+    __slots__ = ("item_counts", "regions")
+
+    item_counts: typing.Tuple[typing.Tuple[int, typing.Tuple[str, ...], int], ...]
+    regions: typing.Tuple[Region, ...]
+
+    def __init__(self, item_counts: typing.Iterable[typing.Tuple[int, typing.Iterable[str], int]] = (),
+                 regions: typing.Iterable[Region] = ()) -> None:
+        self.item_counts = tuple((player, tuple(item_names), count) for player, item_names, count in item_counts)
+        self.regions = tuple(regions)
+
+    def __call__(self, state: "BaseClasses.CollectionState") -> bool:
+        for player, item_names, count in self.item_counts:
+            player_prog_items = state.prog_items[player]
+            found = 0
+            for item_name in item_names:
+                found += player_prog_items[item_name]
+            if found < count:
+                return False
+        for region in self.regions:
+            if not region.can_reach(state):
+                return False
+        return True
+
+    def __and__(self, other: "CompiledRule") -> "CompiledRule":
+        if not isinstance(other, CompiledRule):
+            return NotImplemented
+        return CompiledRule(self.item_counts + other.item_counts, self.regions + other.regions)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.item_counts!r}, {self.regions!r})"
+
+
+def has_rule(item: str, player: int, count: int = 1) -> CompiledRule:
+    """Compiled form of `state.has(item, player, count)`, which also covers `state.count(item, player) >= count`."""
+    return CompiledRule(((player, (item,), count),))
+
+
+def has_all_rule(items: typing.Iterable[str], player: int) -> CompiledRule:
+    """Compiled form of `state.has_all(items, player)`."""
+    return CompiledRule((player, (item,), 1) for item in items)
+
+
+def has_any_rule(items: typing.Iterable[str], player: int) -> CompiledRule:
+    """Compiled form of `state.has_any(items, player)`."""
+    return CompiledRule(((player, items, 1),))
+
+
+def has_group_rule(multiworld: MultiWorld, item_name_group: str, player: int, count: int = 1) -> CompiledRule:
+    """Compiled form of `state.has_group(item_name_group, player, count)`."""
+    return CompiledRule(((player, multiworld.worlds[player].item_name_groups[item_name_group], count),))
+
+
+def can_reach_region_rule(region: Region) -> CompiledRule:
+    """Compiled form of `region.can_reach(state)`."""
+    return CompiledRule(regions=(region,))
+
+
+class RuleBatch:
+    """
+    Finds which of a fixed collection of Locations can be reached in a state. If NumPy is available, the item counts
+    of every CompiledRule access rule are checked together from one array of the state's item counts. Other Locations
+    are checked one by one with Location.can_reach.
+    """
+    _index: typing.Dict[Location, int]
+    """position of each Location with a CompiledRule in the arrays below"""
+    _location_regions: typing.List[typing.Tuple[Region, ...]]
+    _item_keys: typing.Dict[typing.Tuple[int, str], int]
+
+    def __init__(self, locations: typing.Iterable[Location]) -> None:
+        self._index = {}
+        self._location_regions = []
+        # index 0 is an item that is never counted and clause 0 is always fulfilled,
+        # so no clause has to go without items and no Location has to go without clauses
+        self._item_keys = {}
+        clause_items: typing.List[int] = [0]
+        clause_starts: typing.List[int] = [0]
+        thresholds: typing.List[int] = [0]
+        location_clauses: typing.List[int] = []
+        location_clause_starts: typing.List[int] = []
+        try:
+            import numpy
+        except ImportError:
+            self._numpy = None
+            return
+        self._numpy = numpy
+
+        for location in locations:
+            rule = location.access_rule
+            if not isinstance(rule, CompiledRule) or type(location).can_reach is not Location.can_reach \
+                    or not location.parent_region:
+                continue
+            self._index[location] = len(self._location_regions)
+            self._location_regions.append((location.parent_region, *rule.regions))
+            location_clause_starts.append(len(location_clauses))
+            location_clauses.append(0)
+            for player, item_names, count in rule.item_counts:
+                location_clauses.append(len(thresholds))
+                clause_starts.append(len(clause_items))
+                clause_items.append(0)
+                clause_items.extend(self._item_keys.setdefault((player, item_name), len(self._item_keys) + 1)
+                                    for item_name in item_names)
+                thresholds.append(count)
+
+        self._clause_items = numpy.array(clause_items, dtype=numpy.intp)
+        self._clause_starts = numpy.array(clause_starts, dtype=numpy.intp)
+        self._thresholds = numpy.array(thresholds, dtype=numpy.int64)
+        self._location_clauses = numpy.array(location_clauses, dtype=numpy.intp)
+        self._location_clause_starts = numpy.array(location_clause_starts, dtype=numpy.intp)
+
+    def _has_items(self, state: "BaseClasses.CollectionState") -> typing.List[bool]:
+        """Returns for each compiled Location whether the state has the items required by its rule."""
+        numpy = self._numpy
+        prog_items = state.prog_items
+        counts = numpy.fromiter(itertools.chain((0,), (prog_items[player][item_name]
+                                                       for player, item_name in self._item_keys)),
+                                dtype=numpy.int64, count=len(self._item_keys) + 1)
+        fulfilled = numpy.add.reduceat(counts[self._clause_items], self._clause_starts) >= self._thresholds
+        return numpy.logical_and.reduceat(fulfilled[self._location_clauses], self._location_clause_starts).tolist()
+
+    def reachable(self, state: "BaseClasses.CollectionState",
+                  locations: typing.Iterable[Location]) -> typing.List[Location]:
+        """Returns the given Locations that can be reached in state, in the order they were given."""
+        if not self._index:
+            return [location for location in locations if location.can_reach(state)]
+        has_items = self._has_items(state)
+        reachable: typing.List[Location] = []
+        for location in locations:
+            index = self._index.get(location)
+            if index is None:
+                if location.can_reach(state):
+                    reachable.append(location)
+            elif has_items[index]:
+                for region in self._location_regions[index]:
+                    if not region.can_reach(state):
+                        break
+                else:
+                    reachable.append(location)
+        return reachable
+
+
+def set_item_dependencies(entrance: "BaseClasses.Entrance", item_names: typing.Iterable[str]) -> None:
+    """
+    Declare which items of the entrance's player can change the result of its access_rule,
+    allowing worlds with incremental_reachability to skip re-evaluating it until one of them is collected.
+    Rules that also depend on Region reachability still need MultiWorld.register_indirect_condition().
+    Call this after the final rule is set, as set_rule and add_rule discard the declaration.
+
+    entrance: Entrance whose current access_rule only depends on the given items
+    item_names: names of the Items as they are collected,
+        e.g. "Progressive Sword" instead of what collect() turns it into
+    """
+    entrance.item_dependencies = frozenset(item_names)
+
+
+def _discard_item_dependencies(spot: typing.Union["BaseClasses.Location", "BaseClasses.Entrance"]) -> None:
+    # a changed rule may depend on anything, so the previous declaration can no longer be trusted
+    if isinstance(spot, Entrance) and spot.item_dependencies is not None:
+        spot.item_dependencies = None
+
+
 def forbid_item(location: "BaseClasses.Location", item: str, player: int):
     old_rule = location.item_rule
     # empty rule
@@ -35,15 +35,17 @@ def recalculate_reachable_orbs(state: CollectionState, player: int, world: "JakA
 
     # Recalculate every level, every time the cache is stale, because you don't know
     # when a specific bundle of orbs in one level may unlock access to another.
+    # The counts are cached in this state only, as copies of it may reach other regions.
+    prog_items = state.own_prog_items(player)
     accessible_total_orbs = 0
     for level in level_table:
         accessible_level_orbs = count_reachable_orbs_level(state, world, level)
         accessible_total_orbs += accessible_level_orbs
-        state.prog_items[player][f"{level} Reachable Orbs".lstrip()] = accessible_level_orbs
+        prog_items[f"{level} Reachable Orbs".lstrip()] = accessible_level_orbs
 
     # Also recalculate the global count, still used even when Orbsanity is Off.
-    state.prog_items[player]["Reachable Orbs"] = accessible_total_orbs
-    state.prog_items[player]["Reachable Orbs Fresh"] = True
+    prog_items["Reachable Orbs"] = accessible_total_orbs
+    prog_items["Reachable Orbs Fresh"] = True
 
 
 def count_reachable_orbs_global(state: CollectionState,